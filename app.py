@@ -1,7 +1,7 @@
 # app.py
 from flask import Flask, render_template, request, jsonify, send_file, g, Response
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 import os
 import uuid
 from werkzeug.utils import secure_filename
@@ -9,8 +9,10 @@ from datetime import datetime
 import json
 import time
 from database_schema import get_session, UploadedFile, Face
-from celery_tasks import celery_app, process_uploaded_file, search_similar_faces, schedule_batch_processing, process_batch_images_optimized
+from celery_tasks import SEARCH_ALLOWED_BACKENDS, celery_app, process_uploaded_file,search_similar_faces, search_similar_faces_batch, find_faces_similar_to, schedule_batch_processing, process_batch_images_optimized, search_room, progressive_search_faces
 from cache_helper import cache_helper
+from filter_index import SearchFilter
+from search_service import search_service_client, SearchServiceUnavailable, SearchServiceTimeout
 from sqlalchemy import desc
 
 # Configure structured logging and metrics
@@ -75,6 +77,52 @@ ALLOWED_EXTENSIONS = ALLOWED_IMAGE_EXTENSIONS | ALLOWED_VIDEO_EXTENSIONS
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def parse_search_backend(form):
+    """
+    Read the optional search backend from a request form or query string
+    
+    Returns:
+        Backend name, or None to use SEARCH_BACKEND
+    
+    Raises:
+        ValueError: If the backend is unknown or not enabled in SEARCH_ALLOWED_BACKENDS
+    """
+    backend = form.get('backend')
+    if not backend:
+        return None
+    backend = backend.strip().lower()
+    if backend not in SEARCH_ALLOWED_BACKENDS:
+        raise ValueError(f"Unsupported backend '{backend}', expected one of: {', '.join(SEARCH_ALLOWED_BACKENDS)}")
+    return backend
+
+def parse_search_filters(form):
+    """
+    Read optional search filter fields from a request form or query string
+    
+    List fields (file_ids, genders, age_buckets) accept comma-separated values.
+    
+    Returns:
+        Dict of SearchFilter fields, or None when no filter was given
+    
+    Raises:
+        ValueError: If a filter value is invalid
+    """
+    filters = {}
+    for field in ('file_ids', 'genders', 'age_buckets'):
+        if form.get(field):
+            values = [value.strip() for value in form.get(field).split(',') if value.strip()]
+            filters[field] = [int(value) for value in values] if field == 'file_ids' else values
+    for field in ('min_quality', 'max_quality', 'min_timestamp', 'max_timestamp'):
+        if form.get(field):
+            filters[field] = float(form.get(field))
+    for field in ('uploaded_after', 'uploaded_before'):
+        if form.get(field):
+            filters[field] = form.get(field)
+    
+    # Validate here so bad input is a 400 rather than a failed task
+    search_filter = SearchFilter.from_dict(filters)
+    return search_filter.to_dict() if search_filter else None
+
 def get_file_type(filename):
     ext = filename.rsplit('.', 1)[1].lower()
     if ext in ALLOWED_IMAGE_EXTENSIONS:
@@ -187,6 +235,22 @@ def search_faces():
     file = request.files['file']
     threshold = float(request.form.get('threshold', 0.6))
     top_k = int(request.form.get('top_k', 20))
+    try:
+        backend = parse_search_backend(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    all_faces = request.form.get('all_faces', 'false').lower() == 'true'
+    async_mode = request.form.get('async', 'false').lower() == 'true'
+    progressive = request.form.get('progressive', 'false').lower() == 'true'
+    try:
+        filters = parse_search_filters(request.form)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid filters: {str(e)}'}), 400
+    try:
+        time_budget_ms = float(request.form['time_budget_ms']) if request.form.get('time_budget_ms') else None
+        stop_score = float(request.form['stop_score']) if request.form.get('stop_score') else None
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameters: {str(e)}'}), 400
     
     if file and allowed_file(file.filename):
         # Save query image temporarily
@@ -195,21 +259,122 @@ def search_faces():
         os.makedirs(os.path.dirname(query_path), exist_ok=True)
         file.save(query_path)
         
+        if progressive:
+            # Always async: improving top-k sets are pushed while the gallery is scanned
+            task_id = str(uuid.uuid4())
+            progressive_search_faces.apply_async(
+                args=[query_path, threshold, top_k, all_faces, filters, search_room(task_id),
+                      time_budget_ms, stop_score],
+                task_id=task_id
+            )
+            return jsonify({
+                'status': 'pending',
+                'task_id': task_id,
+                'room': search_room(task_id)
+            }), 202
+        
+        if async_mode:
+            # Return at once; the worker pushes progress and the result to the
+            # search's SocketIO room (join it with a 'join_search' event)
+            task_id = str(uuid.uuid4())
+            search_similar_faces.apply_async(
+                args=[query_path, threshold, top_k, backend, all_faces, filters, search_room(task_id)],
+                task_id=task_id
+            )
+            return jsonify({
+                'status': 'pending',
+                'task_id': task_id,
+                'room': search_room(task_id)
+            }), 202
+        
+        # Prefer the warm search service; fall back to a Celery task only if it is down
+        started = time.time()
+        try:
+            result = search_service_client.search(query_path, threshold, top_k, backend, all_faces, filters)
+            return jsonify(result)
+        except SearchServiceTimeout as e:
+            logger.error(f"Search service timed out: {str(e)}")
+            return jsonify({'error': 'Search timed out'}), 504
+        except SearchServiceUnavailable as e:
+            if search_service_client.enabled:
+                logger.warning(f"Search service unavailable, falling back to Celery: {str(e)}")
+        
         # Start search task
         task = search_similar_faces.apply_async(
-            args=[query_path, threshold, top_k]
+            args=[query_path, threshold, top_k, backend, all_faces, filters]
         )
         
-        # Wait for result (with timeout)
+        # Wait for result, counting time already spent trying the service
         try:
-            result = task.get(timeout=30)
+            result = task.get(timeout=max(1.0, 30 - (time.time() - started)))
             return jsonify(result)
         except Exception as e:
             logger.error(f"Search error: {str(e)}")
             return jsonify({'error': 'Search failed'}), 500
-    
+
     return jsonify({'error': 'Invalid file type'}), 400
 
+@app.route('/search/<task_id>', methods=['GET'])
+def get_search_result(task_id):
+    """Poll an async search started with async=true"""
+    task = search_similar_faces.AsyncResult(task_id)
+    if not task.ready():
+        return jsonify({'status': 'pending', 'task_id': task_id, 'state': task.state}), 202
+    if task.failed():
+        return jsonify({'status': 'error', 'task_id': task_id, 'message': str(task.result)}), 500
+    return jsonify(dict(task.result, task_id=task_id))
+
+@app.route('/search-batch', methods=['POST'])
+def search_faces_batch():
+    """Search for faces similar to several query images at once"""
+    if 'files' not in request.files:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'No files selected'}), 400
+    
+    threshold = float(request.form.get('threshold', 0.6))
+    top_k = int(request.form.get('top_k', 20))
+    try:
+        backend = parse_search_backend(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        filters = parse_search_filters(request.form)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid filters: {str(e)}'}), 400
+    
+    query_paths = []
+    query_names = []
+    for file in files:
+        if file and allowed_file(file.filename):
+            # Save query image temporarily
+            query_filename = f"query_{uuid.uuid4()}.jpg"
+            query_path = os.path.join(app.config['UPLOAD_FOLDER'], 'queries', query_filename)
+            os.makedirs(os.path.dirname(query_path), exist_ok=True)
+            file.save(query_path)
+            query_paths.append(query_path)
+            query_names.append(secure_filename(file.filename))
+    
+    if not query_paths:
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    # Start batch search task
+    task = search_similar_faces_batch.apply_async(
+        args=[query_paths, threshold, top_k, backend, filters]
+    )
+    
+    # Wait for result (with timeout scaled to the batch)
+    try:
+        result = task.get(timeout=30 + 2 * len(query_paths))
+        for query in result.get('queries', []):
+            query['filename'] = query_names[query['query_index']]
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Batch search error: {str(e)}")
+        return jsonify({'error': 'Search failed'}), 500
+
 @app.route('/upload-batch', methods=['POST'])
 def upload_batch():
     """Handle batch file upload"""
@@ -338,6 +503,45 @@ def get_file_faces(file_id):
     finally:
         session.close()
 
+@app.route('/faces/<face_id>/similar')
+def get_similar_faces(face_id):
+    """Find faces similar to an existing face using its stored embedding"""
+    try:
+        threshold = float(request.args.get('threshold', 0.6))
+        top_k = int(request.args.get('top_k', 20))
+        backend = parse_search_backend(request.args)
+        filters = parse_search_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameters: {str(e)}'}), 400
+    
+    # Prefer the warm search service, which holds the gallery index
+    try:
+        result = search_service_client.similar(face_id, threshold, top_k, backend, filters)
+    except SearchServiceTimeout as e:
+        logger.error(f"Search service timed out: {str(e)}")
+        return jsonify({'error': 'Search timed out'}), 504
+    except SearchServiceUnavailable as e:
+        if search_service_client.enabled:
+            logger.warning(f"Search service unavailable, ranking similar faces in SQL: {str(e)}")
+        result = None
+    
+    if result is None:
+        session = get_session()
+        try:
+            # Web workers keep no gallery index, so rank in SQL rather than loading one per worker
+            result = find_faces_similar_to(
+                session, face_id, threshold, top_k, 'pgvector', SearchFilter.from_dict(filters)
+            )
+        except Exception as e:
+            logger.error(f"Similar faces error: {str(e)}")
+            return jsonify({'error': 'Search failed'}), 500
+        finally:
+            session.close()
+    
+    if result['status'] == 'error':
+        return jsonify({'error': result['message']}), 404
+    return jsonify(result)
+
 @app.route('/face-image/<face_id>')
 def get_face_image(face_id):
     """Serve face image"""
@@ -371,7 +575,7 @@ def get_stats():
 def get_cache_stats():
     """Get Redis cache statistics"""
     try:
-        cache_stats = cache_helper.get_cache_stats()
+        cache_stats = cache_helper.get_cache_stats(count_keys=True)
         return jsonify({
             'status': 'success',
             'cache_stats': cache_stats
@@ -384,11 +588,12 @@ def get_cache_stats():
 def clear_cache():
     """Clear search cache"""
     try:
-        pattern = request.json.get('pattern', 'search:*') if request.is_json else 'search:*'
+        # Without a pattern, advance the gallery generation instead of deleting keys
+        pattern = request.json.get('pattern') if request.is_json else None
         deleted_count = cache_helper.invalidate_search_cache(pattern)
         return jsonify({
             'status': 'success',
-            'message': f'Cleared {deleted_count} cache entries',
+            'message': f'Cleared {deleted_count} cache entries' if pattern else 'Search cache invalidated',
             'deleted_count': deleted_count
         })
     except Exception as e:
@@ -457,6 +662,20 @@ def health_check():
 def handle_connect():
     emit('connected', {'data': 'Connected to server'})
 
+@socketio.on('join_search')
+def handle_join_search(data):
+    """Subscribe to an async search's progress and result events"""
+    task_id = (data or {}).get('task_id')
+    if not task_id:
+        emit('search_result', {'status': 'error', 'message': 'task_id is required'})
+        return
+    join_room(search_room(task_id))
+    
+    # The search may have finished before the client joined its room
+    task = search_similar_faces.AsyncResult(task_id)
+    if task.successful():
+        emit('search_result', task.result)
+
 @socketio.on('disconnect')
 def handle_disconnect():
     print('Client disconnected')
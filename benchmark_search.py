@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# benchmark_search.py
+"""
+Benchmark the face search backends on synthetic embeddings
+
+Every strategy is scored against exact ground truth from
+FaceProcessor.find_similar_faces, and the report (recall@k, latency
+percentiles, QPS, build time and memory per strategy and gallery size) is
+written as JSON so runs can be diffed:
+
+    python benchmark_search.py --scales 10000,100000 --output bench.json
+    python benchmark_search.py --scales 1000000 --clustered --identities 50000
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+from typing import List, Dict, Tuple, Callable, Iterator
+
+from search_index import EMBEDDING_DIM, EmbeddingIndex, normalize_embeddings, cosine_to_similarity, block_top_k
+from embedding_store import EmbeddingStore
+from quantized_index import QuantizedIndex
+from ivf_index import IVFIndex
+from hnsw_index import HNSWIndex
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+STRATEGIES = ('memory', 'mmap', 'sq8', 'pq', 'ivf', 'hnsw')
+DEFAULT_SCALES = (10000, 100000, 1000000, 5000000)
+
+
+class SyntheticGallery:
+    """
+    Deterministic synthetic gallery of unit-norm embeddings
+
+    Rows are generated chunk by chunk from per-chunk seeds, so every strategy
+    sees identical data without the whole gallery being held in memory.
+    With identities > 0 rows are noisy samples around per-identity centers,
+    which is closer to a real face gallery than uniform random vectors.
+    """
+
+    def __init__(self, size: int, dim: int = EMBEDDING_DIM, identities: int = 0,
+                 noise: float = 0.6, seed: int = 0, chunk_rows: int = 65536):
+        self.size = size
+        self.dim = dim
+        self.identities = identities
+        self.noise = noise
+        self.seed = seed
+        self.chunk_rows = chunk_rows
+        self.centers = None
+        if identities:
+            rng = np.random.default_rng([seed, 1 << 30])
+            self.centers = normalize_embeddings(rng.standard_normal((identities, dim), dtype=np.float32))
+
+    def _perturb(self, rng: np.random.Generator, base: np.ndarray) -> np.ndarray:
+        """Unit vectors around `base` rows, at roughly the same angle for any dim"""
+        noise = rng.standard_normal(base.shape, dtype=np.float32) * (self.noise / np.sqrt(self.dim))
+        return normalize_embeddings(base + noise)
+
+    def chunk(self, chunk_no: int) -> np.ndarray:
+        start = chunk_no * self.chunk_rows
+        rows = min(self.chunk_rows, self.size - start)
+        rng = np.random.default_rng([self.seed, chunk_no])
+        if self.centers is not None:
+            return self._perturb(rng, self.centers[rng.integers(0, self.identities, rows)])
+        return normalize_embeddings(rng.standard_normal((rows, self.dim), dtype=np.float32))
+
+    def iter_chunks(self) -> Iterator[Tuple[int, np.ndarray]]:
+        for chunk_no in range((self.size + self.chunk_rows - 1) // self.chunk_rows):
+            yield chunk_no * self.chunk_rows, self.chunk(chunk_no)
+
+    def face_ids(self, start: int, rows: int) -> List[str]:
+        return [str(row) for row in range(start, start + rows)]
+
+    def sample_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Gather arbitrary gallery rows (regenerating only the chunks they fall in)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.empty((len(rows), self.dim), dtype=np.float32)
+        chunk_nos, offsets = np.divmod(rows, self.chunk_rows)
+        for chunk_no in np.unique(chunk_nos):
+            mask = chunk_nos == chunk_no
+            result[mask] = self.chunk(int(chunk_no))[offsets[mask]]
+        return result
+
+    def queries(self, count: int) -> np.ndarray:
+        """Query embeddings: new noisy samples of gallery rows, like a second photo of a person"""
+        rng = np.random.default_rng([self.seed, 1 << 31])
+        source = self.sample_rows(np.sort(rng.choice(self.size, size=min(count, self.size), replace=False)))
+        return self._perturb(rng, source)
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process (0 when psutil is unavailable)"""
+    if not PSUTIL_AVAILABLE:
+        return 0
+    return psutil.Process().memory_info().rss
+
+
+def directory_bytes(path: str) -> int:
+    """Bytes allocated on disk under a directory (sparse files count only written blocks)"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            stat = os.stat(os.path.join(root, name))
+            total += getattr(stat, 'st_blocks', stat.st_size // 512) * 512
+    return total
+
+
+def ground_truth(gallery: SyntheticGallery, queries: np.ndarray, top_k: int,
+                 method: str = 'find_similar_faces') -> List[List[str]]:
+    """
+    Exact top-k face ids per query
+
+    Args:
+        gallery: Synthetic gallery
+        queries: Query embeddings
+        top_k: Neighbors per query
+        method: 'find_similar_faces' runs FaceProcessor.find_similar_faces over
+            every gallery chunk and merges the chunk top-k lists; 'matrix'
+            computes the same exact scores with one product per chunk (faster)
+
+    Returns:
+        One list of face ids per query, best first
+    """
+    best = [[] for _ in range(len(queries))]
+    if method == 'find_similar_faces':
+        from face_processor import FaceProcessor
+        for start, chunk in gallery.iter_chunks():
+            collection = list(zip(gallery.face_ids(start, len(chunk)), chunk))
+            for i, query in enumerate(queries):
+                # find_similar_faces does not use the model, so no instance is needed
+                hits = FaceProcessor.find_similar_faces(None, query, collection, threshold=0.0, top_k=top_k)
+                best[i] = sorted(best[i] + hits, key=lambda hit: hit[1], reverse=True)[:top_k]
+    elif method == 'matrix':
+        for start, chunk in gallery.iter_chunks():
+            scores = cosine_to_similarity(queries @ chunk.T)
+            keep = block_top_k(scores, top_k)
+            for i, (rows, row_scores) in enumerate(zip(keep, np.take_along_axis(scores, keep, axis=1))):
+                hits = [(str(start + int(row)), float(score)) for row, score in zip(rows, row_scores)]
+                best[i] = sorted(best[i] + hits, key=lambda hit: hit[1], reverse=True)[:top_k]
+    else:
+        raise ValueError(f"Unknown ground truth method: {method}")
+    return [[face_id for face_id, _ in hits] for hits in best]
+
+
+def build_strategy(name: str, gallery: SyntheticGallery, args, workdir: str) -> Tuple[Callable, Callable, Dict]:
+    """
+    Build one search strategy over the gallery
+
+    Returns:
+        (search(query) -> [(face_id, score)], search_batch(queries) or None, info dict)
+    """
+    info = {'params': {}}
+
+    if name == 'memory':
+        index = EmbeddingIndex(initial_capacity=gallery.size)
+        for start, chunk in gallery.iter_chunks():
+            index.add(gallery.face_ids(start, len(chunk)), chunk)
+        info['index_bytes'] = index.matrix.nbytes
+        return (lambda q: index.search(q, 0.0, args.top_k),
+                lambda qs: index.search_batch(qs, 0.0, args.top_k), info)
+
+    if name in ('mmap', 'sq8', 'pq'):
+        store_root = os.path.join(workdir, f'store_{gallery.size}')
+        store = EmbeddingStore(store_root, dim=gallery.dim)
+        if len(store) != gallery.size:
+            store.clear()
+            for start, chunk in gallery.iter_chunks():
+                store.append(gallery.face_ids(start, len(chunk)), chunk)
+        info['disk_bytes'] = directory_bytes(store_root)
+        if name == 'mmap':
+            return (lambda q: store.search(q, 0.0, args.top_k),
+                    lambda qs: store.search_batch(qs, 0.0, args.top_k), info)
+
+        index = QuantizedIndex(name, dim=gallery.dim, rerank_factor=args.rerank_factor,
+                               initial_capacity=gallery.size)
+        rng = np.random.default_rng(args.seed)
+        sample = gallery.sample_rows(np.sort(rng.choice(gallery.size, min(args.train_size, gallery.size), replace=False)))
+        index.train(sample)
+        for _, chunk in gallery.iter_chunks():
+            index.add(chunk)
+        info['index_bytes'] = index.memory_bytes()
+        info['params'] = {'rerank_factor': args.rerank_factor, 'train_size': len(sample)}
+
+        def search_quantized(query):
+            rows, scores = index.search(query, 0.0, args.top_k, full_vectors=store.get_rows)
+            return [(str(int(row)), float(score)) for row, score in zip(rows, scores)]
+        return search_quantized, None, info
+
+    if name == 'ivf':
+        nlist = args.ivf_nlist or max(1, int(4 * np.sqrt(gallery.size)))
+        index = IVFIndex(dim=gallery.dim, nprobe=args.ivf_nprobe)
+        rng = np.random.default_rng(args.seed)
+        sample = gallery.sample_rows(np.sort(rng.choice(gallery.size, min(max(args.train_size, 40 * nlist), gallery.size), replace=False)))
+        index.train(sample, nlist)
+        for start, chunk in gallery.iter_chunks():
+            index.add(gallery.face_ids(start, len(chunk)), chunk)
+        info['index_bytes'] = int(index.list_sizes().sum()) * gallery.dim * 4
+        info['params'] = {'nlist': nlist, 'nprobe': args.ivf_nprobe}
+        return lambda q: index.search(q, 0.0, args.top_k), None, info
+
+    if name == 'hnsw':
+        index = HNSWIndex(dim=gallery.dim, m=args.hnsw_m, ef_construction=args.hnsw_ef_construction,
+                          ef_search=args.hnsw_ef_search, initial_capacity=gallery.size)
+        for start, chunk in gallery.iter_chunks():
+            index.add(gallery.face_ids(start, len(chunk)), chunk)
+        info['index_bytes'] = gallery.size * (gallery.dim * 4 + 2 * args.hnsw_m * 4)
+        info['params'] = {'m': args.hnsw_m, 'ef_construction': args.hnsw_ef_construction,
+                          'ef_search': args.hnsw_ef_search}
+        return lambda q: index.search(q, 0.0, args.top_k), None, info
+
+    raise ValueError(f"Unknown strategy: {name}")
+
+
+def run_strategy(name: str, gallery: SyntheticGallery, queries: np.ndarray,
+                 truth: List[List[str]], args, workdir: str) -> Dict:
+    """Build a strategy, time its queries and score them against the ground truth"""
+    gc.collect()
+    rss_before = rss_bytes()
+    build_start = time.perf_counter()
+    search, search_batch, info = build_strategy(name, gallery, args, workdir)
+    build_seconds = time.perf_counter() - build_start
+    rss_after = rss_bytes()
+
+    # Warm up caches and lazily built structures before timing
+    for query in queries[:min(5, len(queries))]:
+        search(query)
+
+    latencies = []
+    recalls = []
+    for query, expected in zip(queries, truth):
+        query_start = time.perf_counter()
+        hits = search(query)
+        latencies.append(time.perf_counter() - query_start)
+        found = {face_id for face_id, _ in hits[:args.top_k]}
+        recalls.append(len(found.intersection(expected)) / max(len(expected), 1))
+
+    latencies_ms = np.array(latencies) * 1000.0
+    result = {
+        'scale': gallery.size,
+        'strategy': name,
+        'build_seconds': round(build_seconds, 3),
+        'memory_bytes': max(rss_after - rss_before, 0) if PSUTIL_AVAILABLE else None,
+        'index_bytes': info.get('index_bytes'),
+        'disk_bytes': info.get('disk_bytes'),
+        f'recall_at_{args.top_k}': round(float(np.mean(recalls)), 4),
+        'latency_ms': {
+            'p50': round(float(np.percentile(latencies_ms, 50)), 3),
+            'p99': round(float(np.percentile(latencies_ms, 99)), 3),
+            'mean': round(float(latencies_ms.mean()), 3)
+        },
+        'qps': round(len(latencies) / sum(latencies), 1),
+        'params': info['params']
+    }
+
+    if search_batch is not None:
+        batch_start = time.perf_counter()
+        search_batch(queries)
+        result['batch_qps'] = round(len(queries) / (time.perf_counter() - batch_start), 1)
+
+    return result
+
+
+def main(argv: List[str] = None) -> Dict:
+    parser = argparse.ArgumentParser(description='Benchmark face search strategies on synthetic embeddings')
+    parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)), help='Comma-separated gallery sizes')
+    parser.add_argument('--strategies', default=','.join(STRATEGIES), help=f'Comma-separated subset of {",".join(STRATEGIES)}')
+    parser.add_argument('--queries', type=int, default=100, help='Queries per scale')
+    parser.add_argument('--top-k', type=int, default=10, help='k for recall@k')
+    parser.add_argument('--dim', type=int, default=EMBEDDING_DIM, help='Embedding dimension')
+    parser.add_argument('--clustered', action='store_true', help='Draw rows around identity centers instead of uniformly')
+    parser.add_argument('--identities', type=int, default=0, help='Identity count with --clustered (default: scale / 20)')
+    parser.add_argument('--noise', type=float, default=0.6, help='Per-sample noise around identity centers and query sources')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--ground-truth', choices=['find_similar_faces', 'matrix'], default='find_similar_faces',
+                        help="Exact reference: FaceProcessor.find_similar_faces, or the equivalent blocked matrix product")
+    parser.add_argument('--train-size', type=int, default=20000, help='Training sample for sq8/pq/ivf')
+    parser.add_argument('--rerank-factor', type=int, default=10, help='sq8/pq candidates re-ranked per result')
+    parser.add_argument('--ivf-nlist', type=int, default=0, help='IVF lists (0 = 4 * sqrt(scale))')
+    parser.add_argument('--ivf-nprobe', type=int, default=8, help='IVF lists scanned per query')
+    parser.add_argument('--hnsw-m', type=int, default=16, help='HNSW graph degree')
+    parser.add_argument('--hnsw-ef-construction', type=int, default=100, help='HNSW build beam width')
+    parser.add_argument('--hnsw-ef-search', type=int, default=64, help='HNSW search beam width')
+    parser.add_argument('--hnsw-max-rows', type=int, default=200000,
+                        help='Skip HNSW above this scale (graph inserts are pure Python)')
+    parser.add_argument('--workdir', default=None, help='Directory for mmap stores (default: a temporary directory)')
+    parser.add_argument('--output', default='search_benchmark.json', help='JSON report path')
+    args = parser.parse_args(argv)
+
+    scales = [int(scale) for scale in args.scales.split(',') if scale]
+    strategies = [name for name in args.strategies.split(',') if name]
+    unknown = set(strategies) - set(STRATEGIES)
+    if unknown:
+        parser.error(f"Unknown strategies: {sorted(unknown)}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='face_search_bench_')
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'results': []
+    }
+
+    try:
+        for scale in scales:
+            identities = (args.identities or max(scale // 20, 1)) if args.clustered else 0
+            gallery = SyntheticGallery(scale, args.dim, identities, args.noise, args.seed)
+            queries = gallery.queries(args.queries)
+
+            truth_start = time.perf_counter()
+            truth = ground_truth(gallery, queries, args.top_k, args.ground_truth)
+            print(f"[{scale:,}] ground truth ({args.ground_truth}) in {time.perf_counter() - truth_start:.1f}s")
+
+            for name in strategies:
+                if name == 'hnsw' and scale > args.hnsw_max_rows:
+                    report['results'].append({'scale': scale, 'strategy': name,
+                                              'skipped': f'scale above --hnsw-max-rows ({args.hnsw_max_rows})'})
+                    print(f"[{scale:,}] {name:<7} skipped")
+                    continue
+                result = run_strategy(name, gallery, queries, truth, args, workdir)
+                result['identities'] = identities
+                report['results'].append(result)
+                print(f"[{scale:,}] {name:<7} recall@{args.top_k}={result[f'recall_at_{args.top_k}']:.3f} "
+                      f"p50={result['latency_ms']['p50']:.2f}ms p99={result['latency_ms']['p99']:.2f}ms "
+                      f"qps={result['qps']:.0f} build={result['build_seconds']:.1f}s")
+                gc.collect()
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+    return report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
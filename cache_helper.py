@@ -4,11 +4,35 @@ import json
 import hashlib
 import logging
 import os
-from typing import Any, Optional, Dict
+import numpy as np
+from typing import Any, Optional, Dict, List, Tuple
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+# Two-level search cache:
+#   search:qemb:<content hash>  -> detected query faces and their embeddings
+#   search:cand:<scope>:<sig>   -> a deep ranked candidate list per query embedding
+# A candidate list computed with depth SEARCH_CACHE_DEPTH and threshold
+# SEARCH_CACHE_MIN_THRESHOLD answers any request with a smaller top_k or a
+# higher threshold by slicing.
+QUERY_EMBEDDING_CACHE_TTL = int(os.getenv('QUERY_EMBEDDING_CACHE_TTL', 86400))
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 3600))
+SEARCH_CACHE_DEPTH = int(os.getenv('SEARCH_CACHE_DEPTH', 100))
+SEARCH_CACHE_MIN_THRESHOLD = float(os.getenv('SEARCH_CACHE_MIN_THRESHOLD', 0.5))
+SEARCH_CACHE_SIGNATURE_BITS = int(os.getenv('SEARCH_CACHE_SIGNATURE_BITS', 16))
+SEARCH_CACHE_PROBE_BITS = int(os.getenv('SEARCH_CACHE_PROBE_BITS', 2))
+SEARCH_CACHE_MIN_COSINE = float(os.getenv('SEARCH_CACHE_MIN_COSINE', 0.97))
+
+# Gallery generation folded into every ranked-result key. Ingest bumps it, so
+# results computed against an older gallery are never read again and simply
+# expire with their TTL instead of being deleted with KEYS.
+GALLERY_GENERATION_KEY = 'search:meta:generation'
+# Hash of hit/miss/write counters per cache level, maintained on every access
+SEARCH_STATS_KEY = 'search:meta:stats'
+# Hash of per-segment frames/faces counters of a segmented video job
+VIDEO_PROGRESS_KEY = 'video:progress:{job_id}'
+
 class CacheHelper:
     """
     Redis cache helper for face recognition search results and other cached data
@@ -25,8 +49,9 @@ class CacheHelper:
         self.redis_url = redis_url or os.getenv('REDIS_URL', 'redis://localhost:6379/0')
         self.default_ttl = default_ttl
         self.redis_client = None
+        self._signature_planes = {}
         self._connect()
-    
+
     def _connect(self):
         """Connect to Redis"""
         try:
@@ -44,120 +69,280 @@ class CacheHelper:
             self._connect()
         return self.redis_client is not None
     
-    def generate_search_key(self, query_params: Dict) -> str:
+    def get_gallery_generation(self) -> int:
+        """Current gallery generation (0 when unset or Redis is unavailable)"""
+        if not self._ensure_connection():
+            return 0
+        
+        try:
+            return int(self.redis_client.get(GALLERY_GENERATION_KEY) or 0)
+        except Exception as e:
+            logger.error(f"Error reading gallery generation: {str(e)}")
+            return 0
+    
+    def bump_gallery_generation(self) -> int:
         """
-        Generate a cache key for search results
+        Advance the gallery generation after faces are added or removed
         
-        Args:
-            query_params: Dictionary containing search parameters
-            
         Returns:
-            Cache key string
+            The new generation, or 0 if Redis is unavailable
         """
-        # Create a deterministic string from query parameters
-        param_string = json.dumps(query_params, sort_keys=True)
-        cache_key = hashlib.sha256(param_string.encode()).hexdigest()
-        return f"search:{cache_key}"
+        if not self._ensure_connection():
+            return 0
+        
+        try:
+            generation = self.redis_client.incr(GALLERY_GENERATION_KEY)
+            logger.info(f"Gallery generation advanced to {generation}")
+            return generation
+        except Exception as e:
+            logger.error(f"Error bumping gallery generation: {str(e)}")
+            return 0
     
-    def get_cached_search_result(self, query_params: Dict) -> Optional[Dict]:
+    def record_segment_progress(self, job_id: str, segment: int, frames_done: int,
+                                faces_found: int) -> Optional[Dict]:
         """
-        Get cached search result
+        Store one video segment's progress and sum it over all segments of the job
         
         Args:
-            query_params: Dictionary containing search parameters
-            
+            job_id: Id shared by the job's segments (the file processing task id)
+            segment: Segment index
+            frames_done: Video frames of the segment covered so far
+            faces_found: Faces the segment found so far
+        
         Returns:
-            Cached result or None if not found
+            {'frames': total frames covered, 'faces': total faces found}, or None
+            if Redis is unavailable
         """
         if not self._ensure_connection():
             return None
         
+        key = VIDEO_PROGRESS_KEY.format(job_id=job_id)
         try:
-            cache_key = self.generate_search_key(query_params)
-            cached_data = self.redis_client.get(cache_key)
-            
-            if cached_data:
-                result = json.loads(cached_data)
-                logger.info(f"Cache hit for search key: {cache_key}")
-                return result
-            else:
-                logger.info(f"Cache miss for search key: {cache_key}")
-                return None
-                
+            pipe = self.redis_client.pipeline()
+            pipe.hset(key, mapping={f'{segment}:frames': frames_done, f'{segment}:faces': faces_found})
+            pipe.expire(key, self.default_ttl)
+            pipe.hgetall(key)
+            counters = pipe.execute()[-1]
+            totals = {'frames': 0, 'faces': 0}
+            for field, value in counters.items():
+                totals[field.split(':', 1)[1]] += int(value)
+            return totals
         except Exception as e:
-            logger.error(f"Error retrieving cached search result: {str(e)}")
+            logger.error(f"Error recording segment progress: {str(e)}")
             return None
     
-    def cache_search_result(self, query_params: Dict, result: Dict, ttl: int = None) -> bool:
+    def _count(self, field: str):
+        """Increment a search cache counter; failures are ignored"""
+        try:
+            self.redis_client.hincrby(SEARCH_STATS_KEY, field, 1)
+        except Exception:
+            pass
+    
+    def get_query_faces(self, content_hash: str) -> Optional[List[Dict]]:
         """
-        Cache search result
+        Get the cached faces detected in a query image
         
         Args:
-            query_params: Dictionary containing search parameters
-            result: Search result to cache
-            ttl: Time-to-live in seconds (uses default if not specified)
-            
+            content_hash: Hash of the query image bytes
+        
         Returns:
-            True if successfully cached, False otherwise
+            List of {'embedding', 'bbox', 'quality_score'} dicts or None if not cached
+        """
+        faces = self.get_generic_cache(f"search:qemb:{content_hash}")
+        if self.redis_client is not None:
+            self._count('embedding_hits' if faces is not None else 'embedding_misses')
+        return faces
+
+    def cache_query_faces(self, content_hash: str, faces: List[Dict], ttl: int = None) -> bool:
+        """
+        Cache the faces detected in a query image so later searches skip detection
+        
+        Args:
+            content_hash: Hash of the query image bytes
+            faces: List of {'embedding', 'bbox', 'quality_score'} dicts
+            ttl: Time-to-live in seconds (defaults to QUERY_EMBEDDING_CACHE_TTL)
+        """
+        success = self.set_generic_cache(f"search:qemb:{content_hash}", faces,
+                                         ttl=ttl or QUERY_EMBEDDING_CACHE_TTL)
+        if success:
+            self._count('embedding_writes')
+        return success
+
+    def embedding_signatures(self, embedding, probe_bits: int = 0) -> List[str]:
+        """
+        Quantize an embedding to short locality-sensitive signatures
+        
+        Each bit is the sign of the embedding projected on a fixed random
+        hyperplane, so near-identical embeddings (the same face re-encoded)
+        usually share a signature. Extra probes flip the bits whose
+        projections are closest to zero, which catch queries that landed
+        just across a hyperplane.
+        
+        Args:
+            embedding: Query face embedding
+            probe_bits: Number of least-certain bits to flip for extra probes
+        
+        Returns:
+            Hex signature strings, the exact signature first
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        planes = self._signature_planes.get(len(vector))
+        if planes is None:
+            rng = np.random.default_rng(0)
+            planes = rng.standard_normal((SEARCH_CACHE_SIGNATURE_BITS, len(vector))).astype(np.float32)
+            self._signature_planes[len(vector)] = planes
+        
+        projections = planes @ vector
+        bits = projections > 0
+        uncertain = np.argsort(np.abs(projections))[:probe_bits]
+        signatures = []
+        for mask in range(2 ** len(uncertain)):
+            probe = bits.copy()
+            for j, bit in enumerate(uncertain):
+                if mask >> j & 1:
+                    probe[bit] = ~probe[bit]
+            signatures.append(np.packbits(probe).tobytes().hex())
+        return signatures
+    
+    def _candidate_keys(self, embedding, scope: Dict, probe_bits: int = 0) -> List[str]:
+        scope_hash = hashlib.sha256(json.dumps(scope, sort_keys=True).encode()).hexdigest()[:16]
+        return [
+            f"search:cand:g{scope.get('generation', 0)}:{scope_hash}:{signature}"
+            for signature in self.embedding_signatures(embedding, probe_bits)
+        ]
+
+    def get_ranked_candidates(self, embedding, scope: Dict, threshold: float,
+                              top_k: int) -> Optional[List[Tuple[str, float]]]:
+        """
+        Answer a search from a cached candidate list, if it covers the request
+        
+        Args:
+            embedding: Query face embedding
+            scope: Search settings the ranking depends on (backend, filters,
+                gallery generation, ...)
+            threshold: Requested similarity threshold
+            top_k: Requested number of results
+        
+        Returns:
+            List of (face_id, similarity_score) tuples, or None on a miss
         """
         if not self._ensure_connection():
-            return False
+            return None
         
         try:
-            cache_key = self.generate_search_key(query_params)
-            ttl = ttl or self.default_ttl
-            
-            # Add cache metadata
-            cached_result = {
-                'data': result,
-                'cached_at': datetime.utcnow().isoformat(),
-                'ttl': ttl
-            }
-            
-            success = self.redis_client.set(
-                cache_key, 
-                json.dumps(cached_result), 
-                ex=ttl
-            )
+            entries = self.redis_client.mget(self._candidate_keys(embedding, scope, SEARCH_CACHE_PROBE_BITS))
+        except Exception as e:
+            logger.error(f"Error retrieving cached candidates: {str(e)}")
+            return None
+        
+        query = np.asarray(embedding, dtype=np.float32)
+        for cached_entry in entries:
+            if not cached_entry:
+                continue
+            entry = json.loads(cached_entry)
             
-            if success:
-                logger.info(f"Cached search result with key: {cache_key}, TTL: {ttl}s")
+            # Signatures are coarse; only reuse lists computed for a near-identical query
+            cached = np.asarray(entry['embedding'], dtype=np.float32)
+            cosine = float(query @ cached / (np.linalg.norm(query) * np.linalg.norm(cached) or 1.0))
+            if cosine < SEARCH_CACHE_MIN_COSINE:
+                continue
             
-            return success
+            candidates = entry['candidates']
+            # The list holds every match above its threshold when it is shorter than its depth
+            exhaustive = len(candidates) < entry['depth']
+            if threshold < entry['threshold'] or (top_k > entry['depth'] and not exhaustive):
+                continue
             
-        except Exception as e:
-            logger.error(f"Error caching search result: {str(e)}")
-            return False
+            self._count('candidate_hits')
+            return [(face_id, score) for face_id, score in candidates if score >= threshold][:top_k]
+        
+        self._count('candidate_misses')
+        return None
+
+    def cache_ranked_candidates(self, embedding, scope: Dict, candidates: List[Tuple[str, float]],
+                                threshold: float, depth: int, ttl: int = None) -> bool:
+        """
+        Cache a deep ranked candidate list for a query embedding
+        
+        Args:
+            embedding: Query face embedding
+            scope: Search settings the ranking depends on (backend, filters,
+                gallery generation, ...)
+            candidates: (face_id, similarity_score) tuples, best first
+            threshold: Threshold the list was ranked with
+            depth: top_k the list was ranked with
+            ttl: Time-to-live in seconds (defaults to SEARCH_CACHE_TTL)
+        """
+        entry = {
+            'embedding': [round(float(value), 5) for value in embedding],
+            'threshold': threshold,
+            'depth': depth,
+            'candidates': [[face_id, float(score)] for face_id, score in candidates]
+        }
+        success = self.set_generic_cache(self._candidate_keys(embedding, scope)[0], entry,
+                                         ttl=ttl or SEARCH_CACHE_TTL)
+        if success:
+            self._count('candidate_writes')
+        return success
     
-    def invalidate_search_cache(self, pattern: str = "search:*") -> int:
+    def invalidate_search_cache(self, pattern: str = None, batch_size: int = 500) -> int:
         """
         Invalidate cached search results
         
+        Without a pattern this only bumps the gallery generation, which
+        orphans every ranked result in O(1); orphaned keys expire with their
+        TTL. With a pattern, matching keys are deleted in batches found with
+        incremental SCAN so Redis is never blocked by a KEYS call.
+        
         Args:
-            pattern: Redis key pattern to match for deletion
-            
+            pattern: Optional Redis key pattern to delete (e.g. "search:qemb:*")
+            batch_size: Keys per SCAN step and per UNLINK call
+        
         Returns:
             Number of keys deleted
         """
         if not self._ensure_connection():
             return 0
         
-        try:
-            keys = self.redis_client.keys(pattern)
-            if keys:
-                deleted = self.redis_client.delete(*keys)
-                logger.info(f"Invalidated {deleted} cached search results")
-                return deleted
+        if pattern is None:
+            self.bump_gallery_generation()
             return 0
-            
+        
+        try:
+            deleted = 0
+            batch = []
+            for key in self.redis_client.scan_iter(match=pattern, count=batch_size):
+                if key in (GALLERY_GENERATION_KEY, SEARCH_STATS_KEY):
+                    continue
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    deleted += self.redis_client.unlink(*batch)
+                    batch = []
+            if batch:
+                deleted += self.redis_client.unlink(*batch)
+            logger.info(f"Invalidated {deleted} cached search results")
+            return deleted
+        
         except Exception as e:
             logger.error(f"Error invalidating search cache: {str(e)}")
             return 0
     
-    def get_cache_stats(self) -> Dict:
+    def count_search_keys(self, pattern: str = "search:*", batch_size: int = 1000) -> int:
+        """Count cached search keys with incremental SCAN (O(N) but non-blocking)"""
+        if not self._ensure_connection():
+            return 0
+        return sum(1 for _ in self.redis_client.scan_iter(match=pattern, count=batch_size))
+    
+    def get_cache_stats(self, count_keys: bool = False) -> Dict:
         """
         Get cache statistics
         
+        Hit rates come from the counters maintained on every cache access.
+        Key counts need a full SCAN and are only included on request.
+        
+        Args:
+            count_keys: Also count cached search keys with incremental SCAN
+        
         Returns:
             Dictionary containing cache statistics
         """
@@ -166,21 +351,33 @@ class CacheHelper:
         
         try:
             info = self.redis_client.info()
-            search_keys = len(self.redis_client.keys("search:*"))
+            counters = {
+                field: int(value)
+                for field, value in (self.redis_client.hgetall(SEARCH_STATS_KEY) or {}).items()
+            }
+            hits = counters.get('candidate_hits', 0)
+            misses = counters.get('candidate_misses', 0)
             
-            return {
+            stats = {
                 'redis_version': info.get('redis_version', 'unknown'),
                 'used_memory': info.get('used_memory_human', 'unknown'),
                 'connected_clients': info.get('connected_clients', 0),
-                'total_search_keys': search_keys,
+                'gallery_generation': self.get_gallery_generation(),
+                'search_hits': hits,
+                'search_misses': misses,
+                'embedding_hit_rate': self._calculate_hit_rate(
+                    counters.get('embedding_hits', 0),
+                    counters.get('embedding_misses', 0)
+                ),
                 'keyspace_hits': info.get('keyspace_hits', 0),
                 'keyspace_misses': info.get('keyspace_misses', 0),
-                'hit_rate': self._calculate_hit_rate(
-                    info.get('keyspace_hits', 0), 
-                    info.get('keyspace_misses', 0)
-                )
+                'hit_rate': self._calculate_hit_rate(hits, misses)
             }
-            
+            stats.update(counters)
+            if count_keys:
+                stats['total_search_keys'] = self.count_search_keys()
+            return stats
+
         except Exception as e:
             logger.error(f"Error getting cache stats: {str(e)}")
             return {}
@@ -2,17 +2,33 @@
 from celery import Celery
 from celery import current_task
 from celery import group, chord
+from celery.exceptions import Ignore
+from flask_socketio import SocketIO
 import os
 import json
-from database_schema import get_session, UploadedFile, Face
+import uuid
+import tempfile
+from database_schema import get_session, set_vector_search_params, reset_vector_search_params, UploadedFile, Face, HNSW_EF_SEARCH, HNSW_MAX_EF_SEARCH
 from face_processor import FaceProcessor
 from sqlalchemy.orm import Session
-from cache_helper import cache_helper
+from cache_helper import cache_helper, SEARCH_CACHE_DEPTH, SEARCH_CACHE_MIN_THRESHOLD
 from logging_config import configure_logging, get_logger
 from metrics import metrics, TimedOperation
+from search_index import EmbeddingIndex, merge_shard_results, trim_results
+from embedding_store import EmbeddingStore
+from quantized_index import QuantizedIndex, QUANTIZATION_MODES
+from ivf_index import IVFIndex
+from hnsw_index import HNSWIndex
+from filter_index import SearchFilter, AGE_BUCKET_EDGES, AGE_BUCKET_LABELS
+from video_sampler import plan_segments, VIDEO_SAMPLE_FPS
+from face_tracker import merge_segment_tracks, TRACK_MAX_MISSED
+from sqlalchemy import func, and_, or_
+import numpy as np
 import hashlib
+import threading
 from datetime import datetime
 from typing import List, Dict, Tuple
+from collections import OrderedDict
 import time
 
 # Ensure logging is configured for Celery workers
@@ -41,6 +57,692 @@ celery_app.conf.update(
 face_processor = FaceProcessor()
 logger = get_logger(__name__)
 
+# Default similarity search backend: 'memory' (warm in-process index),
+# 'pgvector' (rank in SQL), 'mmap' (scan the shared on-disk embedding store)
+# 'sq8'/'pq' (compressed codes re-ranked against the embedding store)
+# 'ivf' (k-means partitioned index scanning IVF_NPROBE lists), 'hnsw' (in-process graph)
+# or 'sharded' (scatter-gather over SEARCH_SHARDS Celery shard tasks)
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'memory').lower()
+# Backends clients may request; 'sharded' needs workers consuming the search_shard_i queues
+SEARCH_ALLOWED_BACKENDS = [
+    backend.strip().lower()
+    for backend in os.getenv('SEARCH_ALLOWED_BACKENDS', 'memory,pgvector,mmap,sq8,pq,ivf,hnsw,sharded').split(',')
+    if backend.strip()
+]
+
+# Append-only memory-mapped embedding store under EMBEDDINGS_FOLDER, shared by all processes
+EMBEDDING_STORE_ENABLED = os.getenv('EMBEDDING_STORE_ENABLED', 'true').lower() == 'true'
+embedding_store = EmbeddingStore()
+
+# Compressed indexes mirroring the embedding store row-for-row
+QUANTIZED_TRAIN_SIZE = int(os.getenv('QUANTIZED_TRAIN_SIZE', 20000))
+QUANTIZED_MIN_ROWS = int(os.getenv('QUANTIZED_MIN_ROWS', 1000))
+QUANTIZED_RERANK_FACTOR = int(os.getenv('QUANTIZED_RERANK_FACTOR', 10))
+quantized_indexes = {}
+_quantized_lock = threading.Lock()
+
+# Warm in-memory search index, shared by all tasks in this worker process
+search_index = EmbeddingIndex()
+_search_index_lock = threading.Lock()
+_search_index_last_row_id = 0
+_search_index_checked_at = 0.0
+
+# Index refreshes follow faces.id, but ids are assigned before commit: re-check this
+# many ids below the watermark for rows that committed late, and every
+# INDEX_RECONCILE_SECONDS compare the face count to catch older gaps and deletions
+INDEX_REFRESH_LOOKBACK = int(os.getenv('INDEX_REFRESH_LOOKBACK', 1000))
+INDEX_RECONCILE_SECONDS = float(os.getenv('INDEX_RECONCILE_SECONDS', 60))
+
+# Inverted-file index; centroids are shared on disk, posting lists are per process
+IVF_NLIST = int(os.getenv('IVF_NLIST', 0))  # 0 = 4 * sqrt(faces) at training time
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', 8))
+IVF_TRAIN_SIZE = int(os.getenv('IVF_TRAIN_SIZE', 50000))
+IVF_CENTROIDS_PATH = os.path.join(embedding_store.root, 'ivf_centroids.npy')
+ivf_index = None
+_ivf_lock = threading.Lock()
+_ivf_last_row_id = 0
+_ivf_checked_at = 0.0
+_ivf_centroids_mtime = None
+
+# In-process HNSW graph, checkpointed under EMBEDDINGS_FOLDER so workers start warm
+HNSW_INDEX_M = int(os.getenv('HNSW_INDEX_M', 16))
+HNSW_INDEX_EF_CONSTRUCTION = int(os.getenv('HNSW_INDEX_EF_CONSTRUCTION', 100))
+HNSW_INDEX_EF_SEARCH = int(os.getenv('HNSW_INDEX_EF_SEARCH', 64))
+HNSW_SAVE_INTERVAL = int(os.getenv('HNSW_SAVE_INTERVAL', 10000))  # inserts between checkpoints
+HNSW_INDEX_PATH = os.path.join(embedding_store.root, 'hnsw_index.npz')
+hnsw_index = None
+_hnsw_lock = threading.RLock()
+_hnsw_last_row_id = 0
+_hnsw_checked_at = 0.0
+_hnsw_unsaved = 0
+
+# Scatter-gather search: faces are split by faces.id % SEARCH_SHARDS and each
+# worker keeps the shards it serves warm. Shard i is routed to queue
+# 'search_shard_i' so it can be pinned to specific workers; without pinning
+# (SEARCH_SHARD_QUEUES=false) every worker ends up loading every shard.
+SEARCH_SHARDS = int(os.getenv('SEARCH_SHARDS', 4))
+SEARCH_SHARD_QUEUES = os.getenv('SEARCH_SHARD_QUEUES', 'true').lower() == 'true'
+SHARDED_SEARCH_TIMEOUT = int(os.getenv('SHARDED_SEARCH_TIMEOUT', 30))
+shard_indexes = {}
+_shard_lock = threading.Lock()
+
+# Progressive search: scan the embedding store in chunks, pushing the running top-k
+PROGRESSIVE_SEARCH_CHUNK_ROWS = int(os.getenv('PROGRESSIVE_SEARCH_CHUNK_ROWS', 16384))
+PROGRESSIVE_SEARCH_EMIT_INTERVAL_MS = float(os.getenv('PROGRESSIVE_SEARCH_EMIT_INTERVAL_MS', 50))
+PROGRESSIVE_SEARCH_TIME_BUDGET_MS = float(os.getenv('PROGRESSIVE_SEARCH_TIME_BUDGET_MS', 2000))
+PROGRESSIVE_SEARCH_STOP_SCORE = float(os.getenv('PROGRESSIVE_SEARCH_STOP_SCORE', 0))  # 0 = never stop on score
+
+# Videos are sampled every VIDEO_FRAME_INTERVAL frames (unless VIDEO_SAMPLE_FPS is set);
+# videos longer than VIDEO_SEGMENT_SECONDS are split into segments processed in parallel
+VIDEO_FRAME_INTERVAL = 30
+# Segment workers stage their faces here (on storage shared by all workers) for the merge
+VIDEO_STAGING_FOLDER = os.getenv('VIDEO_STAGING_FOLDER', './data/processed/staging')
+
+# Write-only SocketIO client: workers publish search events through the Redis
+# message queue and the web process delivers them to the client's room
+_search_events = None
+_search_events_lock = threading.Lock()
+
+def search_room(task_id: str) -> str:
+    """SocketIO room receiving the events of an async search"""
+    return f"search:{task_id}"
+
+def emit_search_event(room: str, event: str, data: Dict):
+    """
+    Push an async search event to a SocketIO room
+    
+    Args:
+        room: Room to emit to (no-op when None)
+        event: 'search_progress' for partial results, 'search_result' for the final one
+        data: Event payload
+    """
+    global _search_events
+    if not room:
+        return
+    try:
+        with _search_events_lock:
+            if _search_events is None:
+                _search_events = SocketIO(message_queue=os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        _search_events.emit(event, data, to=room)
+    except Exception as e:
+        logger.warning(f"Failed to emit {event} to {room}: {str(e)}")
+
+def finish_search(result: Dict, room: str = None) -> Dict:
+    """Push a final search result to the async search room and return it"""
+    emit_search_event(room, 'search_result', result)
+    return result
+
+def _coerce_embedding(embedding):
+    """Return an embedding as a list/array regardless of how it was stored"""
+    return json.loads(embedding) if isinstance(embedding, str) else embedding
+
+def iter_new_face_batches(session: Session, after_row_id: int, batch_size: int = 10000,
+                          shard: Tuple[int, int] = None, with_attributes: bool = False):
+    """
+    Stream face embeddings added after a given faces.id watermark
+    
+    Args:
+        session: Database session
+        after_row_id: Only rows with a larger faces.id are returned
+        batch_size: Maximum faces per yielded batch
+        shard: Optional (shard_id, num_shards) to only return faces with
+            faces.id % num_shards == shard_id
+        with_attributes: Also yield the filterable attributes of every face
+        
+    Yields:
+        (last_row_id, face_ids, embeddings) tuples in id order, or
+        (last_row_id, face_ids, embeddings, attributes) with with_attributes
+    """
+    query = _face_rows_query(session, shard, with_attributes).filter(Face.id > after_row_id)
+    yield from _batch_face_rows(query.order_by(Face.id).yield_per(batch_size), after_row_id,
+                                batch_size, with_attributes)
+
+def iter_face_batches_by_id(session: Session, face_ids: List[str], batch_size: int = 10000,
+                            with_attributes: bool = False):
+    """
+    Stream the embeddings of specific faces, batched like iter_new_face_batches
+    
+    Yields:
+        The same tuples as iter_new_face_batches, in id order within each batch
+    """
+    for start in range(0, len(face_ids), batch_size):
+        query = _face_rows_query(session, None, with_attributes).filter(
+            Face.face_id.in_(face_ids[start:start + batch_size])
+        )
+        yield from _batch_face_rows(query.order_by(Face.id).all(), 0, batch_size, with_attributes)
+
+def _face_rows_query(session: Session, shard: Tuple[int, int] = None, with_attributes: bool = False):
+    columns = [Face.id, Face.face_id, Face.embedding]
+    if with_attributes:
+        columns += [Face.file_id, UploadedFile.upload_time, Face.quality_score,
+                    Face.timestamp, Face.gender, Face.age]
+    query = session.query(*columns)
+    if with_attributes:
+        query = query.outerjoin(UploadedFile, Face.file_id == UploadedFile.id)
+    if shard is not None:
+        shard_id, num_shards = shard
+        query = query.filter(Face.id % num_shards == shard_id)
+    return query
+
+def _batch_face_rows(rows, after_row_id: int, batch_size: int, with_attributes: bool):
+    last_row_id = after_row_id
+    face_ids, embeddings, attributes = [], [], []
+    for row in rows:
+        row_id, face_id, embedding = row[:3]
+        last_row_id = row_id
+        if embedding is not None:
+            face_ids.append(face_id)
+            embeddings.append(_coerce_embedding(embedding))
+            if with_attributes:
+                file_id, upload_time, quality_score, timestamp, gender, age = row[3:]
+                attributes.append({
+                    'file_id': file_id,
+                    'upload_time': upload_time,
+                    'quality_score': quality_score,
+                    'timestamp': timestamp,
+                    'gender': gender,
+                    'age': age
+                })
+        
+        if len(face_ids) >= batch_size:
+            yield (last_row_id, face_ids, embeddings, attributes) if with_attributes else (last_row_id, face_ids, embeddings)
+            face_ids, embeddings, attributes = [], [], []
+    
+    if face_ids or last_row_id != after_row_id:
+        yield (last_row_id, face_ids, embeddings, attributes) if with_attributes else (last_row_id, face_ids, embeddings)
+
+def sync_face_index(session: Session, index, last_row_id: int, checked_at: float, add,
+                    batch_size: int = 10000, shard: Tuple[int, int] = None,
+                    with_attributes: bool = False) -> Tuple[int, float, int]:
+    """
+    Bring a face index up to date with the faces table
+    
+    Rows past the watermark are added in id order. Rows up to
+    INDEX_REFRESH_LOOKBACK ids below the old watermark are re-checked for
+    faces that committed after a higher id moved the watermark past them.
+    Every INDEX_RECONCILE_SECONDS the committed face count is compared with
+    the index; on a mismatch the face ids are compared in full, adding
+    faces still missing and removing deleted ones.
+    
+    Args:
+        session: Database session
+        index: Index with __contains__, face_ids and remove()
+        last_row_id: faces.id watermark of the index
+        checked_at: When the face count was last compared
+        add: Called with the face_ids, embeddings (and attributes with
+            with_attributes) of each batch to insert; returns faces inserted
+        batch_size: Number of rows to fetch and add at a time
+        shard: Optional (shard_id, num_shards) the index holds
+        with_attributes: Pass filterable attributes to add
+        
+    Returns:
+        (new watermark, new checked_at, faces added or removed)
+    """
+    changed = 0
+    previous_row_id = last_row_id
+    for batch in iter_new_face_batches(session, last_row_id, batch_size, shard, with_attributes):
+        changed += add(*batch[1:])
+        last_row_id = batch[0]
+    
+    def committed_ids(low_row_id: int = None):
+        query = session.query(Face.id, Face.face_id).filter(Face.embedding.isnot(None))
+        if low_row_id is not None:
+            query = query.filter(Face.id > low_row_id, Face.id <= last_row_id)
+        if shard is not None:
+            shard_id, num_shards = shard
+            query = query.filter(Face.id % num_shards == shard_id)
+        return query.all()
+    
+    # Late commits just below the watermark (below the new one on a first load)
+    window_top = previous_row_id or last_row_id
+    missing = [face_id for _, face_id in committed_ids(window_top - INDEX_REFRESH_LOOKBACK)
+               if face_id not in index]
+    deleted = []
+    
+    now = time.time()
+    if now - checked_at >= INDEX_RECONCILE_SECONDS:
+        checked_at = now
+        count_query = session.query(func.count(Face.id)).filter(Face.embedding.isnot(None))
+        if shard is not None:
+            count_query = count_query.filter(Face.id % shard[1] == shard[0])
+        if count_query.scalar() != len(index) + len(missing):
+            rows = committed_ids()
+            committed = {face_id for _, face_id in rows}
+            missing = [face_id for row_id, face_id in rows if row_id <= last_row_id and face_id not in index]
+            deleted = [face_id for face_id in list(index.face_ids) if face_id not in committed]
+    
+    for batch in iter_face_batches_by_id(session, missing, batch_size, with_attributes):
+        changed += add(*batch[1:])
+    if deleted:
+        changed += index.remove(deleted)
+    if missing or deleted:
+        logger.info("Reconciled face index", added=len(missing), removed=len(deleted), shard=shard)
+    return last_row_id, checked_at, changed
+
+def get_search_index(session: Session, batch_size: int = 10000) -> EmbeddingIndex:
+    """
+    Return the warm search index, loading any faces added since the last call
+    
+    Args:
+        session: Database session used to fetch new face rows
+        batch_size: Number of rows to fetch and index at a time
+        
+    Returns:
+        The process-wide EmbeddingIndex
+    """
+    global _search_index_last_row_id, _search_index_checked_at
+    
+    with _search_index_lock:
+        _search_index_last_row_id, _search_index_checked_at, _ = sync_face_index(
+            session, search_index, _search_index_last_row_id, _search_index_checked_at,
+            search_index.add, batch_size, with_attributes=True
+        )
+    
+    return search_index
+
+def get_shard_index(session: Session, shard_id: int, num_shards: int,
+                    batch_size: int = 10000) -> EmbeddingIndex:
+    """
+    Return this worker's warm index for one search shard, loading new faces
+    
+    Args:
+        session: Database session used to fetch new face rows
+        shard_id: Shard number
+        num_shards: Total number of shards
+        batch_size: Number of rows to fetch and index at a time
+        
+    Returns:
+        EmbeddingIndex holding the shard's faces
+    """
+    with _shard_lock:
+        entry = shard_indexes.get((shard_id, num_shards))
+        if entry is None:
+            entry = {'index': EmbeddingIndex(), 'last_row_id': 0, 'checked_at': 0.0, 'lock': threading.Lock()}
+            shard_indexes[(shard_id, num_shards)] = entry
+    
+    with entry['lock']:
+        entry['last_row_id'], entry['checked_at'], _ = sync_face_index(
+            session, entry['index'], entry['last_row_id'], entry['checked_at'], entry['index'].add,
+            batch_size, shard=(shard_id, num_shards), with_attributes=True
+        )
+    
+    return entry['index']
+
+def train_ivf_centroids(session: Session, nlist: int = None, sample_size: int = None) -> IVFIndex:
+    """
+    Train IVF centroids on a random sample of faces and save them for all workers
+    
+    Args:
+        session: Database session
+        nlist: Number of posting lists (defaults to IVF_NLIST or 4 * sqrt(faces))
+        sample_size: Number of faces to train on (defaults to IVF_TRAIN_SIZE)
+        
+    Returns:
+        Trained, empty IVFIndex
+    """
+    total_faces = session.query(Face).count()
+    nlist = nlist or IVF_NLIST or max(1, int(4 * np.sqrt(total_faces)))
+    sample_size = max(sample_size or IVF_TRAIN_SIZE, nlist)
+    
+    rows = (
+        session.query(Face.embedding)
+        .filter(Face.embedding.isnot(None))
+        .order_by(func.random())
+        .limit(sample_size)
+        .all()
+    )
+    sample = [_coerce_embedding(embedding) for (embedding,) in rows]
+    if len(sample) < nlist:
+        raise ValueError(f"Need at least {nlist} faces to train {nlist} IVF lists, found {len(sample)}")
+    
+    index = IVFIndex(nprobe=IVF_NPROBE)
+    index.train(sample, nlist)
+    index.save_centroids(IVF_CENTROIDS_PATH)
+    logger.info("Trained IVF centroids", nlist=nlist, sample_size=len(sample))
+    return index
+
+def get_ivf_index(session: Session, batch_size: int = 10000):
+    """
+    Return the warm IVF index, assigning faces added since the last call
+    
+    Centroids are shared through IVF_CENTROIDS_PATH; when another process
+    retrains them, this worker reloads and reassigns its posting lists.
+    They are never trained here: k-means over IVF_TRAIN_SIZE rows would
+    stall the search and every other search waiting on the lock. Train them
+    with `cli_tool.py retrain-ivf` (the retrain_ivf_index task).
+    
+    Args:
+        session: Database session used to fetch new face rows
+        batch_size: Number of rows to fetch and assign at a time
+        
+    Returns:
+        IVFIndex, or None if no centroids have been trained yet
+    """
+    global ivf_index, _ivf_last_row_id, _ivf_checked_at, _ivf_centroids_mtime
+    
+    with _ivf_lock:
+        if not os.path.exists(IVF_CENTROIDS_PATH):
+            return None
+        
+        mtime = os.path.getmtime(IVF_CENTROIDS_PATH)
+        if ivf_index is None or mtime != _ivf_centroids_mtime:
+            ivf_index = IVFIndex.from_centroids_file(IVF_CENTROIDS_PATH, nprobe=IVF_NPROBE)
+            _ivf_last_row_id = 0
+            _ivf_checked_at = 0.0
+            _ivf_centroids_mtime = mtime
+        
+        _ivf_last_row_id, _ivf_checked_at, _ = sync_face_index(
+            session, ivf_index, _ivf_last_row_id, _ivf_checked_at,
+            lambda face_ids, embeddings: _add_new_faces(ivf_index, face_ids, embeddings), batch_size
+        )
+        
+        return ivf_index
+
+def _add_new_faces(index, face_ids: List[str], embeddings: List) -> int:
+    """Add faces not yet in an ANN index; save_face_to_db inserts some directly"""
+    new = [(face_id, embedding) for face_id, embedding in zip(face_ids, embeddings) if face_id not in index]
+    if not new:
+        return 0
+    return index.add([face_id for face_id, _ in new], [embedding for _, embedding in new])
+
+def _new_hnsw_index() -> HNSWIndex:
+    return HNSWIndex(m=HNSW_INDEX_M, ef_construction=HNSW_INDEX_EF_CONSTRUCTION,
+                     ef_search=HNSW_INDEX_EF_SEARCH)
+
+def save_hnsw_index():
+    """Checkpoint the HNSW graph together with its faces.id watermark"""
+    global _hnsw_unsaved
+    
+    with _hnsw_lock:
+        if hnsw_index is None:
+            return
+        hnsw_index.metadata['last_row_id'] = _hnsw_last_row_id
+        hnsw_index.save(HNSW_INDEX_PATH)
+        _hnsw_unsaved = 0
+
+def get_hnsw_index(session: Session, batch_size: int = 1000):
+    """
+    Return the warm HNSW graph, inserting faces added since the last call
+    
+    The first call loads the checkpoint written by `cli_tool.py build-hnsw`
+    from HNSW_INDEX_PATH and only inserts rows newer than its watermark.
+    The graph is never built here: inserts are far too slow to build a
+    gallery-sized graph inside a search.
+    
+    Args:
+        session: Database session used to fetch new face rows
+        batch_size: Number of rows to fetch and insert at a time
+        
+    Returns:
+        The process-wide HNSWIndex, or None if no checkpoint has been built yet
+    """
+    global hnsw_index, _hnsw_last_row_id, _hnsw_checked_at, _hnsw_unsaved
+    
+    with _hnsw_lock:
+        if hnsw_index is None:
+            if not os.path.exists(HNSW_INDEX_PATH):
+                return None
+            hnsw_index = HNSWIndex.load(HNSW_INDEX_PATH)
+            hnsw_index.ef_search = HNSW_INDEX_EF_SEARCH
+            _hnsw_last_row_id = int(hnsw_index.metadata.get('last_row_id', 0))
+            _hnsw_checked_at = 0.0
+            logger.info("Loaded HNSW index", faces=len(hnsw_index), last_row_id=_hnsw_last_row_id)
+        
+        _hnsw_last_row_id, _hnsw_checked_at, changed = sync_face_index(
+            session, hnsw_index, _hnsw_last_row_id, _hnsw_checked_at,
+            lambda face_ids, embeddings: _add_new_faces(hnsw_index, face_ids, embeddings), batch_size
+        )
+        _hnsw_unsaved += changed
+        
+        if _hnsw_unsaved>= HNSW_SAVE_INTERVAL:
+            save_hnsw_index()
+        
+        return hnsw_index
+
+def build_hnsw_index(session: Session, batch_size: int = 1000) -> HNSWIndex:
+    """
+    Build a fresh HNSW graph from the faces table and checkpoint it
+    
+    Args:
+        session: Database session
+        batch_size: Number of rows to fetch and insert at a time
+        
+    Returns:
+        The new process-wide HNSWIndex
+    """
+    global hnsw_index, _hnsw_last_row_id, _hnsw_checked_at, _hnsw_unsaved
+    
+    with _hnsw_lock:
+        hnsw_index = _new_hnsw_index()
+        _hnsw_last_row_id = 0
+        _hnsw_checked_at = 0.0
+        _hnsw_unsaved = 0
+        get_hnsw_index(session, batch_size)
+        save_hnsw_index()
+        return hnsw_index
+
+def _add_to_live_indexes(face_data: dict):
+    """Insert a newly saved face into this process's loaded ANN indexes"""
+    global _hnsw_unsaved
+    
+    embedding = face_data.get('embedding')
+    if embedding is None:
+        return
+    
+    if ivf_index is not None:
+        with _ivf_lock:
+            ivf_index.add([face_data['face_id']], [embedding])
+    
+    if hnsw_index is not None:
+        with _hnsw_lock:
+            hnsw_index.add([face_data['face_id']], [embedding])
+            _hnsw_unsaved += 1
+
+def append_faces_to_store(faces: List[Dict]):
+    """
+    Append newly saved faces to the shared embedding store
+    
+    Failures are logged rather than raised; the store can be rebuilt from
+    the database with the CLI 'rebuild-store' command.
+    """
+    if not EMBEDDING_STORE_ENABLED or not faces:
+        return
+    
+    try:
+        embedding_store.append(
+            [face['face_id'] for face in faces],
+            [face['embedding'] for face in faces]
+        )
+    except Exception as e:
+        logger.error(f"Error appending faces to embedding store: {str(e)}")
+
+def rebuild_embedding_store(session: Session, batch_size: int = 10000) -> int:
+    """
+    Rebuild the embedding store from the faces table
+    
+    Args:
+        session: Database session
+        batch_size: Number of rows to fetch and append at a time
+        
+    Returns:
+        Number of embeddings written
+    """
+    embedding_store.clear()
+    
+    rows = (
+        session.query(Face.face_id, Face.embedding)
+        .filter(Face.embedding.isnot(None))
+        .order_by(Face.id)
+        .yield_per(batch_size)
+    )
+    
+    total = 0
+    face_ids, embeddings = [], []
+    for face_id, embedding in rows:
+        face_ids.append(face_id)
+        embeddings.append(_coerce_embedding(embedding))
+        if len(face_ids) >= batch_size:
+            total += embedding_store.append(face_ids, embeddings)
+            face_ids, embeddings = [], []
+    
+    if face_ids:
+        total += embedding_store.append(face_ids, embeddings)
+    
+    return total
+
+def get_quantized_index(mode: str):
+    """
+    Return the compressed index for a quantization mode, synced with the embedding store
+    
+    The quantizer is trained on an evenly spaced sample of the store the first
+    time it is needed (and again after the store is rebuilt); later calls only
+    encode rows appended since the previous call.
+    
+    Args:
+        mode: 'sq8' or 'pq'
+        
+    Returns:
+        QuantizedIndex, or None if the store is too small to train on
+    """
+    with _quantized_lock:
+        store_size = len(embedding_store)
+        epoch = embedding_store.epoch
+        entry = quantized_indexes.get(mode)
+        
+        if entry is None or entry[1] != epoch:
+            if store_size < QUANTIZED_MIN_ROWS:
+                return None
+            index = QuantizedIndex(mode, rerank_factor=QUANTIZED_RERANK_FACTOR)
+            sample_rows = np.unique(np.linspace(0, store_size - 1, min(QUANTIZED_TRAIN_SIZE, store_size)).astype(np.int64))
+            index.train(embedding_store.get_rows(sample_rows))
+            entry = (index, epoch)
+            quantized_indexes[mode] = entry
+            logger.info("Trained quantized index", mode=mode, sample_size=len(sample_rows))
+        
+        index = entry[0]
+        for _, chunk in embedding_store.iter_chunks(start_row=len(index), end_row=store_size):
+            index.add(chunk)
+    
+    return index
+
+def search_faces_quantized(mode: str, query_embedding, threshold: float = 0.6,
+                           top_k: int = 20, rerank_factor: int = None) -> List[Tuple[str, float]]:
+    """
+    Scan compressed codes for candidates and re-rank them exactly
+    
+    Args:
+        mode: 'sq8' or 'pq'
+        query_embedding: Query face embedding
+        threshold: Similarity threshold (0-1)
+        top_k: Return top k results
+        rerank_factor: Candidates re-ranked per requested result
+        
+    Returns:
+        List of (face_id, similarity_score) tuples, best first
+    """
+    index = get_quantized_index(mode)
+    if index is None:
+        # Too few faces to train a quantizer; an exact scan is cheap anyway
+        return embedding_store.search(query_embedding, threshold, top_k)
+    
+    rows, scores = index.search(
+        query_embedding, threshold, top_k,
+        full_vectors=embedding_store.get_rows,
+        rerank_factor=rerank_factor
+    )
+    face_ids = embedding_store.face_ids_for(rows)
+    return [(face_id, float(score)) for face_id, score in zip(face_ids, scores)]
+
+def apply_search_filter(query, search_filter: SearchFilter):
+    """
+    Add WHERE clauses for a SearchFilter to a query over the faces table
+    
+    Args:
+        query: SQLAlchemy query selecting from Face
+        search_filter: Attribute filter, or None
+        
+    Returns:
+        The filtered query
+    """
+    if search_filter is None:
+        return query
+    
+    if search_filter.file_ids is not None:
+        query = query.filter(Face.file_id.in_(search_filter.file_ids))
+    if search_filter.uploaded_after is not None or search_filter.uploaded_before is not None:
+        query = query.join(UploadedFile, Face.file_id == UploadedFile.id)
+        if search_filter.uploaded_after is not None:
+            query = query.filter(UploadedFile.upload_time >= datetime.fromtimestamp(search_filter.uploaded_after))
+        if search_filter.uploaded_before is not None:
+            query = query.filter(UploadedFile.upload_time <= datetime.fromtimestamp(search_filter.uploaded_before))
+    if search_filter.min_quality is not None:
+        query = query.filter(Face.quality_score >= search_filter.min_quality)
+    if search_filter.max_quality is not None:
+        query = query.filter(Face.quality_score <= search_filter.max_quality)
+    if search_filter.min_timestamp is not None:
+        query = query.filter(Face.timestamp >= search_filter.min_timestamp)
+    if search_filter.max_timestamp is not None:
+        query = query.filter(Face.timestamp <= search_filter.max_timestamp)
+    if search_filter.genders is not None:
+        query = query.filter(Face.gender.in_(search_filter.genders))
+    if search_filter.age_buckets is not None:
+        bounds = (0,) + AGE_BUCKET_EDGES
+        ranges = []
+        for bucket in search_filter.age_buckets:
+            index = AGE_BUCKET_LABELS.index(bucket)
+            condition = Face.age >= bounds[index]
+            if index + 1 < len(bounds):
+                condition = and_(condition, Face.age < bounds[index + 1])
+            ranges.append(condition)
+        query = query.filter(or_(*ranges))
+    return query
+
+def search_faces_pgvector(session: Session, query_embedding, threshold: float = 0.6,
+                          top_k: int = 20, ef_search: int = None,
+                          probes: int = None,
+                          search_filter: SearchFilter = None) -> List[Tuple[str, float]]:
+    """
+    Rank faces in PostgreSQL using the pgvector cosine-distance operator
+    
+    Args:
+        session: Database session
+        query_embedding: Query face embedding
+        threshold: Similarity threshold (0-1)
+        top_k: Return top k results
+        ef_search: HNSW ef_search override
+        probes: IVFFlat probes override
+        search_filter: Optional attribute filter added to the WHERE clause
+        
+    Returns:
+        List of (face_id, similarity_score) tuples, best first
+    """
+    # An HNSW scan yields at most ef_search rows, which are then filtered; a
+    # filtered or very deep search ranks every matching row exactly instead
+    ef_search = max(ef_search or HNSW_EF_SEARCH, top_k)
+    exact = search_filter is not None or ef_search > HNSW_MAX_EF_SEARCH
+    set_vector_search_params(session, ef_search=ef_search, probes=probes, exact=exact)
+    
+    distance = Face.embedding.cosine_distance(list(map(float, query_embedding)))
+    query = apply_search_filter(session.query(Face.face_id, distance.label('distance')), search_filter)
+    rows = (
+        query
+        .order_by(distance)
+        .limit(top_k)
+        .all()
+    )
+    # The metadata and similarity queries later in this transaction need
+    # their normal planner settings back (a failed query aborts it anyway)
+    reset_vector_search_params(session)
+    
+    # Cosine distance is 1 - cos; map to the (cos + 1) / 2 similarity scale.
+    # Thresholding after LIMIT keeps the ORDER BY on the ANN index scan.
+    results = []
+    for face_id, dist in rows:
+        similarity = 1.0 - float(dist) / 2.0
+        if similarity >= threshold:
+            results.append((face_id, similarity))
+    return results
+
 @celery_app.task(bind=True)
 def process_uploaded_file(self, file_id: int, file_path: str, file_type: str):
     """
@@ -91,6 +793,17 @@ def process_uploaded_file(self, file_id: int, file_path: str, file_type: str):
                 )
         
         elif file_type == 'video':
+            fps, total_frames, segments = plan_segments(file_path)
+            if len(segments) > 1:
+                # Fan out to segment workers; the chord callback saves every face at once
+                logger.info("Splitting video into segments", segments=len(segments), total_frames=total_frames)
+                workflow = build_segmented_video_processing(
+                    file_id, file_path, fps, total_frames, segments, self.request.id, start_time
+                )
+                if self.request.called_directly:
+                    return workflow.apply_async().get()
+                raise self.replace(workflow)
+            
             def progress_callback(progress, frames_processed, faces_found):
                 current_task.update_state(
                     state='PROCESSING',
@@ -103,7 +816,7 @@ def process_uploaded_file(self, file_id: int, file_path: str, file_type: str):
             
             faces = face_processor.process_video(
                 file_path, 
-                frame_interval=30,
+                frame_interval=VIDEO_FRAME_INTERVAL,
                 progress_callback=progress_callback
             )
             
@@ -116,179 +829,1162 @@ def process_uploaded_file(self, file_id: int, file_path: str, file_type: str):
         file_record.total_faces = len(faces)
         session.commit()
         
-        # Track metrics
-        duration = time.time() - start_time
-        metrics.track_file_processing(file_type, 'completed', duration)
+        append_faces_to_store(faces)
+        if faces:
+            # Orphan search results computed against the previous gallery
+            cache_helper.bump_gallery_generation()
+        
+        # Track metrics
+        duration = time.time() - start_time
+        metrics.track_file_processing(file_type, 'completed', duration)
+        
+        # Track face detection metrics
+        quality_scores = [face.get('quality_score', 0.0) for face in faces]
+        metrics.track_face_detection(
+            source_type=file_type,
+            num_faces=len(faces),
+            duration=duration,
+            quality_scores=quality_scores
+        )
+        
+        logger.info("File processing completed", 
+                   total_faces=len(faces), 
+                   duration_seconds=duration)
+        
+        # Final update
+        current_task.update_state(
+            state='SUCCESS',
+            meta={
+                'current': 100,
+                'total': 100,
+                'status': f'Completed! Found {len(faces)} faces',
+                'total_faces': len(faces)
+            }
+        )
+        
+        return {
+            'status': 'success',
+            'file_id': file_id,
+            'total_faces': len(faces),
+            'message': f'Successfully processed {len(faces)} faces'
+        }
+    
+    except Ignore:
+        # Raised by self.replace() to hand a long video over to the segment workflow
+        raise
+    except Exception as e:
+        duration = time.time() - start_time
+        logger.error("File processing failed", 
+                    error=str(e), 
+                    duration_seconds=duration)
+        
+        # Track failed processing metric
+        metrics.track_file_processing(file_type, 'failed', duration)
+        
+        # Update status to failed
+        file_record = session.query(UploadedFile).filter_by(id=file_id).first()
+        if file_record:
+            file_record.processing_status = 'failed'
+            session.commit()
+        
+        # Update task state
+        current_task.update_state(
+            state='FAILURE',
+            meta={
+                'current': 0,
+                'total': 100,
+                'status': f'Error: {str(e)}'
+            }
+        )
+        
+        raise
+        
+    finally:
+        session.close()
+
+def build_segmented_video_processing(file_id: int, file_path: str, fps: float, total_frames: int,
+                                     segments: List[Tuple], job_id: str, start_time: float):
+    """
+    Build a workflow processing video segments in parallel and merging them
+    
+    Args:
+        file_id: Uploaded file id
+        file_path: Path to video file
+        fps: Video frame rate
+        total_frames: Video length in frames
+        segments: (start_frame, end_frame) ranges from plan_segments
+        job_id: Task whose state shows the aggregated progress
+        start_time: When processing of the file started
+        
+    Returns:
+        Celery chord signature
+    """
+    workflow_id = job_id or uuid.uuid4().hex
+    staging_paths = [
+        os.path.join(VIDEO_STAGING_FOLDER, f'video_{file_id}_{workflow_id}_{segment}.json')
+        for segment in range(len(segments))
+    ]
+    segment_tasks = group(
+        process_video_segment.s(file_path, segment, start_frame, end_frame, len(segments),
+                                fps, total_frames, staging_paths[segment], job_id)
+        for segment, (start_frame, end_frame) in enumerate(segments)
+    )
+    # Tracks cut by a boundary end and start within a few samples of it
+    sample_spacing = 1.0 / VIDEO_SAMPLE_FPS if VIDEO_SAMPLE_FPS else VIDEO_FRAME_INTERVAL / fps
+    callback = finalize_video_segments.s(file_id, sample_spacing * (TRACK_MAX_MISSED + 1), start_time)
+    errback = video_segments_failed.s(file_id, start_time, staging_paths)
+    return chord(segment_tasks, callback.on_error(errback))
+
+def write_segment_staging(staging_path: str, faces: List[Dict]):
+    """Atomically write a segment's face dictionaries to its staging file"""
+    staging_dir = os.path.dirname(staging_path)
+    os.makedirs(staging_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=staging_dir, prefix=os.path.basename(staging_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(faces, f)
+        os.replace(tmp_path, staging_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def read_segment_staging(staging_path: str) -> List[Dict]:
+    """Load the face dictionaries a segment staged"""
+    with open(staging_path) as f:
+        return json.load(f)
+
+def remove_face_images(faces: List[Dict]):
+    """Delete the cropped images of faces that will not be saved"""
+    for face in faces:
+        path = face.get('face_image_path')
+        if not path:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not remove face image", path=path, error=str(e))
+
+def discard_segment_staging(staging_paths: List[str], remove_images: bool):
+    """Delete staging files, and with remove_images the face crops they reference"""
+    for staging_path in staging_paths:
+        if not os.path.exists(staging_path):
+            continue
+        try:
+            if remove_images:
+                remove_face_images(read_segment_staging(staging_path))
+            os.remove(staging_path)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not discard segment staging", path=staging_path, error=str(e))
+
+@celery_app.task(bind=True)
+def process_video_segment(self, file_path: str, segment: int, start_frame: int, end_frame: int,
+                          num_segments: int, fps: float, total_frames: int, staging_path: str,
+                          job_id: str = None):
+    """
+    Extract faces from one segment of a video
+    
+    The faces, embeddings included, are written to staging_path rather than
+    returned, so only a small summary passes through the result backend.
+    
+    Args:
+        file_path: Path to video file
+        segment: Segment index
+        start_frame: First frame of the segment
+        end_frame: Frame the segment ends before (None = end of video)
+        num_segments: Segments of the video
+        fps: Video frame rate
+        total_frames: Video length in frames
+        staging_path: File receiving the segment's face dictionaries
+        job_id: Task whose state receives the progress aggregated over all segments
+    
+    Returns:
+        {'segment', 'start_time', 'staging_path', 'total_faces'}
+    """
+    segment_frames = (end_frame if end_frame is not None else total_frames) - start_frame
+    
+    def progress_callback(progress, frames_processed, faces_found):
+        totals = cache_helper.record_segment_progress(
+            job_id, segment, int(progress / 100 * segment_frames), faces_found
+        )
+        if totals is None or not job_id:
+            return
+        self.update_state(
+            task_id=job_id,
+            state='PROCESSING',
+            meta={
+                'current': min(int(totals['frames'] / total_frames * 100), 99) if total_frames > 0 else 0,
+                'total': 100,
+                'status': f"Processed {totals['frames']}/{total_frames} frames in {num_segments} segments, "
+                          f"found {totals['faces']} faces",
+                'segments': num_segments
+            }
+        )
+    
+    logger.info("Processing video segment", file_path=file_path, segment=segment,
+                start_frame=start_frame, end_frame=end_frame)
+    faces = face_processor.process_video(
+        file_path,
+        frame_interval=VIDEO_FRAME_INTERVAL,
+        progress_callback=progress_callback,
+        start_frame=start_frame,
+        end_frame=end_frame
+    )
+    try:
+        write_segment_staging(staging_path, faces)
+    except Exception:
+        remove_face_images(faces)
+        raise
+    progress_callback(100, 0, len(faces))
+    
+    return {
+        'segment': segment,
+        'start_time': start_frame / fps if fps > 0 else 0.0,
+        'staging_path': staging_path,
+        'total_faces': len(faces)
+    }
+
+@celery_app.task
+def finalize_video_segments(segment_results: List[Dict], file_id: int, max_gap_seconds: float,
+                            start_time: float):
+    """
+    Chord callback merging segment faces and tracks and saving them in one transaction
+    
+    Staged faces dropped by the track merge lose their crops; on failure
+    every staged face does, and the staging files are removed either way.
+    """
+    segment_results = sorted(segment_results, key=lambda result: result['segment'])
+    staging_paths = [result['staging_path'] for result in segment_results]
+    
+    session = get_session()
+    try:
+        segments = [
+            {'start_time': result['start_time'], 'faces': read_segment_staging(result['staging_path'])}
+            for result in segment_results
+        ]
+        faces = merge_segment_tracks(segments, max_gap_seconds)
+        
+        file_record= session.query(UploadedFile).filter_by(id=file_id).first()
+        if not file_record:
+            raise ValueError(f"File record not found: {file_id}")
+        
+        session.add_all([build_face_record(file_id, face_data) for face_data in faces])
+        file_record.processing_status = 'completed'
+        file_record.total_faces = len(faces)
+        session.commit()
+        
+        saved = {face['face_id'] for face in faces}
+        remove_face_images([face for segment in segments for face in segment['faces']
+                            if face['face_id'] not in saved])
+        discard_segment_staging(staging_paths, remove_images=False)
+        
+        for face_data in faces:
+            _add_to_live_indexes(face_data)
+        append_faces_to_store(faces)
+        if faces:
+            # Orphan search results computed against the previous gallery
+            cache_helper.bump_gallery_generation()
+        
+        duration = time.time() - start_time
+        metrics.track_file_processing('video', 'completed', duration)
+        metrics.track_face_detection(
+            source_type='video',
+            num_faces=len(faces),
+            duration=duration,
+            quality_scores=[face.get('quality_score', 0.0) for face in faces]
+        )
+        logger.info("Segmented video processing completed", file_id=file_id,
+                    segments=len(segment_results), total_faces=len(faces), duration_seconds=duration)
+        
+        return {
+            'status': 'success',
+            'file_id': file_id,
+            'total_faces': len(faces),
+            'segments': len(segment_results),
+            'message': f'Successfully processed {len(faces)} faces'
+        }
+    except Exception as e:
+        session.rollback()
+        logger.error("Merging video segments failed", file_id=file_id, error=str(e))
+        discard_segment_staging(staging_paths, remove_images=True)
+        mark_file_failed(session, file_id, start_time)
+        raise
+    finally:
+        session.close()
+
+@celery_app.task
+def video_segments_failed(request, exc, traceback, file_id: int, start_time: float,
+                          staging_paths: List[str] = None):
+    """
+    Error callback of the segment chord: discard staged faces and mark the file failed
+    """
+    logger.error("Video segment processing failed", file_id=file_id, error=str(exc))
+    discard_segment_staging(staging_paths or [], remove_images=True)
+    session= get_session()
+    try:
+        mark_file_failed(session, file_id, start_time)
+    finally:
+        session.close()
+
+def mark_file_failed(session: Session, file_id: int, start_time: float):
+    """Set a video file's status to failed and record the failure metric"""
+    metrics.track_file_processing('video', 'failed', time.time() - start_time)
+    file_record = session.query(UploadedFile).filter_by(id=file_id).first()
+    if file_record:
+        file_record.processing_status = 'failed'
+        session.commit()
+
+def rank_query_embeddings(session: Session, query_embeddings: List, threshold: float = 0.6,
+                          top_k: int = 20, backend: str = None,
+                          search_filter: SearchFilter = None) -> List[List[Tuple[str, float]]]:
+    """
+    Rank one or more query embeddings against the gallery with a search backend
+    
+    Exact backends ('memory', 'mmap') score the whole query batch with one
+    blocked matrix-matrix product; the others answer query by query.
+    
+    Filtered searches run on the in-memory index for 'memory', which resolves
+    the filter to candidate rows before scoring, and in SQL for every other
+    backend. The approximate backends would drop matches by filtering after
+    their top-k, and the compact ones ('mmap', quantized) exist so the worker
+    never holds the float32 index.
+    
+    Args:
+        session: Database session
+        query_embeddings: List of query face embeddings
+        threshold: Similarity threshold (0-1)
+        top_k: Return top k results per query
+        backend: Search backend (defaults to SEARCH_BACKEND)
+        search_filter: Optional attribute filter applied before scoring
+        
+    Returns:
+        One list of (face_id, similarity_score) tuples per query, best first
+    """
+    backend = (backend or SEARCH_BACKEND).lower()
+    
+    if search_filter is not None:
+        if backend == 'memory':
+            return get_search_index(session).search_batch(
+                query_embeddings, threshold, top_k, search_filter=search_filter
+            )
+        if backend != 'pgvector':
+            # Don't build a float32 copy of the gallery in a worker serving a compact backend
+            logger.info("Routing filtered search to pgvector", backend=backend)
+        return [
+            search_faces_pgvector(session, query_embedding, threshold, top_k, search_filter=search_filter)
+            for query_embedding in query_embeddings
+        ]
+    
+    if backend == 'memory':
+        # Rank against the warm in-memory index
+        return get_search_index(session).search_batch(query_embeddings, threshold, top_k)
+    if backend == 'mmap':
+        return embedding_store.search_batch(query_embeddings, threshold, top_k)
+    
+    if backend == 'pgvector':
+        search = lambda q: search_faces_pgvector(session, q, threshold, top_k)
+    elif backend in QUANTIZATION_MODES:
+        search = lambda q: search_faces_quantized(backend, q, threshold, top_k)
+    elif backend == 'ivf':
+        index = get_ivf_index(session)
+        if index is None:
+            # No centroids trained yet (`cli_tool.py retrain-ivf`); use the exact in-memory index
+            index = get_search_index(session)
+        search = lambda q: index.search(q, threshold, top_k)
+    elif backend == 'hnsw':
+        index = get_hnsw_index(session)
+        if index is None:
+            # No graph built yet (`cli_tool.py build-hnsw`); use the exact in-memory index
+            index = get_search_index(session)
+        search = lambda q: index.search(q, threshold, top_k)
+    elif backend == 'sharded':
+        # Shard fan-out runs as a chord and cannot be waited on from inside a task
+        raise ValueError("The 'sharded' backend is only available through search_similar_faces")
+    else:
+        raise ValueError(f"Unknown search backend: {backend}")
+    
+    return [search(query_embedding) for query_embedding in query_embeddings]
+
+class FaceMetadataCache:
+    """
+    Small thread-safe LRU cache of search result metadata keyed by face_id
+    """
+    
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_many(self, face_ids) -> Dict[str, Dict]:
+        found = {}
+        with self._lock:
+            for face_id in face_ids:
+                entry = self._entries.get(face_id)
+                if entry is not None:
+                    self._entries.move_to_end(face_id)
+                    found[face_id] = entry
+        return found
+    
+    def put_many(self, entries: Dict[str, Dict]):
+        with self._lock:
+            for face_id, entry in entries.items():
+                self._entries[face_id] = entry
+                self._entries.move_to_end(face_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+face_metadata_cache = FaceMetadataCache(int(os.getenv('FACE_METADATA_CACHE_SIZE', 10000)))
+
+def fetch_face_metadata(session: Session, face_ids) -> Dict[str, Dict]:
+    """
+    Load search result metadata for many faces with a single joined query
+    
+    Only the displayed columns are selected (never the embedding), and rows
+    already in the in-process cache are not fetched again.
+    
+    Args:
+        session: Database session
+        face_ids: Face identifiers to look up
+        
+    Returns:
+        Mapping of face_id to metadata dict for faces that exist
+    """
+    face_ids = set(face_ids)
+    metadata = face_metadata_cache.get_many(face_ids)
+    missing = face_ids.difference(metadata)
+    
+    if missing:
+        rows = (
+            session.query(
+                Face.face_id, Face.file_id, UploadedFile.original_filename,
+                Face.face_image_path, Face.bbox, Face.quality_score,
+                Face.timestamp, Face.frame_number
+            )
+            .join(UploadedFile, Face.file_id == UploadedFile.id)
+            .filter(Face.face_id.in_(missing))
+            .all()
+        )
+        fetched = {
+            row.face_id: {
+                'face_id': row.face_id,
+                'file_id': row.file_id,
+                'file_name': row.original_filename,
+                'face_image_path': row.face_image_path,
+                'bbox': row.bbox,
+                'quality_score': row.quality_score,
+                'timestamp': row.timestamp,
+                'frame_number': row.frame_number
+            }
+            for row in rows
+        }
+        face_metadata_cache.put_many(fetched)
+        metadata.update(fetched)
+    
+    return metadata
+
+def hydrate_search_results(session: Session, similar_faces: List[Tuple[str, float]]) -> List[Dict]:
+    """
+    Attach face and file details to ranked (face_id, similarity) pairs
+    """
+    metadata = fetch_face_metadata(session, [face_id for face_id, _ in similar_faces])
+    
+    results = []
+    for face_id, similarity in similar_faces:
+        entry = metadata.get(face_id)
+        if entry:
+            results.append(dict(entry, similarity=float(similarity)))
+    return results
+
+@celery_app.task(bind=True)
+def search_similar_faces(self, query_image_path: str, threshold: float = 0.6, top_k: int = 20,
+                         backend: str = None, all_faces: bool = False, filters: Dict = None,
+                         room: str = None):
+    """
+    Search for similar faces in the database
+    
+    Args:
+        query_image_path: Path to the query image
+        threshold: Similarity threshold (0-1)
+        top_k: Maximum number of results
+        backend: 'memory', 'pgvector', 'mmap', 'sq8', 'pq', 'ivf', 'hnsw' or 'sharded'
+            (defaults to SEARCH_BACKEND)
+        all_faces: Search with every face in the query image and group results
+            by query face instead of using only the first detected face
+        filters: Optional SearchFilter fields (file_ids, uploaded_after,
+            min_quality, genders, age_buckets, ...) applied before scoring
+        room: Optional SocketIO room (see search_room) receiving progress
+            events and the final result, for async searches
+    """
+    start_time = time.time()
+    backend = (backend or SEARCH_BACKEND).lower()
+    logger = get_logger(__name__).bind(
+        operation="face_search",
+        threshold=threshold,
+        top_k=top_k,
+        backend=backend,
+        all_faces=all_faces
+    )
+    logger.info("Starting face search", query_image_path=query_image_path)
+    
+    try:
+        search_filter = SearchFilter.from_dict(filters)
+    except (TypeError, ValueError) as e:
+        return finish_search({
+            'status': 'error',
+            'message': f"Invalid search filters: {str(e)}"
+        }, room)
+    
+    session = get_session()
+    try:
+        # Process query image (embeddings are cached by image content)
+        query_faces = detect_query_faces(query_image_path)
+        
+        if not query_faces:
+            return finish_search({
+                'status': 'error',
+                'message': 'No faces found in query image'
+            }, room)
+        
+        # Rank every detected face, or only the first one found
+        if not all_faces:
+            query_faces = query_faces[:1]
+        query_embeddings = [face['embedding'] for face in query_faces]
+        query_summaries = [
+            {'bbox': face['bbox'], 'quality_score': face['quality_score']}
+            for face in query_faces
+        ]
+        emit_search_event(room, 'search_progress', {
+            'stage': 'detected',
+            'query_faces': query_summaries
+        })
+        
+        if backend == 'sharded':
+            scope = search_cache_scope(backend, search_filter)
+            ranked = [
+                cache_helper.get_ranked_candidates(embedding, scope, threshold, top_k)
+                for embedding in query_embeddings
+            ]
+            if any(similar_faces is None for similar_faces in ranked):
+                # Fan out to the shard workers; the chord callback finishes the search
+                search_params = {'threshold': threshold, 'top_k': top_k, 'backend': backend,
+                                 'scope': scope, 'room': room}
+                workflow = build_sharded_search(
+                    query_embeddings, min(threshold, SEARCH_CACHE_MIN_THRESHOLD), max(top_k, SEARCH_CACHE_DEPTH),
+                    finalize_sharded_search.s(query_embeddings, query_summaries, search_params, all_faces, start_time),
+                    filters=search_filter.to_dict() if search_filter else None,
+                    room=room,
+                    partial_threshold=threshold,
+                    partial_top_k=top_k
+                )
+                if self.request.called_directly:
+                    return workflow.apply_async().get(timeout=SHARDED_SEARCH_TIMEOUT)
+                raise self.replace(workflow)
+            cache_hit = True
+        else:
+            ranked, cache_hit = rank_with_candidate_cache(
+                session, query_embeddings, threshold, top_k, backend, search_filter
+            )
+        
+        result = build_search_result(session, query_summaries, ranked, all_faces)
+        record_search_result(result, start_time, backend, cache_hit=cache_hit)
+        return finish_search(result, room)
+    
+    except Ignore:
+        # Raised by self.replace() to hand the request over to the sharded workflow
+        raise
+    except Exception as e:
+        logger.error(f"Error searching faces: {str(e)}")
+        return finish_search({
+            'status': 'error',
+            'message': str(e)
+        }, room)
+    finally:
+        session.close()
+
+@celery_app.task
+def progressive_search_faces(query_image_path: str, threshold: float = 0.6, top_k: int = 20,
+                             all_faces: bool = False, filters: Dict = None, room: str = None,
+                             time_budget_ms: float = None, stop_score: float = None):
+    """
+    Search by scanning the embedding store in chunks, pushing improving results
+    
+    The running top-k is emitted to the room as a 'search_progress' event
+    (stage 'partial') whenever it changed and PROGRESSIVE_SEARCH_EMIT_INTERVAL_MS
+    has passed. The scan stops early once the time budget is spent or every
+    query's k-th best score reaches stop_score; the final result then carries
+    complete=False and the reason in 'stopped'.
+    
+    Args:
+        query_image_path: Path to the query image
+        threshold: Similarity threshold (0-1)
+        top_k: Maximum number of results
+        all_faces: Search with every face in the query image
+        filters: Optional SearchFilter fields; filtered searches are ranked
+            exactly with SEARCH_BACKEND since the store holds no attributes
+        room: SocketIO room receiving progress events and the final result
+        time_budget_ms: Stop scanning after this long (defaults to PROGRESSIVE_SEARCH_TIME_BUDGET_MS)
+        stop_score: Stop once top_k results score at least this (0 disables;
+            defaults to PROGRESSIVE_SEARCH_STOP_SCORE)
+    """
+    start_time = time.time()
+    time_budget = (PROGRESSIVE_SEARCH_TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms) / 1000.0
+    stop_score = PROGRESSIVE_SEARCH_STOP_SCORE if stop_score is None else stop_score
+    emit_interval = PROGRESSIVE_SEARCH_EMIT_INTERVAL_MS / 1000.0
+    
+    try:
+        search_filter = SearchFilter.from_dict(filters)
+    except (TypeError, ValueError) as e:
+        return finish_search({
+            'status': 'error',
+            'message': f"Invalid search filters: {str(e)}"
+        }, room)
+    
+    session = get_session()
+    try:
+        query_faces = detect_query_faces(query_image_path)
+        
+        if not query_faces:
+            return finish_search({
+                'status': 'error',
+                'message': 'No faces found in query image'
+            }, room)
         
-        # Track face detection metrics
-        quality_scores = [face.get('quality_score', 0.0) for face in faces]
-        metrics.track_face_detection(
-            source_type=file_type,
-            num_faces=len(faces),
-            duration=duration,
-            quality_scores=quality_scores
-        )
+        if not all_faces:
+            query_faces = query_faces[:1]
+        query_embeddings = [face['embedding'] for face in query_faces]
+        query_summaries = [
+            {'bbox': face['bbox'], 'quality_score': face['quality_score']}
+            for face in query_faces
+        ]
+        emit_search_event(room, 'search_progress', {
+            'stage': 'detected',
+            'query_faces': query_summaries
+        })
         
-        logger.info("File processing completed", 
-                   total_faces=len(faces), 
-                   duration_seconds=duration)
+        if search_filter is not None or not EMBEDDING_STORE_ENABLED:
+            # The shard chord cannot be waited on inside a task
+            backend = 'memory' if SEARCH_BACKEND == 'sharded' else SEARCH_BACKEND
+            ranked, cache_hit = rank_with_candidate_cache(
+                session, query_embeddings, threshold, top_k, backend, search_filter
+            )
+            result = build_search_result(session, query_summaries, ranked, all_faces)
+            result.update(complete=True, stopped='exhausted')
+            record_search_result(result, start_time, backend, cache_hit=cache_hit)
+            return finish_search(result, room)
         
-        # Final update
-        current_task.update_state(
-            state='SUCCESS',
-            meta={
-                'current': 100,
-                'total': 100,
-                'status': f'Completed! Found {len(faces)} faces',
-                'total_faces': len(faces)
-            }
-        )
+        # Hits are store row numbers until they are emitted
+        ranked = [[] for _ in query_faces]
+        emitted = ranked
+        scanned, total = 0, 0
+        stopped = 'exhausted'
+        last_emit = 0.0
+        for scanned, total, ranked in embedding_store.iter_search_batch(
+                query_embeddings, threshold, top_k, PROGRESSIVE_SEARCH_CHUNK_ROWS):
+            if scanned >= total:
+                break
+            now = time.time()
+            if stop_score and all(len(similar_faces) >= top_k and similar_faces[-1][1] >= stop_score
+                                  for similar_faces in ranked):
+                stopped = 'confidence'
+                break
+            if now - start_time >= time_budget:
+                stopped = 'time_budget'
+                break
+            if room and ranked != emitted and now - last_emit >= emit_interval:
+                partial = build_search_result(session, query_summaries,
+                                              embedding_store.resolve_rows(ranked, total), all_faces)
+                emit_search_event(room, 'search_progress', dict(
+                    partial, stage='partial', scanned=scanned, total=total
+                ))
+                emitted, last_emit = ranked, now
         
+        result = build_search_result(session, query_summaries,
+                                     embedding_store.resolve_rows(ranked, total), all_faces)
+        result.update(complete=stopped == 'exhausted', stopped=stopped, scanned=scanned, total=total)
+        record_search_result(result, start_time, 'progressive')
+        return finish_search(result, room)
+    
+    except Exception as e:
+        logger.error(f"Error in progressive search: {str(e)}")
+        return finish_search({
+            'status': 'error',
+            'message': str(e)
+        }, room)
+    finally:
+        session.close()
+
+def build_search_result(session: Session, query_summaries: List[Dict],
+                        ranked: List[List[Tuple[str, float]]], all_faces: bool) -> Dict:
+    """
+    Build the search response from ranked hits for each query face
+    
+    Args:
+        session: Database session
+        query_summaries: bbox/quality_score of each query face
+        ranked: One list of (face_id, similarity_score) tuples per query face
+        all_faces: Group results per query face instead of the single-face layout
+    """
+    # Load metadata for every hit across all query faces at once
+    fetch_face_metadata(session, [face_id for similar_faces in ranked for face_id, _ in similar_faces])
+    
+    if not all_faces:
+        results = hydrate_search_results(session, ranked[0])
         return {
             'status': 'success',
-            'file_id': file_id,
-            'total_faces': len(faces),
-            'message': f'Successfully processed {len(faces)} faces'
+            'query_face': query_summaries[0],
+            'results': results,
+            'total_results': len(results)
         }
+    
+    grouped = []
+    for query_summary, similar_faces in zip(query_summaries, ranked):
+        matches = hydrate_search_results(session, similar_faces)
+        grouped.append(dict(query_summary, results=matches, total_results=len(matches)))
+    
+    return {
+        'status': 'success',
+        'query_faces': grouped,
+        'total_query_faces': len(grouped),
+        'total_results': sum(group['total_results'] for group in grouped)
+    }
+
+def record_search_result(result: Dict, start_time: float, backend: str, cache_hit: bool = False):
+    """Track metrics for a finished search"""
+    duration = time.time() - start_time
+    metrics.track_search(cache_hit=cache_hit, duration=duration, num_results=result['total_results'])
+    
+    logger.info("Face search completed",
+               backend=backend,
+               cache_hit=cache_hit,
+               num_results=result['total_results'],
+               duration_seconds=duration)
+
+def detect_query_faces(query_image_path: str) -> List[Dict]:
+    """
+    Detect the faces in a query image, reusing embeddings cached by image content
+    
+    Args:
+        query_image_path: Path to the query image
         
-    except Exception as e:
-        duration = time.time() - start_time
-        logger.error("File processing failed", 
-                    error=str(e), 
-                    duration_seconds=duration)
-        
-        # Track failed processing metric
-        metrics.track_file_processing(file_type, 'failed', duration)
+    Returns:
+        List of {'embedding', 'bbox', 'quality_score'} dicts, one per face
+    """
+    try:
+        with open(query_image_path, 'rb') as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        content_hash = None
+    
+    if content_hash:
+        cached_faces = cache_helper.get_query_faces(content_hash)
+        if cached_faces is not None:
+            return cached_faces
+    
+    query_faces = summarize_query_faces(face_processor.process_image(query_image_path, save_faces=False))
+    if content_hash and query_faces:
+        cache_helper.cache_query_faces(content_hash, query_faces)
+    return query_faces
+
+def summarize_query_faces(faces: List[Dict]) -> List[Dict]:
+    """Keep the fields a search needs from processed face dictionaries"""
+    return [
+        {
+            'embedding': [float(value) for value in face['embedding']],
+            'bbox': face['bbox'],
+            'quality_score': float(face['quality_score'])
+        }
+        for face in faces
+    ]
+
+def detect_query_faces_batch(query_image_paths: List[str]) -> List[List[Dict]]:
+    """
+    Detect the faces in several query images with batched inference
+    
+    Images whose content is cached are answered from the cache; the rest are
+    detected and embedded together by FaceProcessor.process_images_batch.
+    
+    Args:
+        query_image_paths: Paths to the query images
         
-        # Update status to failed
-        file_record = session.query(UploadedFile).filter_by(id=file_id).first()
-        if file_record:
-            file_record.processing_status = 'failed'
-            session.commit()
+    Returns:
+        One list of {'embedding', 'bbox', 'quality_score'} dicts per image
+        (empty when no face was found or the image could not be read)
+    """
+    detected = [None] * len(query_image_paths)
+    content_hashes = [None] * len(query_image_paths)
+    misses = []
+    for i, query_image_path in enumerate(query_image_paths):
+        try:
+            with open(query_image_path, 'rb') as f:
+                content_hashes[i] = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            pass
+        if content_hashes[i]:
+            detected[i] = cache_helper.get_query_faces(content_hashes[i])
+        if detected[i] is None:
+            misses.append(i)
+    
+    if misses:
+        results, _ = face_processor.process_images_batch(
+            [query_image_paths[i] for i in misses], save_faces=False
+        )
+        for i, result in zip(misses, results):
+            if result['status'] != 'success':
+                logger.error(f"Error processing query image {query_image_paths[i]}: {result.get('error')}")
+                detected[i] = []
+                continue
+            detected[i] = summarize_query_faces(result['faces'])
+            if content_hashes[i] and detected[i]:
+                cache_helper.cache_query_faces(content_hashes[i], detected[i])
+    return detected
+
+def search_cache_scope(backend: str, search_filter: SearchFilter = None) -> Dict:
+    """Search settings a cached candidate list is only valid for, including the gallery generation"""
+    return {
+        'backend': backend,
+        'filters': search_filter.to_dict() if search_filter else None,
+        'generation': cache_helper.get_gallery_generation()
+    }
+
+def rank_with_candidate_cache(session: Session, query_embeddings: List, threshold: float,
+                              top_k: int, backend: str,
+                              search_filter: SearchFilter = None) -> Tuple[List[List[Tuple[str, float]]], bool]:
+    """
+    Rank query embeddings, answering from cached candidate lists where possible
+    
+    Misses are ranked with SEARCH_CACHE_DEPTH results down to
+    SEARCH_CACHE_MIN_THRESHOLD and cached, so later requests with a smaller
+    top_k or a higher threshold are served by slicing.
+    
+    Args:
+        session: Database session
+        query_embeddings: Query face embeddings
+        threshold: Similarity threshold (0-1)
+        top_k: Results per query
+        backend: Search backend
+        search_filter: Optional attribute filter
         
-        # Update task state
-        current_task.update_state(
-            state='FAILURE',
-            meta={
-                'current': 0,
-                'total': 100,
-                'status': f'Error: {str(e)}'
-            }
+    Returns:
+        (one list of (face_id, similarity_score) tuples per query, True if every query hit the cache)
+    """
+    scope = search_cache_scope(backend, search_filter)
+    ranked = [
+        cache_helper.get_ranked_candidates(embedding, scope, threshold, top_k)
+        for embedding in query_embeddings
+    ]
+    misses = [i for i, similar_faces in enumerate(ranked) if similar_faces is None]
+    
+    if misses:
+        miss_embeddings = [query_embeddings[i] for i in misses]
+        deep = rank_query_embeddings(
+            session, miss_embeddings, min(threshold, SEARCH_CACHE_MIN_THRESHOLD),
+            max(top_k, SEARCH_CACHE_DEPTH), backend, search_filter
         )
+        for i, similar_faces in zip(misses, store_ranked_candidates(miss_embeddings, scope, deep, threshold, top_k)):
+            ranked[i] = similar_faces
+    
+    return ranked, not misses
+
+def get_face_embedding(session: Session, face_id: str):
+    """
+    Look up the stored embedding of a gallery face
+    
+    The warm in-memory index is checked first; otherwise the embedding is
+    read from the faces row.
+    
+    Args:
+        session: Database session
+        face_id: Face identifier
         
-        raise
+    Returns:
+        Embedding, or None if the face does not exist
+    """
+    embedding = search_index.get_embedding(face_id)
+    if embedding is not None:
+        return embedding
+    
+    row = session.query(Face.embedding).filter(Face.face_id == face_id).first()
+    if row is None or row.embedding is None:
+        return None
+    return _coerce_embedding(row.embedding)
+
+def find_faces_similar_to(session: Session, face_id: str, threshold: float = 0.6, top_k: int = 20,
+                          backend: str = None, search_filter: SearchFilter = None) -> Dict:
+    """
+    Find faces similar to an existing gallery face using its stored embedding
+    
+    No image is decoded and no model runs. Processes without a warm gallery
+    index (the web app) should pass backend='pgvector', since the in-process
+    backends load or train their index on first use.
+    
+    Args:
+        session: Database session
+        face_id: Face to pivot on
+        threshold: Similarity threshold (0-1)
+        top_k: Maximum number of results (the face itself is excluded)
+        backend: Search backend (defaults to SEARCH_BACKEND); 'sharded' uses 'memory'
+        search_filter: Optional attribute filter applied before scoring
+    """
+    start_time = time.time()
+    backend = (backend or SEARCH_BACKEND).lower()
+    if backend == 'sharded':
+        backend = 'memory'
+    
+    embedding = get_face_embedding(session, face_id)
+    if embedding is None:
+        return {
+            'status': 'error',
+            'message': f'Face not found: {face_id}'
+        }
+    embedding = [float(value) for value in embedding]
+    
+    # Ask for one extra result since the face always matches itself
+    ranked, cache_hit = rank_with_candidate_cache(
+        session, [embedding], threshold, top_k + 1, backend, search_filter
+    )
+    similar_faces = [(match_id, score) for match_id, score in ranked[0] if match_id != face_id][:top_k]
+    
+    query_face = fetch_face_metadata(session, [face_id]).get(face_id, {'face_id': face_id})
+    results = hydrate_search_results(session, similar_faces)
+    result = {
+        'status': 'success',
+        'query_face': query_face,
+        'results': results,
+        'total_results': len(results)
+    }
+    record_search_result(result, start_time, backend, cache_hit=cache_hit)
+    return result
+
+def store_ranked_candidates(query_embeddings: List, scope: Dict, deep: List[List[Tuple[str, float]]],
+                            threshold: float, top_k: int) -> List[List[Tuple[str, float]]]:
+    """
+    Cache deep candidate lists and slice them to the requested threshold and top_k
+    
+    Args:
+        query_embeddings: Query face embeddings the lists were ranked for
+        scope: Cache scope from search_cache_scope
+        deep: Lists ranked with SEARCH_CACHE_MIN_THRESHOLD / SEARCH_CACHE_DEPTH
+        threshold: Requested similarity threshold
+        top_k: Requested number of results
         
+    Returns:
+        One sliced list of (face_id, similarity_score) tuples per query
+    """
+    ranked = []
+    for embedding, candidates in zip(query_embeddings, deep):
+        cache_helper.cache_ranked_candidates(
+            embedding, scope, candidates,
+            min(threshold, SEARCH_CACHE_MIN_THRESHOLD), max(top_k, SEARCH_CACHE_DEPTH)
+        )
+        ranked.append([(face_id, score) for face_id, score in candidates if score >= threshold][:top_k])
+    return ranked
+
+def build_sharded_search(query_embeddings: List, threshold: float, top_k: int, callback,
+                         filters: Dict = None, room: str = None, partial_threshold: float = None,
+                         partial_top_k: int = None):
+    """
+    Build a scatter-gather workflow over all search shards
+    
+    Args:
+        query_embeddings: Query face embeddings
+        threshold: Similarity threshold (0-1)
+        top_k: Results per query kept by each shard
+        callback: Chord callback signature receiving the list of shard results
+        filters: Optional SearchFilter fields applied by every shard
+        room: Optional SocketIO room receiving each shard's hits as it finishes
+        partial_threshold: Threshold of the hits sent to the room (defaults to threshold)
+        partial_top_k: Hits per query sent to the room (defaults to top_k)
+    
+    Returns:
+        Celery chord signature
+    """
+    shard_tasks = []
+    for shard_id in range(SEARCH_SHARDS):
+        signature = search_shard.s(shard_id, SEARCH_SHARDS, query_embeddings, threshold, top_k, filters, room,
+                                   partial_threshold, partial_top_k)
+        if SEARCH_SHARD_QUEUES:
+            # Pin each shard to its own queue so the same workers keep it warm
+            signature = signature.set(queue=f'search_shard_{shard_id}')
+        shard_tasks.append(signature)
+    return chord(group(shard_tasks), callback)
+
+@celery_app.task
+def search_shard(shard_id: int, num_shards: int, query_embeddings: List,
+                 threshold: float = 0.6, top_k: int = 20, filters: Dict = None,
+                 room: str = None, partial_threshold: float = None, partial_top_k: int = None):
+    """
+    Rank query embeddings against one shard of the gallery
+    
+    Args:
+        shard_id: Shard to search (faces with id % num_shards == shard_id)
+        num_shards: Total number of shards
+        query_embeddings: Query face embeddings
+        threshold: Similarity threshold (0-1)
+        top_k: Results per query
+        filters: Optional SearchFilter fields applied before scoring
+        room: Optional SocketIO room receiving this shard's hits as a partial result
+        partial_threshold: Threshold of the partial result (defaults to threshold)
+        partial_top_k: Hits per query in the partial result (defaults to top_k)
+    """
+    session = get_session()
+    try:
+        index = get_shard_index(session, shard_id, num_shards)
+        ranked = index.search_batch(query_embeddings, threshold, top_k,
+                                    search_filter=SearchFilter.from_dict(filters))
+        shard_result = {
+            'shard_id': shard_id,
+            'shard_size': len(index),
+            'results': [[[face_id, score] for face_id, score in similar_faces] for similar_faces in ranked]
+        }
+        if room:
+            # The shard ranks deep enough to fill the candidate cache; send only what the request asked for
+            partial = trim_results(
+                shard_result['results'],
+                threshold if partial_threshold is None else partial_threshold,
+                top_k if partial_top_k is None else partial_top_k
+            )
+            emit_search_event(room, 'search_progress', dict(
+                shard_result, results=partial, stage='shard', num_shards=num_shards
+            ))
+        return shard_result
     finally:
         session.close()
 
 @celery_app.task
-def search_similar_faces(query_image_path: str, threshold: float = 0.6, top_k: int = 20):
+def finalize_sharded_search(shard_results: List[Dict], query_embeddings: List,
+                            query_summaries: List[Dict], search_params: Dict,
+                            all_faces: bool, start_time: float):
     """
-    Search for similar faces in the database
+    Chord callback merging shard top-k lists into the final search result
+    """
+    deep = merge_shard_results(shard_results, max(search_params['top_k'], SEARCH_CACHE_DEPTH))
+    ranked = store_ranked_candidates(query_embeddings, search_params['scope'], deep,
+                                     search_params['threshold'], search_params['top_k'])
+    
+    session = get_session()
+    try:
+        result = build_search_result(session, query_summaries, ranked, all_faces)
+        record_search_result(result, start_time, search_params['backend'])
+        return finish_search(result, search_params.get('room'))
+    except Exception as e:
+        logger.error(f"Error merging sharded search: {str(e)}")
+        return finish_search({
+            'status': 'error',
+            'message': str(e)
+        }, search_params.get('room'))
+    finally:
+        session.close()
+
+@celery_app.task
+def search_similar_faces_batch(query_image_paths: List[str], threshold: float = 0.6,
+                               top_k: int = 20, backend: str = None, filters: Dict = None):
+    """
+    Search for faces similar to many query images in one pass over the gallery
+    
+    Args:
+        query_image_paths: Paths to the query images
+        threshold: Similarity threshold (0-1)
+        top_k: Maximum number of results per query
+        backend: Search backend (defaults to SEARCH_BACKEND); 'sharded' uses 'memory'
+        filters: Optional SearchFilter fields applied before scoring
     """
     start_time = time.time()
+    backend = (backend or SEARCH_BACKEND).lower()
+    if backend == 'sharded':
+        # The shard chord cannot be waited on from inside a task
+        backend = 'memory'
     logger = get_logger(__name__).bind(
-        operation="face_search",
+        operation="face_search_batch",
         threshold=threshold,
-        top_k=top_k
+        top_k=top_k,
+        backend=backend,
+        num_queries=len(query_image_paths)
     )
-    logger.info("Starting face search", query_image_path=query_image_path)
-    
-    # Create query parameters for caching with file hash
-    try:
-        with open(query_image_path, 'rb') as f:
-            file_hash = hashlib.md5(f.read()).hexdigest()
-    except:
-        file_hash = query_image_path  # Fallback to path if hashing fails
-    
-    query_params = {
-        'file_hash': file_hash,
-        'threshold': threshold,
-        'top_k': top_k
-    }
+    logger.info("Starting batch face search")
     
-    # Check if result is cached
-    cached_result = cache_helper.get_cached_search_result(query_params)
-    if cached_result:
-        duration = time.time() - start_time
-        metrics.track_search(cache_hit=True, duration=duration, num_results=len(cached_result.get('data', {}).get('results', [])))
-        logger.info("Cache hit for face search", duration_seconds=duration)
-        return cached_result.get('data', cached_result)
-
     session = get_session()
     try:
-        # Process query image
-        query_faces = face_processor.process_image(query_image_path, save_faces=False)
-        
-        if not query_faces:
-            return {
-                'status': 'error',
-                'message': 'No faces found in query image'
-            }
-        
-        # Use the first face found
-        query_face = query_faces[0]
-        query_embedding = query_face['embedding']
+        search_filter = SearchFilter.from_dict(filters)
         
-        # Get all faces from database
-        all_faces = session.query(Face).all()
-        
-        # Prepare embeddings for comparison
-        face_embeddings = [
-            (face.face_id, json.loads(face.embedding) if isinstance(face.embedding, str) else face.embedding)
-            for face in all_faces
+        # Detect faces in all query images together, keeping the first face of each
+        queries = [
+            query_faces[0] if query_faces else None
+            for query_faces in detect_query_faces_batch(query_image_paths)
         ]
         
-        # Find similar faces
-        similar_faces = face_processor.find_similar_faces(
-            query_embedding, 
-            face_embeddings, 
-            threshold, 
-            top_k
-        )
+        # Score all query embeddings against the gallery together
+        detected = [query for query in queries if query is not None]
+        ranked, _ = rank_with_candidate_cache(
+            session, [query['embedding'] for query in detected], threshold, top_k, backend, search_filter
+        ) if detected else ([], False)
+        # Load metadata for every hit across all queries at once
+        fetch_face_metadata(session, [face_id for similar_faces in ranked for face_id, _ in similar_faces])
+        ranked = iter(ranked)
         
-        # Get face details
         results = []
-        for face_id, similarity in similar_faces:
-            face = session.query(Face).filter_by(face_id=face_id).first()
-            if face:
+        total_results = 0
+        for index, query_face in enumerate(queries):
+            if query_face is None:
                 results.append({
-                    'face_id': face.face_id,
-                    'similarity': float(similarity),
-                    'file_id': face.file_id,
-                    'file_name': face.file.original_filename,
-                    'face_image_path': face.face_image_path,
-                    'bbox': face.bbox,
-                    'quality_score': face.quality_score,
-                    'timestamp': face.timestamp,
-                    'frame_number': face.frame_number
+                    'query_index': index,
+                    'status': 'error',
+                    'message': 'No faces found in query image'
                 })
-        
-        result = {
-            'status': 'success',
-            'query_face': {
-                'bbox': query_face['bbox'],
-                'quality_score': query_face['quality_score']
-            },
-            'results': results,
-            'total_results': len(results)
-        }
-
-        # Cache the result
-        cache_helper.cache_search_result(query_params, result, ttl=3600)  # Cache for 1 hour
+                continue
+            
+            matches = hydrate_search_results(session, next(ranked))
+            total_results += len(matches)
+            results.append({
+                'query_index': index,
+                'status': 'success',
+                'query_face': {
+                    'bbox': query_face['bbox'],
+                    'quality_score': query_face['quality_score']
+                },
+                'results': matches,
+                'total_results': len(matches)
+            })
         
         # Track metrics
         duration = time.time() - start_time
-        metrics.track_search(cache_hit=False, duration=duration, num_results=len(results))
+        metrics.track_search(cache_hit=False, duration=duration, num_results=total_results)
         
-        logger.info("Face search completed", 
-                   num_results=len(results),
+        logger.info("Batch face search completed",
+                   num_results=total_results,
                    duration_seconds=duration)
-
-        return result
+        
+        return {
+            'status': 'success',
+            'queries': results,
+            'total_queries': len(query_image_paths)
+        }
         
     except Exception as e:
-        logger.error(f"Error searching faces: {str(e)}")
+        logger.error(f"Error in batch face search: {str(e)}")
+        return {
+            'status': 'error',
+            'message': str(e)
+        }
+    finally:
+        session.close()
+
+@celery_app.task
+def retrain_ivf_index(nlist: int = None, sample_size: int = None):
+    """
+    Retrain the shared IVF centroids; workers reassign their posting lists on next search
+    """
+    session = get_session()
+    try:
+        index = train_ivf_centroids(session, nlist=nlist, sample_size=sample_size)
+        return {
+            'status': 'success',
+            'nlist': index.nlist,
+            'centroids_path': IVF_CENTROIDS_PATH
+        }
+    except Exception as e:
+        logger.error(f"Error retraining IVF index: {str(e)}")
         return {
             'status': 'error',
             'message': str(e)
@@ -322,8 +2018,7 @@ def cluster_faces(min_cluster_size: int = 3, distance_threshold: float = 0.4):
         
         for face in faces:
             face_ids.append(face.face_id)
-            embedding = json.loads(face.embedding) if isinstance(face.embedding, str) else face.embedding
-            embeddings.append(embedding)
+            embeddings.append(_coerce_embedding(face.embedding))
         
         # Convert to numpy array
         X = np.array(embeddings)
@@ -359,11 +2054,11 @@ def cluster_faces(min_cluster_size: int = 3, distance_threshold: float = 0.4):
     finally:
         session.close()
 
-def save_face_to_db(session: Session, file_id: int, face_data: dict):
+def build_face_record(file_id: int, face_data: dict) -> Face:
     """
-    Save face data to database
+    Face row for a face dictionary
     """
-    face = Face(
+    return Face(
         file_id=file_id,
         face_id=face_data['face_id'],
         embedding=face_data['embedding'],
@@ -374,13 +2069,24 @@ def save_face_to_db(session: Session, file_id: int, face_data: dict):
         frame_number=face_data.get('frame_number'),
         timestamp=face_data.get('timestamp'),
         face_image_path=face_data.get('face_image_path'),
+        track_id=face_data.get('track_id'),
+        track_start=face_data.get('track_start'),
+        track_end=face_data.get('track_end'),
         age=face_data.get('age'),
         gender=face_data.get('gender'),
         emotion=face_data.get('emotion')
     )
+
+def save_face_to_db(session: Session, file_id: int, face_data: dict):
+    """
+    Save face data to database
+    """
+    face = build_face_record(file_id, face_data)
     
     session.add(face)
     session.commit()
+    
+    _add_to_live_indexes(face_data)
 
 @celery_app.task(bind=True)
 def process_batch_files(self, file_batch: List[Dict]):
@@ -425,13 +2131,16 @@ def process_batch_files(self, file_batch: List[Dict]):
                 if file_type == 'image':
                     faces = face_processor.process_image(file_path)
                 elif file_type == 'video':
-                    faces = face_processor.process_video(file_path, frame_interval=30)
+                    faces = face_processor.process_video(file_path, frame_interval=VIDEO_FRAME_INTERVAL)
                 else:
                     continue
                 
                 # Save faces to database
                 for face_data in faces:
                     save_face_to_db(session, file_id, face_data)
+                append_faces_to_store(faces)
+                if faces:
+                    cache_helper.bump_gallery_generation()
                 
                 # Update file record
                 file_record = session.query(UploadedFile).filter_by(id=file_id).first()
@@ -495,26 +2204,71 @@ def process_batch_files(self, file_batch: List[Dict]):
         session.close()
 
 @celery_app.task(bind=True)
-def process_batch_images_optimized(self, image_paths: List[str], batch_size: int = 8):
+def process_batch_images_optimized(self, image_paths: List[str], batch_size: int = 8,
+                                   detection_batch_size: int = None,
+                                   recognition_batch_size: int = None,
+                                   decode_workers: int = None):
     """
     Optimized batch processing for images using GPU efficiently
     
+    A thread pool reads and decodes images ahead of inference into a bounded
+    queue; each batch is detected with stacked detector forward passes and all
+    of its face chips are embedded together (see FaceProcessor.iter_image_batches).
+    
     Args:
         image_paths: List of image file paths
         batch_size: Number of images to process simultaneously
+        detection_batch_size: Images per detection forward pass (defaults to FACE_DETECTION_BATCH_SIZE)
+        recognition_batch_size: Face chips per recognition call (defaults to FACE_RECOGNITION_BATCH_SIZE)
+        decode_workers: Image decode threads (defaults to DECODE_WORKERS)
     """
     session = get_session()
     results = []
+    batch_stats = []
     
     try:
         total_images = len(image_paths)
         processed_images = 0
         total_faces = 0
+        start_time = time.time()
+        
+        current_task.update_state(
+            state='PROCESSING',
+            meta={
+                'current': 0,
+                'total': total_images,
+                'status': f'Processing {total_images} images in batches of {batch_size}'
+            }
+        )
         
-        # Process images in batches
-        for batch_start in range(0, total_images, batch_size):
-            batch_end = min(batch_start + batch_size, total_images)
-            batch_paths = image_paths[batch_start:batch_end]
+        # Decode ahead on a thread pool while batches run through the models
+        batches = face_processor.iter_image_batches(
+            image_paths, batch_size,
+            detection_batch_size=detection_batch_size,
+            recognition_batch_size=recognition_batch_size,
+            decode_workers=decode_workers
+        )
+        for batch_number, (batch_results, stats) in enumerate(batches, 1):
+            for batch_result in batch_results:
+                if batch_result['status'] == 'error':
+                    logger.error(f"Error processing image {batch_result['path']}: {batch_result['error']}")
+                total_faces += len(batch_result['faces'])
+            processed_images += len(batch_results)
+            results.extend(batch_results)
+            batch_stats.append(stats)
+            
+            pipeline = stats['pipeline']
+            logger.info("Image batch processed",
+                       batch=batch_number,
+                       images=stats['images'],
+                       faces=stats['faces'],
+                       detect_seconds=stats.get('detect_seconds'),
+                       embed_seconds=stats.get('embed_seconds'),
+                       images_per_second=stats.get('images_per_second'),
+                       faces_per_second=stats.get('faces_per_second'),
+                       decode_queue_depth=pipeline['queue_depth'],
+                       decode_wait_seconds=pipeline['consumer_wait_seconds'],
+                       decode_blocked_seconds=pipeline['producer_blocked_seconds'])
             
             # Update progress
             current_task.update_state(
@@ -522,36 +2276,12 @@ def process_batch_images_optimized(self, image_paths: List[str], batch_size: int
                 meta={
                     'current': processed_images,
                     'total': total_images,
-                    'status': f'Processing batch {batch_start//batch_size + 1}, images {batch_start+1}-{batch_end}'
+                    'status': f'Processed batch {batch_number}, {processed_images}/{total_images} images',
+                    'pipeline': pipeline
                 }
             )
-            
-            # Process batch of images
-            batch_results = []
-            for img_path in batch_paths:
-                try:
-                    faces = face_processor.process_image(img_path)
-                    batch_results.append({
-                        'path': img_path,
-                        'faces': faces,
-                        'status': 'success'
-                    })
-                    total_faces += len(faces)
-                except Exception as e:
-                    logger.error(f"Error processing image {img_path}: {str(e)}")
-                    batch_results.append({
-                        'path': img_path,
-                        'faces': [],
-                        'status': 'error',
-                        'error': str(e)
-                    })
-                
-                processed_images += 1
-            
-            results.extend(batch_results)
-            
-            # Small delay to prevent GPU overheating
-            time.sleep(0.1)
+        
+        duration = time.time() - start_time
         
         # Final update
         current_task.update_state(
@@ -569,6 +2299,9 @@ def process_batch_images_optimized(self, image_paths: List[str], batch_size: int
             'total_images': total_images,
             'processed_images': processed_images,
             'total_faces': total_faces,
+            'duration_seconds': duration,
+            'images_per_second': processed_images / duration if duration > 0 else 0.0,
+            'batch_stats': batch_stats,
             'results': results
         }
         
@@ -3,9 +3,11 @@ import click
 import os
 import glob
 from pathlib import Path
-from database_schema import get_session, UploadedFile, Face, init_db
-from celery_tasks import process_uploaded_file, search_similar_faces
+from database_schema import get_session, UploadedFile, Face, init_db, create_vector_index
+from celery_tasks import process_uploaded_file, search_similar_faces, find_faces_similar_to, rebuild_embedding_store, retrain_ivf_index
 from face_processor import FaceProcessor
+from filter_index import AGE_BUCKET_LABELS
+from search_service import search_service_client, SearchServiceUnavailable, SearchServiceTimeout
 import shutil
 import uuid
 import json
@@ -151,13 +153,90 @@ def batch(directory, recursive, pattern):
 @click.argument('query_image', type=click.Path(exists=True))
 @click.option('--threshold', default=0.6, help='Similarity threshold (0-1)')
 @click.option('--limit', default=10, help='Maximum results')
-def search(query_image, threshold, limit):
+@click.option('--backend', type=click.Choice(['memory', 'pgvector', 'mmap', 'sq8', 'pq', 'ivf', 'hnsw', 'sharded']), default=None,
+              help='Search backend (defaults to SEARCH_BACKEND)')
+@click.option('--all-faces', is_flag=True, help='Search with every face in the query image')
+@click.option('--file-id', 'file_ids', type=int, multiple=True, help='Only faces from this uploaded file (repeatable)')
+@click.option('--uploaded-after', default=None, help='Only files uploaded at or after this ISO date/time')
+@click.option('--uploaded-before', default=None, help='Only files uploaded at or before this ISO date/time')
+@click.option('--min-quality', type=float, default=None, help='Minimum face quality score')
+@click.option('--gender', 'genders', type=click.Choice(['male', 'female']), multiple=True,
+              help='Only faces of this gender (repeatable)')
+@click.option('--age-bucket', 'age_buckets', type=click.Choice(AGE_BUCKET_LABELS), multiple=True,
+              help='Only faces in this age bucket (repeatable)')
+def search(query_image, threshold, limit, backend, all_faces, file_ids, uploaded_after,
+           uploaded_before, min_quality, genders, age_buckets):
     """Search for similar faces"""
     
     click.echo(f"Searching for faces similar to: {query_image}")
     
+    filters = {
+        'file_ids': list(file_ids) or None,
+        'uploaded_after': uploaded_after,
+        'uploaded_before': uploaded_before,
+        'min_quality': min_quality,
+        'genders': list(genders) or None,
+        'age_buckets': list(age_buckets) or None
+    }
+    filters = {field: value for field, value in filters.items() if value is not None}
+    
     # Perform search
-    result = search_similar_faces(query_image, threshold, limit)
+    result = search_similar_faces(query_image, threshold, limit, backend, all_faces, filters or None)
+
+    if result['status'] == 'error':
+        click.echo(f"Error: {result['message']}", err=True)
+        return
+    
+    groups = result['query_faces'] if all_faces else [{'bbox': result['query_face']['bbox'], 'results': result['results']}]
+    
+    for group in groups:
+        if all_faces:
+            click.echo(f"\nQuery face at {group['bbox']}:")
+        
+        if not group['results']:
+            click.echo("No similar faces found")
+            continue
+        
+        # Display results
+        table_data = []
+        for r in group['results']:
+            table_data.append([
+                r['face_id'][:8] + '...',
+                f"{r['similarity']:.2%}",
+                r['file_name'],
+                r['quality_score'],
+                r['timestamp'] if r['timestamp'] else 'N/A'
+            ])
+        
+        headers = ['Face ID', 'Similarity', 'File', 'Quality', 'Timestamp']
+        click.echo("\nSearch Results:")
+        click.echo(tabulate(table_data, headers=headers, tablefmt='grid'))
+
+@cli.command()
+@click.argument('face_id')
+@click.option('--threshold', default=0.6, help='Similarity threshold (0-1)')
+@click.option('--limit', default=10, help='Maximum results')
+@click.option('--backend', type=click.Choice(['memory', 'pgvector', 'mmap', 'sq8', 'pq', 'ivf', 'hnsw']), default=None,
+              help='Search backend (defaults to the search service, else pgvector)')
+def similar(face_id, threshold, limit, backend):
+    """Find faces similar to an existing face, using its stored embedding"""
+    
+    # Prefer the warm search service, which holds the gallery index
+    try:
+        result = search_service_client.similar(face_id, threshold, limit, backend)
+    except (SearchServiceTimeout, SearchServiceUnavailable) as e:
+        if search_service_client.enabled:
+            click.echo(f"Search service unavailable, ranking in SQL: {e}", err=True)
+        result = None
+    
+    if result is None:
+        session = get_session()
+        try:
+            # This one-shot process has no warm index; loading the gallery
+            # for a single query costs far more than ranking it in SQL
+            result = find_faces_similar_to(session, face_id, threshold, limit, backend or 'pgvector')
+        finally:
+            session.close()
     
     if result['status'] == 'error':
         click.echo(f"Error: {result['message']}", err=True)
@@ -167,19 +246,14 @@ def search(query_image, threshold, limit):
         click.echo("No similar faces found")
         return
     
-    # Display results
-    table_data = []
-    for r in result['results']:
-        table_data.append([
-            r['face_id'][:8] + '...',
-            f"{r['similarity']:.2%}",
-            r['file_name'],
-            r['quality_score'],
-            r['timestamp'] if r['timestamp'] else 'N/A'
-        ])
-    
+    # Full face ids so results can be pivoted on again
+    table_data = [
+        [r['face_id'], f"{r['similarity']:.2%}", r['file_name'], r['quality_score'],
+         r['timestamp'] if r['timestamp'] else 'N/A']
+        for r in result['results']
+    ]
     headers = ['Face ID', 'Similarity', 'File', 'Quality', 'Timestamp']
-    click.echo("\nSearch Results:")
+    click.echo(f"\nFaces similar to {face_id}:")
     click.echo(tabulate(table_data, headers=headers, tablefmt='grid'))
 
 @cli.command()
@@ -258,11 +332,115 @@ def init():
     """Initialize the database"""
     click.echo("Initializing database...")
     try:
-        init_db()
+        engine = init_db()
+        click.echo("Building vector index (concurrently; inserts and searches keep running)...")
+        create_vector_index(engine)
         click.echo("Database initialized successfully!")
     except Exception as e:
         click.echo(f"Error: {str(e)}", err=True)
 
+@cli.command()
+@click.option('--type', 'index_type', type=click.Choice(['hnsw', 'ivfflat', 'none']),
+              default=None, help='Vector index type (defaults to VECTOR_INDEX_TYPE)')
+def reindex(index_type):
+    """Rebuild the pgvector similarity index on face embeddings"""
+    click.echo("Rebuilding vector index...")
+    try:
+        engine = init_db()
+        create_vector_index(engine, index_type=index_type, rebuild=True)
+        click.echo("Vector index rebuilt successfully!")
+    except Exception as e:
+        click.echo(f"Error: {str(e)}", err=True)
+
+@cli.command('rebuild-store')
+def rebuild_store():
+    """Rebuild the memory-mapped embedding store from the database"""
+    click.echo("Rebuilding embedding store...")
+    session = get_session()
+    try:
+        total = rebuild_embedding_store(session)
+        click.echo(f"Embedding store rebuilt with {total} faces")
+    except Exception as e:
+        click.echo(f"Error: {str(e)}", err=True)
+    finally:
+        session.close()
+
+@cli.command('retrain-ivf')
+@click.option('--nlist', type=int, default=None, help='Number of IVF lists (defaults to IVF_NLIST or 4*sqrt(faces))')
+@click.option('--sample-size', type=int, default=None, help='Faces sampled for k-means training')
+def retrain_ivf(nlist, sample_size):
+    """Retrain the IVF coarse centroids used by the 'ivf' search backend"""
+    click.echo("Training IVF centroids...")
+    result = retrain_ivf_index(nlist, sample_size)
+    if result['status'] == 'error':
+        click.echo(f"Error: {result['message']}", err=True)
+        return
+    click.echo(f"Trained {result['nlist']} IVF lists, saved to {result['centroids_path']}")
+
+@cli.command('build-hnsw')
+def build_hnsw():
+    """Build the HNSW graph used by the 'hnsw' search backend from the database
+    
+    Faces are inserted one at a time (roughly 4-5 ms each, about 8 minutes per
+    100K faces); above a few hundred thousand faces use the 'ivf' backend or
+    pgvector's HNSW index instead.
+    """
+    from celery_tasks import build_hnsw_index, HNSW_INDEX_PATH
+    
+    click.echo("Building HNSW index...")
+    session = get_session()
+    try:
+        index = build_hnsw_index(session)
+        click.echo(f"HNSW index built with {len(index)} faces, saved to {HNSW_INDEX_PATH}")
+    except Exception as e:
+        click.echo(f"Error: {str(e)}", err=True)
+    finally:
+        session.close()
+
+@cli.command('quantization-report')
+@click.option('--queries', default=50, help='Number of stored faces to use as queries')
+@click.option('--top-k', default=10, help='Results per query')
+@click.option('--rerank-factors', default='1,5,10,20', help='Comma-separated rerank factors to try')
+def quantization_report(queries, top_k, rerank_factors):
+    """Report recall/latency of compressed indexes against an exact scan"""
+    import time
+    import numpy as np
+    from celery_tasks import embedding_store, get_quantized_index
+    
+    store_size = len(embedding_store)
+    if store_size == 0:
+        click.echo("Embedding store is empty; run 'rebuild-store' first")
+        return
+    
+    rng = np.random.default_rng(0)
+    query_rows = rng.choice(store_size, size=min(queries, store_size), replace=False)
+    query_vectors = embedding_store.get_rows(query_rows)
+    
+    # Exact ground truth from a full scan of the store
+    start = time.time()
+    truth = [set(f for f, _ in embedding_store.search(q, 0.0, top_k)) for q in query_vectors]
+    exact_ms = (time.time() - start) * 1000 / len(query_vectors)
+    
+    table_data = [['exact', '-', '100.00%', f"{exact_ms:.2f}", f"{store_size * embedding_store.dim * 4 / 1e6:.1f}"]]
+    for mode in ('sq8', 'pq'):
+        index = get_quantized_index(mode)
+        if index is None:
+            click.echo(f"Not enough faces to train the {mode} index")
+            continue
+        for factor in [int(f) for f in rerank_factors.split(',')]:
+            hits = 0
+            start = time.time()
+            for q, expected in zip(query_vectors, truth):
+                rows, _ = index.search(q, 0.0, top_k, full_vectors=embedding_store.get_rows,
+                                       rerank_factor=factor)
+                hits += len(expected & set(embedding_store.face_ids_for(rows)))
+            latency_ms = (time.time() - start) * 1000 / len(query_vectors)
+            recall = hits / (len(query_vectors) * top_k)
+            table_data.append([mode, factor, f"{recall:.2%}", f"{latency_ms:.2f}", f"{index.memory_bytes() / 1e6:.1f}"])
+    
+    headers = ['Index', 'Rerank', f'Recall@{top_k}', 'Latency (ms)', 'Memory (MB)']
+    click.echo(tabulate(table_data, headers=headers, tablefmt='grid'))
+
 @cli.command()
 @click.option('--watch-folder', default='./data/watch', help='Folder to monitor')
 @click.option('--process-existing', is_flag=True, help='Process existing files')
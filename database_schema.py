@@ -39,6 +39,9 @@ class Face(Base):
     frame_number = Column(Integer)  # For videos
     timestamp = Column(Float)  # Video timestamp in seconds
     face_image_path = Column(String(500))  # Path to cropped face image
+    track_id = Column(String(100), index=True)  # Video face track this face represents
+    track_start = Column(Float)  # Track span in seconds
+    track_end = Column(Float)
     
     file = relationship("UploadedFile", back_populates="faces")
     
@@ -67,8 +70,133 @@ class SearchLog(Base):
     search_time = Column(Float)  # Search duration in milliseconds
     timestamp = Column(DateTime, server_default=func.now())
 
+# Vector index configuration
+VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'hnsw').lower()  # hnsw, ivfflat or none
+VECTOR_INDEX_NAMES = {
+    'hnsw': 'ix_faces_embedding_hnsw',
+    'ivfflat': 'ix_faces_embedding_ivfflat',
+}
+HNSW_M = int(os.getenv('HNSW_M', 16))
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', 64))
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', 100))
+HNSW_MAX_EF_SEARCH = 1000  # pgvector's upper bound for hnsw.ef_search
+IVFFLAT_LISTS = int(os.getenv('IVFFLAT_LISTS', 0))  # 0 = derive from row count
+IVFFLAT_PROBES = int(os.getenv('IVFFLAT_PROBES', 10))
+
+_schema_checked = False
+
+def create_vector_index(engine, index_type: str = None, rebuild: bool = False):
+    """
+    Create the ANN index on faces.embedding and drop indexes of other types
+    
+    Indexes are built and dropped CONCURRENTLY, so inserts and searches keep
+    running during a long build. This is an administrative step (`cli_tool.py
+    init` / `reindex`), never run implicitly on process start. A rebuild
+    creates the new index under a temporary name and swaps it in, so searches
+    are never left without an index.
+    
+    Args:
+        engine: SQLAlchemy engine
+        index_type: 'hnsw', 'ivfflat' or 'none' (defaults to VECTOR_INDEX_TYPE)
+        rebuild: Drop and recreate the index even if it already exists
+    """
+    index_type = (index_type or VECTOR_INDEX_TYPE).lower()
+    if index_type not in VECTOR_INDEX_NAMES and index_type != 'none':
+        raise ValueError(f"Unsupported vector index type: {index_type}")
+    
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for name_type, index_name in VECTOR_INDEX_NAMES.items():
+            if name_type != index_type:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+        if index_type == 'none':
+            return
+        
+        if index_type == 'hnsw':
+            method = f"hnsw (embedding vector_cosine_ops) WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+        else:
+            # IVFFlat centroids are trained from existing rows, so size lists from the table
+            lists = IVFFLAT_LISTS
+            if lists <= 0:
+                row_count = conn.execute(text("SELECT count(*) FROM faces")).scalar() or 0
+                lists = max(1, int(row_count / 1000) if row_count <= 1000000 else int(row_count ** 0.5))
+            method = f"ivfflat (embedding vector_cosine_ops) WITH (lists = {lists})"
+        
+        index_name = VECTOR_INDEX_NAMES[index_type]
+        exists = conn.execute(
+            text("SELECT 1 FROM pg_indexes WHERE indexname = :name"), {'name': index_name}
+        ).scalar()
+        if exists and not rebuild:
+            return
+        
+        # A failed concurrent build leaves an invalid index behind; clear it first
+        build_name = f"{index_name}_new" if exists else index_name
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {build_name}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY {build_name} ON faces USING {method}"))
+        if build_name != index_name:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+            conn.execute(text(f"ALTER INDEX {build_name} RENAME TO {index_name}"))
+
+def set_vector_search_params(session, ef_search: int = None, probes: int = None, exact: bool = False):
+    """
+    Apply ANN search parameters to the current transaction
+    
+    Args:
+        session: Database session
+        ef_search: HNSW candidate list size (higher = better recall, slower);
+            an HNSW scan returns at most this many rows
+        probes: Number of IVFFlat lists to scan
+        exact: Disable index scans so the query ranks every matching row
+    """
+    ef_search = min(int(ef_search or HNSW_EF_SEARCH), HNSW_MAX_EF_SEARCH)
+    probes = int(probes or IVFFLAT_PROBES)
+    session.execute(text(f"SET LOCAL hnsw.ef_search = {ef_search}"))
+    session.execute(text(f"SET LOCAL ivfflat.probes = {probes}"))
+    if exact:
+        session.execute(text("SET LOCAL enable_indexscan = off"))
+
+def reset_vector_search_params(session):
+    """
+    Restore the ANN search parameters set by set_vector_search_params
+    
+    SET LOCAL lasts until the transaction ends, so later queries in the same
+    transaction would otherwise run with index scans disabled.
+    """
+    session.execute(text("RESET hnsw.ef_search"))
+    session.execute(text("RESET ivfflat.probes"))
+    session.execute(text("RESET enable_indexscan"))
+
 # Database initialization
+def add_track_columns(engine):
+    """
+    Add the face track columns to a faces table created before they existed
+    
+    The catalog is checked first so a current schema takes no ALTER TABLE
+    (ACCESS EXCLUSIVE) or CREATE INDEX lock on faces.
+    """
+    columns = {'track_id': 'VARCHAR(100)', 'track_start': 'FLOAT', 'track_end': 'FLOAT'}
+    with engine.connect() as conn:
+        existing = {row[0] for row in conn.execute(text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = 'faces'"
+        ))}
+        has_index = conn.execute(text(
+            "SELECT 1 FROM pg_indexes WHERE schemaname = current_schema() "
+            "AND tablename = 'faces' AND indexname = 'ix_faces_track_id'"
+        )).first() is not None
+        missing = [name for name in columns if name not in existing]
+        if not missing and has_index:
+            return
+        
+        for name in missing:
+            conn.execute(text(f"ALTER TABLE faces ADD COLUMN IF NOT EXISTS {name} {columns[name]}"))
+        if not has_index:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_faces_track_id ON faces (track_id)"))
+        conn.commit()
+
 def init_db():
+    global _schema_checked
+    
     engine = create_engine(os.getenv('DATABASE_URL'))
     
     # Create pgvector extension
@@ -79,6 +207,11 @@ def init_db():
     # Create all tables
     Base.metadata.create_all(engine)
     
+    # Add missing columns once per process (the vector index is built by `cli_tool.py init`)
+    if not _schema_checked:
+        add_track_columns(engine)
+        _schema_checked = True
+    
     return engine
 
 def get_session():
@@ -88,5 +221,5 @@ def get_session():
 
 if __name__ == "__main__":
     # Initialize database when running this script directly
-    init_db()
+    create_vector_index(init_db())
     print("Database initialized successfully!")
@@ -0,0 +1,405 @@
+# embedding_store.py
+import os
+import json
+import threading
+import logging
+import numpy as np
+from contextlib import contextmanager
+from typing import List, Tuple, Iterable, Iterator, Optional
+
+from search_index import EMBEDDING_DIM, normalize_embeddings, cosine_to_similarity, select_top_k, block_top_k
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+FACE_ID_WIDTH = 64  # Bytes reserved per face_id in the offset table
+MANIFEST_FILE = 'manifest.json'
+COUNT_FILE = 'count'
+IDS_FILE = 'face_ids.bin'
+LOCK_FILE = '.lock'
+
+
+class EmbeddingStore:
+    """
+    Append-only, memory-mapped embedding store
+
+    Embeddings live in fixed-capacity shard files of L2-normalized float32 or
+    float16 rows, with a parallel fixed-width face_id table. Readers map the
+    files read-only, so every process on the host shares the same page cache
+    instead of holding its own copy. Appends are serialized with a file lock
+    and published by bumping the row count last.
+    """
+
+    def __init__(self, root: str = None, dim: int = EMBEDDING_DIM,
+                 dtype: str = None, shard_rows: int = None):
+        """
+        Open (or create) a store
+
+        Args:
+            root: Directory holding the store (defaults to EMBEDDINGS_FOLDER)
+            dim: Embedding dimensionality
+            dtype: 'float32' or 'float16' (only used when creating a new store)
+            shard_rows: Rows per shard file (only used when creating a new store)
+        """
+        self.root = root or os.getenv('EMBEDDINGS_FOLDER', './data/embeddings')
+        os.makedirs(self.root, exist_ok=True)
+
+        manifest_path = os.path.join(self.root, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        else:
+            manifest = {
+                'dim': dim,
+                'dtype': dtype or os.getenv('EMBEDDING_STORE_DTYPE', 'float32'),
+                'shard_rows': int(shard_rows or os.getenv('EMBEDDING_STORE_SHARD_ROWS', 262144)),
+                'face_id_width': FACE_ID_WIDTH
+            }
+            with self._locked():
+                if not os.path.exists(manifest_path):
+                    with open(manifest_path, 'w') as f:
+                        json.dump(manifest, f)
+
+        self.dim = manifest['dim']
+        self.dtype = np.dtype(manifest['dtype'])
+        self.shard_rows = manifest['shard_rows']
+        self.id_dtype = np.dtype(f"S{manifest['face_id_width']}")
+
+        self._shards = {}
+        self._ids = None
+        self._ids_rows = 0
+        self._epoch = 0
+        self._thread_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # File helpers
+    # ------------------------------------------------------------------
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _shard_path(self, shard: int) -> str:
+        return self._path(f"shard_{shard:05d}.{self.dtype.name}")
+
+    @contextmanager
+    def _locked(self):
+        """Hold an exclusive cross-process lock on the store"""
+        with open(os.path.join(self.root, LOCK_FILE), 'a') as lock_file:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_state(self) -> Tuple[int, int]:
+        """Return the committed (row_count, epoch); epoch changes when the store is cleared"""
+        try:
+            with open(self._path(COUNT_FILE), 'rb') as f:
+                count, epoch = np.frombuffer(f.read(16), dtype='<i8')
+                return int(count), int(epoch)
+        except (FileNotFoundError, ValueError):
+            return 0, 0
+
+    def _read_count(self) -> int:
+        count, epoch = self._read_state()
+        with self._thread_lock:
+            if epoch != self._epoch:
+                # Store was cleared by some process; drop stale mappings
+                self._shards = {}
+                self._ids = None
+                self._ids_rows = 0
+                self._epoch = epoch
+        return count
+
+    def _write_state(self, count: int, epoch: int):
+        tmp_path = self._path(COUNT_FILE + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(np.array([count, epoch], dtype='<i8').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(COUNT_FILE))
+
+    def _ensure_file(self, path: str, size: int):
+        """Create or extend a file to `size` bytes (sparse on most filesystems)"""
+        with open(path, 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+
+    def _shard(self, shard: int) -> np.memmap:
+        """Read-only mapping of a shard, cached per process"""
+        mapping = self._shards.get(shard)
+        if mapping is None:
+            mapping = np.memmap(self._shard_path(shard), dtype=self.dtype, mode='r',
+                                shape=(self.shard_rows, self.dim))
+            self._shards[shard] = mapping
+        return mapping
+
+    def _id_table(self, rows: int) -> np.ndarray:
+        """Read-only mapping of the face_id table covering at least `rows` rows"""
+        if self._ids is None or self._ids_rows < rows:
+            self._ids = np.memmap(self._path(IDS_FILE), dtype=self.id_dtype, mode='r',
+                                  shape=(rows,))
+            self._ids_rows = rows
+        return self._ids
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return self._read_count()
+
+    @property
+    def epoch(self) -> int:
+        """Counter bumped whenever the store is cleared, so derived indexes know to rebuild"""
+        return self._read_state()[1]
+
+    def append(self, face_ids: Iterable[str], embeddings) -> int:
+        """
+        Append embeddings to the store
+
+        Args:
+            face_ids: Face identifiers, one per embedding
+            embeddings: Sequence or 2-D array of embeddings
+
+        Returns:
+            Number of rows appended
+        """
+        face_ids = list(face_ids)
+        if not face_ids:
+            return 0
+
+        vectors = normalize_embeddings(embeddings)
+        if vectors.shape != (len(face_ids), self.dim):
+            raise ValueError(
+                f"Expected {len(face_ids)} embeddings of dimension {self.dim}, got {vectors.shape}"
+            )
+        encoded_ids = np.array([face_id.encode('ascii') for face_id in face_ids], dtype=self.id_dtype)
+
+        with self._locked():
+            start, epoch = self._read_state()
+            end = start + len(face_ids)
+
+            # Face id table
+            ids_path = self._path(IDS_FILE)
+            self._ensure_file(ids_path, end * self.id_dtype.itemsize)
+            ids = np.memmap(ids_path, dtype=self.id_dtype, mode='r+', shape=(end,))
+            ids[start:end] = encoded_ids
+            ids.flush()
+            del ids
+
+            # Embedding shards, written one shard-sized slice at a time
+            written = 0
+            while written < len(face_ids):
+                row = start + written
+                shard, offset = divmod(row, self.shard_rows)
+                take = min(self.shard_rows - offset, len(face_ids) - written)
+
+                shard_path = self._shard_path(shard)
+                self._ensure_file(shard_path, self.shard_rows * self.dim * self.dtype.itemsize)
+                mapping = np.memmap(shard_path, dtype=self.dtype, mode='r+',
+                                    shape=(self.shard_rows, self.dim))
+                mapping[offset:offset + take] = vectors[written:written + take]
+                mapping.flush()
+                del mapping
+
+                written += take
+
+            # Publish the new rows only once their data is on disk
+            self._write_state(end, epoch)
+
+        return len(face_ids)
+
+    def iter_chunks(self, chunk_rows: int = 16384, start_row: int = 0,
+                    end_row: int = None) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Iterate over committed rows as zero-copy views
+
+        Args:
+            chunk_rows: Maximum rows per chunk
+            start_row: First row to yield
+            end_row: Stop before this row (defaults to the committed count)
+
+        Yields:
+            (start_row, embedding_view) tuples
+        """
+        count = self._read_count()
+        if end_row is not None:
+            count = min(count, end_row)
+        row = start_row
+        while row < count:
+            shard, offset = divmod(row, self.shard_rows)
+            take = min(self.shard_rows - offset, count - row, chunk_rows)
+            with self._thread_lock:
+                mapping = self._shard(shard)
+            yield row, mapping[offset:offset + take]
+            row += take
+
+    def get_rows(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Gather embeddings for arbitrary row numbers
+
+        Args:
+            rows: 1-D array of row numbers
+
+        Returns:
+            (len(rows), dim) float32 array
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.empty((len(rows), self.dim), dtype=np.float32)
+        shards, offsets = np.divmod(rows, self.shard_rows)
+        for shard in np.unique(shards):
+            mask = shards == shard
+            with self._thread_lock:
+                mapping = self._shard(int(shard))
+            result[mask] = mapping[offsets[mask]]
+        return result
+
+    def face_ids_for(self, rows: np.ndarray, count: int = None) -> List[str]:
+        """Resolve row numbers to face ids"""
+        count = count or self._read_count()
+        with self._thread_lock:
+            ids = self._id_table(count)
+        return [ids[row].decode('ascii') for row in rows]
+
+    def search(self, query_embedding, threshold: float = 0.6, top_k: int = 10,
+               chunk_rows: int = 16384) -> List[Tuple[str, float]]:
+        """
+        Scan the store for the most similar faces to a query embedding
+
+        Args:
+            query_embedding: Query face embedding
+            threshold: Similarity threshold (0-1)
+            top_k: Return top k results
+            chunk_rows: Rows scored per matrix-vector product
+
+        Returns:
+            List of (face_id, similarity_score) tuples, best first
+        """
+        query = normalize_embeddings(query_embedding)[0]
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        count = 0
+        for start, chunk in self.iter_chunks(chunk_rows):
+            # float32 shards are scored in place; float16 chunks are upcast
+            # one chunk at a time since BLAS has no half-precision GEMV
+            scores = cosine_to_similarity(np.asarray(chunk, dtype=np.float32) @ query)
+            keep = select_top_k(scores, threshold, top_k)
+            best_rows = np.concatenate([best_rows, keep + start])
+            best_scores = np.concatenate([best_scores, scores[keep]])
+            count = start + len(chunk)
+
+        if best_rows.size == 0:
+            return []
+
+        order = select_top_k(best_scores, threshold, top_k)
+        face_ids = self.face_ids_for(best_rows[order], count)
+        return [(face_id, float(best_scores[i])) for face_id, i in zip(face_ids, order)]
+
+    def search_batch(self, query_embeddings, threshold: float = 0.6, top_k: int = 10,
+                     chunk_rows: int = 16384) -> List[List[Tuple[str, float]]]:
+        """
+        Scan the store once for many query embeddings
+
+        Args:
+            query_embeddings: Sequence or 2-D array of query embeddings
+            threshold: Similarity threshold (0-1)
+            top_k: Return top k results per query
+            chunk_rows: Rows scored per matrix-matrix product
+
+        Returns:
+            One list of (face_id, similarity_score) tuples per query, best first
+        """
+        queries = normalize_embeddings(query_embeddings)
+
+        best_rows = []
+        best_scores = []
+        count = 0
+        for start, chunk in self.iter_chunks(chunk_rows):
+            scores = cosine_to_similarity(queries @ np.asarray(chunk, dtype=np.float32).T)
+            keep = block_top_k(scores, top_k)
+            best_rows.append(keep + start)
+            best_scores.append(np.take_along_axis(scores, keep, axis=1))
+            count = start + len(chunk)
+
+        if not best_rows or top_k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        rows = np.hstack(best_rows)
+        scores = np.hstack(best_scores)
+        results = []
+        for row_rows, row_scores in zip(rows, scores):
+            order = select_top_k(row_scores, threshold, top_k)
+            face_ids = self.face_ids_for(row_rows[order], count)
+            results.append([(face_id, float(row_scores[i])) for face_id, i in zip(face_ids, order)])
+        return results
+
+    def iter_search_batch(self, query_embeddings, threshold: float = 0.6, top_k: int = 10,
+                          chunk_rows: int = 16384) -> Iterator[Tuple[int, int, List[List[Tuple[str, float]]]]]:
+        """
+        Scan the store chunk by chunk, yielding the running top-k after every chunk
+
+        Lets callers show the best candidates found so far and stop the scan
+        early. Hits are row numbers so that chunks nobody looks at cost no id
+        lookups; resolve_rows turns the last results into what search_batch
+        returns.
+
+        Args:
+            query_embeddings: Sequence or 2-D array of query embeddings
+            threshold: Similarity threshold (0-1)
+            top_k: Return top k results per query
+            chunk_rows: Rows scored per matrix-matrix product
+
+        Yields:
+            (rows_scanned, total_rows, results) tuples, where results holds one
+            list of (row, similarity_score) tuples per query, best first
+        """
+        queries = normalize_embeddings(query_embeddings)
+        total = self._read_count()
+        if top_k <= 0:
+            return
+
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start, chunk in self.iter_chunks(chunk_rows, end_row=total):
+            scores = cosine_to_similarity(queries @ np.asarray(chunk, dtype=np.float32).T)
+            keep = block_top_k(scores, top_k)
+
+            # Merge the chunk's best rows into the running top-k of every query
+            rows = np.hstack([best_rows, keep + start])
+            scores = np.hstack([best_scores, np.take_along_axis(scores, keep, axis=1)])
+            keep = block_top_k(scores, top_k)
+            best_rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+
+            results = []
+            for row_rows, row_scores in zip(best_rows, best_scores):
+                order = select_top_k(row_scores, threshold, top_k)
+                results.append([(int(row_rows[i]), float(row_scores[i])) for i in order])
+            yield start + len(chunk), total, results
+
+    def resolve_rows(self, results: List[List[Tuple[int, float]]],
+                     count: int = None) -> List[List[Tuple[str, float]]]:
+        """Replace the row numbers of iter_search_batch results with face ids"""
+        resolved = []
+        for hits in results:
+            face_ids = self.face_ids_for([row for row, _ in hits], count)
+            resolved.append([(face_id, score) for face_id, (_, score) in zip(face_ids, hits)])
+        return resolved
+
+    def clear(self):
+        """Remove all rows from the store"""
+        with self._locked():
+            _, epoch = self._read_state()
+            self._write_state(0, epoch + 1)
+            for name in os.listdir(self.root):
+                if name.startswith('shard_') or name == IDS_FILE:
+                    os.remove(self._path(name))
@@ -3,16 +3,24 @@ import cv2
 import numpy as np
 import insightface
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from insightface.utils import face_align
+from insightface.model_zoo.scrfd import distance2bbox, distance2kps
 import os
 import json
 import uuid
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterator
 import logging
 from PIL import Image
 import io
 import psutil
 import platform
 import subprocess
+import time
+from search_index import normalize_embeddings, cosine_to_similarity, select_top_k
+from image_pipeline import ImagePrefetcher, read_image_reduced, IMAGE_REDUCED_DECODE
+from video_sampler import FrameSampler, MotionGate, VIDEO_SAMPLE_FPS, VIDEO_MOTION_GATING
+from face_tracker import FaceTracker, Track, VIDEO_FACE_TRACKING
 
 try:
     import onnxruntime as ort
@@ -26,6 +34,10 @@ try:
 except ImportError:
     TORCH_AVAILABLE = False
 
+# Batched inference: images per detection forward pass, face chips per recognition call
+DETECTION_BATCH_SIZE = int(os.getenv('FACE_DETECTION_BATCH_SIZE', 8))
+RECOGNITION_BATCH_SIZE = int(os.getenv('FACE_RECOGNITION_BATCH_SIZE', 64))
+
 class FaceProcessor:
     def __init__(self, model_name='buffalo_l', ctx_id=0, det_size=(640, 640)):
         """
@@ -48,21 +60,29 @@ class FaceProcessor:
         """
         Process a single image and extract faces
         
+        With IMAGE_REDUCED_DECODE, images much larger than the detector input
+        are detected on a reduced decode (see read_image_reduced) and decoded
+        at full resolution only when faces were found, for aligning, scoring
+        and cropping them. Other images are decoded once, at full size.
+        
         Args:
             image_path: Path to image file
             save_faces: Whether to save cropped face images
-            
+        
         Returns:
             List of face dictionaries with embeddings and metadata
         """
         try:
-            # Read image
-            img = cv2.imread(image_path)
-            if img is None:
-                raise ValueError(f"Cannot read image: {image_path}")
-            
-            # Detect faces
-            faces = self.app.get(img)
+            if IMAGE_REDUCED_DECODE:
+                faces, img = self._detect_reduced(image_path)
+            else:
+                # Read image
+                img = cv2.imread(image_path)
+                if img is None:
+                    raise ValueError(f"Cannot read image: {image_path}")
+                
+                # Detect faces
+                faces = self.app.get(img)
             
             results = []
             for idx, face in enumerate(faces):
@@ -75,62 +95,443 @@ class FaceProcessor:
             self.logger.error(f"Error processing image {image_path}: {str(e)}")
             raise
     
+    def _detect_reduced(self, image_path: str) -> Tuple[List[Face], Optional[np.ndarray]]:
+        """
+        Detect faces on a reduced decode, then embed them from the full-resolution image
+        
+        Returns:
+            (faces with full-resolution coordinates and all model outputs,
+            full-resolution image or None when no face was found)
+        """
+        img, scale = read_image_reduced(image_path, self._reduced_min_side())
+        if img is None:
+            raise ValueError(f"Cannot read image: {image_path}")
+        
+        faces = self.detect_batch([img])[0]
+        if not faces:
+            return [], None
+        
+        if scale != (1.0, 1.0):
+            del img
+            img = self._read_full_resolution(image_path, faces, scale)
+        
+        self.embed_faces([img] * len(faces), faces)
+        for face in faces:
+            for taskname, model in self.app.models.items():
+                if taskname not in ('detection', 'recognition'):
+                    model.get(img, face)
+        return faces, img
+    
+    def _reduced_min_side(self) -> int:
+        """Smallest long side a reduced decode may have: the detector input size"""
+        return max(self.app.det_model.input_size)
+    
+    def _read_full_resolution(self, image_path: str, faces: List[Face],
+                              scale: Tuple[float, float]) -> np.ndarray:
+        """Decode an image at full size and map faces detected on its reduced decode onto it"""
+        img = cv2.imread(image_path)
+        if img is None:
+            raise ValueError(f"Cannot read image: {image_path}")
+        scale_x, scale_y = scale
+        for face in faces:
+            face.bbox = face.bbox * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+            if face.kps is not None:
+                face.kps = face.kps * np.array([scale_x, scale_y], dtype=np.float32)
+        return img
+    
+    def process_images_batch(self, image_paths: List[str], save_faces: bool = True,
+                             detection_batch_size: int = None,
+                             recognition_batch_size: int = None) -> Tuple[List[Dict], Dict]:
+        """
+        Process several images with batched model inference
+        
+        Detection runs over letterboxed images stacked into one tensor per
+        detection batch, and the aligned chips of every face found in the
+        batch are embedded with one recognition call per recognition batch.
+        With IMAGE_REDUCED_DECODE, large images are read as in process_image.
+        
+        Args:
+            image_paths: Paths to image files
+            save_faces: Whether to save cropped face images
+            detection_batch_size: Images per detection forward pass
+            recognition_batch_size: Face chips per recognition call
+        
+        Returns:
+            (results, stats): one {'path', 'faces', 'status'[, 'error']} dict
+            per image, in input order, and timing/throughput stats for the batch
+        """
+        start_time = time.time()
+        images, errors, scales = {}, {}, {}
+        for i, path in enumerate(image_paths):
+            if IMAGE_REDUCED_DECODE:
+                img, scales[i] = read_image_reduced(path, self._reduced_min_side())
+            else:
+                img = cv2.imread(path)
+            if img is None:
+                errors[i] = f"Cannot read image: {path}"
+            else:
+                images[i] = img
+        read_seconds = time.time() - start_time
+        
+        results, stats = self._process_decoded_batch(image_paths, images, errors, save_faces,
+                                                     detection_batch_size, recognition_batch_size,
+                                                     scales)
+        stats['read_seconds'] = read_seconds
+        stats['duration_seconds'] += read_seconds
+        duration = stats['duration_seconds']
+        stats['images_per_second'] = len(image_paths) / duration if duration > 0 else 0.0
+        stats['faces_per_second'] = stats['faces'] / duration if duration > 0 else 0.0
+        return results, stats
+    
+    def iter_image_batches(self, image_paths: List[str], batch_size: int = 8, save_faces: bool = True,
+                           detection_batch_size: int = None, recognition_batch_size: int = None,
+                           decode_workers: int = None,
+                           decode_queue_size: int = None) -> Iterator[Tuple[List[Dict], Dict]]:
+        """
+        Process images in batches while a thread pool decodes the next ones
+        
+        Images are read and decoded by an ImagePrefetcher into a bounded queue
+        and reach inference in completion order, so batches may not follow
+        the input order; every result carries its 'path'.
+        
+        Args:
+            image_paths: Paths to image files
+            batch_size: Images per inference batch
+            save_faces: Whether to save cropped face images
+            detection_batch_size: Images per detection forward pass
+            recognition_batch_size: Face chips per recognition call
+            decode_workers: Decode threads (defaults to DECODE_WORKERS)
+            decode_queue_size: Decoded images allowed to wait (defaults to DECODE_QUEUE_SIZE)
+        
+        Yields:
+            (results, stats) per batch, as process_images_batch returns them,
+            with stats['pipeline'] holding the prefetcher's queue depths and timings
+        """
+        reduced_min_side = self._reduced_min_side() if IMAGE_REDUCED_DECODE else None
+        with ImagePrefetcher(image_paths, decode_workers, decode_queue_size, reduced_min_side) as prefetcher:
+            for batch in prefetcher.batches(batch_size):
+                paths = [item.path for item in batch]
+                images = {i: item.image for i, item in enumerate(batch) if item.error is None}
+                errors = {i: item.error for i, item in enumerate(batch) if item.error is not None}
+                scales = {i: item.scale for i, item in enumerate(batch) if item.error is None}
+                try:
+                    results, stats = self._process_decoded_batch(paths, images, errors, save_faces,
+                                                                 detection_batch_size, recognition_batch_size,
+                                                                 scales)
+                except Exception as e:
+                    self.logger.error(f"Error processing image batch: {str(e)}")
+                    results = [{'path': path, 'faces': [], 'status': 'error', 'error': str(e)} for path in paths]
+                    stats = {'images': len(paths), 'faces': 0}
+                stats['pipeline'] = prefetcher.stats()
+                yield results, stats
+    
+    def _process_decoded_batch(self, image_paths: List[str], images: Dict[int, np.ndarray],
+                               errors: Dict[int, str], save_faces: bool = True,
+                               detection_batch_size: int = None,
+                               recognition_batch_size: int = None,
+                               scales: Dict[int, Tuple[float, float]] = None) -> Tuple[List[Dict], Dict]:
+        """
+        Run batched inference over already decoded images (keyed by position in image_paths)
+        
+        scales holds the (scale_x, scale_y) of images decoded reduced; those
+        with faces are decoded again at full resolution after detection.
+        """
+        start_time = time.time()
+        results = [{'path': path, 'faces': [], 'status': 'success'} for path in image_paths]
+        for i, error in errors.items():
+            results[i].update(status='error', error=error)
+        
+        # Detect faces, one letterboxed tensor per detection batch
+        detect_start = time.time()
+        detections = self.detect_batch(list(images.values()), detection_batch_size)
+        detected = dict(zip(images.keys(), detections))
+        for i, scale in (scales or {}).items():
+            if scale == (1.0, 1.0) or not detected.get(i):
+                continue
+            try:
+                images[i] = self._read_full_resolution(image_paths[i], detected[i], scale)
+            except ValueError as e:
+                results[i].update(status='error', error=str(e))
+                detected[i] = []
+        detect_seconds = time.time() - detect_start
+        
+        # Align and embed every face of the batch together
+        embed_start = time.time()
+        pairs = [(images[i], face) for i, faces in detected.items() for face in faces]
+        self.embed_faces([img for img, _ in pairs], [face for _, face in pairs], recognition_batch_size)
+        embed_seconds = time.time() - embed_start
+        
+        # Remaining per-face models (landmarks/pose, gender/age), as FaceAnalysis.get runs them
+        for img, face in pairs:
+            for taskname, model in self.app.models.items():
+                if taskname not in ('detection', 'recognition'):
+                    model.get(img, face)
+        
+        for i, faces in detected.items():
+            try:
+                results[i]['faces'] = [
+                    self._extract_face_data(face, images[i], idx, image_paths[i], save_faces)
+                    for idx, face in enumerate(faces)
+                ]
+            except Exception as e:
+                self.logger.error(f"Error processing image {image_paths[i]}: {str(e)}")
+                results[i].update(status='error', error=str(e), faces=[])
+        
+        duration = time.time() - start_time
+        stats = {
+            'images': len(image_paths),
+            'faces': len(pairs),
+            'detect_seconds': detect_seconds,
+            'embed_seconds': embed_seconds,
+            'duration_seconds': duration,
+            'images_per_second': len(image_paths) / duration if duration > 0 else 0.0,
+            'faces_per_second': len(pairs) / duration if duration > 0 else 0.0
+        }
+        return results, stats
+    
+    def detect_batch(self, images: List[np.ndarray], batch_size: int = None) -> List[List[Face]]:
+        """
+        Detect faces in several images with batched detector forward passes
+        
+        Images are letterboxed (aspect-preserving resize, zero padding at the
+        bottom/right) to the detector input size and stacked into one tensor.
+        Detector models exported with a fixed batch size of 1 fall back to one
+        forward pass per image.
+        
+        Args:
+            images: BGR images
+            batch_size: Images per forward pass (defaults to DETECTION_BATCH_SIZE)
+        
+        Returns:
+            One list of Face objects (bbox, kps, det_score) per image
+        """
+        det = self.app.det_model
+        batch_size = batch_size or DETECTION_BATCH_SIZE
+        if not getattr(det, 'batched', False):
+            return [self._faces_from_detections(*det.detect(img, max_num=0)) for img in images]
+        
+        input_w, input_h = det.input_size
+        results = []
+        for batch_start in range(0, len(images), batch_size):
+            batch = images[batch_start:batch_start + batch_size]
+            letterboxed = []
+            scales = []
+            for img in batch:
+                if img.shape[0] / img.shape[1] > input_h / input_w:
+                    new_h, new_w = input_h, int(input_h * img.shape[1] / img.shape[0])
+                else:
+                    new_h, new_w = int(input_w * img.shape[0] / img.shape[1]), input_w
+                canvas = np.zeros((input_h, input_w, 3), dtype=np.uint8)
+                canvas[:new_h, :new_w] = cv2.resize(img, (new_w, new_h))
+                letterboxed.append(canvas)
+                scales.append(new_h / img.shape[0])
+            
+            blob = cv2.dnn.blobFromImages(
+                letterboxed, 1.0 / det.input_std, (input_w, input_h),
+                (det.input_mean, det.input_mean, det.input_mean), swapRB=True
+            )
+            outputs = det.session.run(det.output_names, {det.input_name: blob})
+            for b, scale in enumerate(scales):
+                results.append(self._faces_from_detections(
+                    *self._decode_detections(det, outputs, b, input_h, input_w, scale)
+                ))
+        return results
+    
+    def _decode_detections(self, det, outputs, b: int, input_h: int, input_w: int,
+                           scale: float) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Decode one image of a batched SCRFD output into (bboxes+scores, keypoints)
+        in original image coordinates, after NMS
+        """
+        scores_list, bboxes_list, kpss_list = [], [], []
+        for idx, stride in enumerate(det._feat_stride_fpn):
+            scores = outputs[idx][b]
+            bbox_preds = outputs[idx + det.fmc][b] * stride
+            height, width = input_h // stride, input_w // stride
+            key = (height, width, stride)
+            anchor_centers = det.center_cache.get(key)
+            if anchor_centers is None:
+                anchor_centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+                anchor_centers = (anchor_centers * stride).reshape((-1, 2))
+                if det._num_anchors > 1:
+                    anchor_centers = np.stack([anchor_centers] * det._num_anchors, axis=1).reshape((-1, 2))
+                det.center_cache[key] = anchor_centers
+            
+            pos_inds = np.where(scores >= det.det_thresh)[0]
+            scores_list.append(scores[pos_inds])
+            bboxes_list.append(distance2bbox(anchor_centers, bbox_preds)[pos_inds])
+            if det.use_kps:
+                kps_preds = outputs[idx + det.fmc * 2][b] * stride
+                kpss = distance2kps(anchor_centers, kps_preds)
+                kpss_list.append(kpss.reshape((kpss.shape[0], -1, 2))[pos_inds])
+        
+        scores = np.vstack(scores_list)
+        order = scores.ravel().argsort()[::-1]
+        bboxes = np.vstack(bboxes_list) / scale
+        pre_det = np.hstack((bboxes, scores)).astype(np.float32, copy=False)[order, :]
+        keep = det.nms(pre_det)
+        kpss = None
+        if det.use_kps:
+            kpss = (np.vstack(kpss_list) / scale)[order, :, :][keep, :, :]
+        return pre_det[keep, :], kpss
+    
+    def _faces_from_detections(self, bboxes: np.ndarray, kpss: Optional[np.ndarray]) -> List[Face]:
+        return [
+            Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+            for i in range(bboxes.shape[0])
+        ]
+    
+    def embed_faces(self, images: List[np.ndarray], faces: List[Face], batch_size: int = None):
+        """
+        Align face chips and embed them with batched recognition calls
+        
+        Args:
+            images: Source image of each face
+            faces: Detected faces; their embedding attribute is set in place
+            batch_size: Chips per recognition call (defaults to RECOGNITION_BATCH_SIZE)
+        """
+        rec = self.app.models['recognition']
+        batch_size = batch_size or RECOGNITION_BATCH_SIZE
+        for batch_start in range(0, len(faces), batch_size):
+            batch_faces = faces[batch_start:batch_start + batch_size]
+            chips = [
+                face_align.norm_crop(img, landmark=face.kps, image_size=rec.input_size[0])
+                for img, face in zip(images[batch_start:batch_start + batch_size], batch_faces)
+            ]
+            embeddings = rec.get_feat(chips)
+            for face, embedding in zip(batch_faces, embeddings):
+                face.embedding = embedding.flatten()
+    
     def process_video(self, video_path: str, frame_interval: int = 30, 
-                     save_faces: bool = True, progress_callback=None) -> List[Dict]:
+                     save_faces: bool = True, progress_callback=None,
+                     sample_fps: float = None, motion_gating: bool = None,
+                     track_faces: bool = None, start_frame: int = 0,
+                     end_frame: int = None) -> List[Dict]:
         """
         Process video and extract faces from frames
         
+        Skipped frames are never converted to images (see FrameSampler), and
+        long gaps between samples are crossed by seeking. With motion gating,
+        sampled frames that did not change since the last detected frame skip
+        face detection (see MotionGate).
+        
+        With face tracking, detections are linked across sampled frames and
+        only new or uncertain faces are embedded (see FaceTracker). Each track
+        yields one face - its best-quality detection - with the track's time
+        span in track_start/track_end, plus up to TRACK_DIVERSE_SAMPLES extra
+        faces that look different from it.
+        
         Args:
             video_path: Path to video file
             frame_interval: Process every nth frame
             save_faces: Whether to save cropped face images
             progress_callback: Function to call with progress updates
-            
+            sample_fps: Process this many frames per second of video instead of
+                every nth frame (defaults to VIDEO_SAMPLE_FPS; 0 uses frame_interval)
+            motion_gating: Skip detection on static frames (defaults to VIDEO_MOTION_GATING)
+            track_faces: Keep one face per track instead of one per detection
+                (defaults to VIDEO_FACE_TRACKING)
+            start_frame: First frame of the segment to process
+            end_frame: Frame the segment ends before (None = end of video)
+        
         Returns:
             List of face dictionaries with embeddings and metadata
         """
         try:
             cap = cv2.VideoCapture(video_path)
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            fps = cap.get(cv2.CAP_PROP_FPS)
+            sampler = FrameSampler(cap, frame_interval, VIDEO_SAMPLE_FPS if sample_fps is None else sample_fps,
+                                   start_frame=start_frame, end_frame=end_frame)
+            total_frames = sampler.total_frames
+            segment_end = min(end_frame, total_frames) if end_frame is not None else total_frames
+            segment_frames = segment_end - sampler.start_frame
+            gate = MotionGate() if (VIDEO_MOTION_GATING if motion_gating is None else motion_gating) else None
+            tracker = FaceTracker() if (VIDEO_FACE_TRACKING if track_faces is None else track_faces) else None
             
             results = []
-            frame_count = 0
             processed_frames = 0
             
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
+            for frame_number, timestamp, frame in sampler:
+                if gate is not None and not gate.should_process(frame, timestamp):
+                    continue
                 
-                if frame_count % frame_interval == 0:
-                    # Detect faces in current frame
-                    faces = self.app.get(frame)
-                    
-                    for idx, face in enumerate(faces):
-                        face_data = self._extract_face_data(
-                            face, frame, idx, video_path, save_faces,
-                            frame_number=frame_count, 
-                            timestamp=frame_count / fps
-                        )
-                        results.append(face_data)
-                    
+                if tracker is not None:
+                    faces = self.detect_batch([frame])[0]
+                    qualities = [self._calculate_face_quality(face, frame, face.bbox.astype(int).tolist())
+                                 for face in faces]
+                    finished = tracker.update(
+                        faces, qualities, frame, frame_number, timestamp,
+                        lambda to_embed: self.embed_faces([frame] * len(to_embed), to_embed)
+                    )
+                    for track in finished:
+                        results.extend(self._track_face_data(track, video_path, save_faces))
                     processed_frames += 1
-                    
-                    # Progress callback
-                    if progress_callback:
-                        progress = (frame_count / total_frames) * 100
-                        progress_callback(progress, processed_frames, len(results))
+                    if progress_callback and segment_frames > 0:
+                        progress = ((frame_number - sampler.start_frame) / segment_frames) * 100
+                        progress_callback(progress, processed_frames, len(results) + len(tracker.active))
+                    continue
+                
+                # Detect faces in current frame
+                faces = self.app.get(frame)
+                
+                for idx, face in enumerate(faces):
+                    face_data = self._extract_face_data(
+                        face, frame, idx, video_path, save_faces,
+                        frame_number=frame_number, 
+                        timestamp=timestamp
+                    )
+                    results.append(face_data)
+                
+                processed_frames += 1
                 
-                frame_count += 1
+                # Progress callback
+                if progress_callback and segment_frames > 0:
+                    progress = ((frame_number - sampler.start_frame) / segment_frames) * 100
+                    progress_callback(progress, processed_frames, len(results))
+            
+            if tracker is not None:
+                for track in tracker.finish():
+                    results.extend(self._track_face_data(track, video_path, save_faces))
             
             cap.release()
+            self.logger.info(f"Sampled {sampler.stats['sampled']} frames of {video_path} "
+                             f"({sampler.stats['grabbed']} grabbed without decode to image, "
+                             f"{sampler.stats['seeks']} seeks)")
+            if gate is not None:
+                self.logger.info(f"Motion gating ran detection on {gate.stats['processed']} of "
+                                 f"{gate.stats['evaluated']} sampled frames ({gate.stats})")
+            if tracker is not None:
+                self.logger.info(f"Tracked {tracker.stats['detections']} detections into "
+                                 f"{tracker.stats['tracks']} tracks, embedding {tracker.stats['embedded']}")
             return results
             
         except Exception as e:
             self.logger.error(f"Error processing video {video_path}: {str(e)}")
             raise
     
+    def _track_face_data(self, track: Track, video_path: str, save_faces: bool) -> List[Dict]:
+        """
+        Face dictionaries for a finished track: its best face, then any diverse samples
+        """
+        results = []
+        for idx, sample in enumerate([track.best] + track.samples):
+            # Landmark/pose and gender/age models run only on the kept faces
+            for taskname, model in self.app.models.items():
+                if taskname not in ('detection', 'recognition'):
+                    model.get(sample.frame, sample.face)
+            face_data = self._extract_face_data(
+                sample.face, sample.frame, idx, video_path, save_faces,
+                frame_number=sample.frame_number,
+                timestamp=sample.timestamp
+            )
+            face_data.update(
+                track_id=track.track_id,
+                track_start=track.start_time,
+                track_end=track.end_time,
+                track_detections=track.detections
+            )
+            results.append(face_data)
+        return results
+    
     def _extract_face_data(self, face, image, face_idx, source_path, 
                           save_face=True, frame_number=None, timestamp=None) -> Dict:
         """
@@ -200,7 +601,7 @@ class FaceProcessor:
             scores.append(sharpness_score)
         
         # 4. Pose quality (frontal faces score higher)
-        if hasattr(face, 'pose'):
+        if getattr(face, 'pose', None) is not None:
             pose_score = 1.0 - (abs(face.pose[0]) + abs(face.pose[1])) / 180.0
             scores.append(pose_score)
         
@@ -269,14 +670,15 @@ class FaceProcessor:
         Returns:
             List of (face_id, similarity_score) tuples
         """
-        similarities = []
+        if not all_embeddings:
+            return []
         
-        for face_id, embedding in all_embeddings:
-            similarity = self.compare_faces(query_embedding, embedding)
-            if similarity >= threshold:
-                similarities.append((face_id, similarity))
+        face_ids = [face_id for face_id, _ in all_embeddings]
+        matrix = normalize_embeddings([embedding for _, embedding in all_embeddings])
+        query = normalize_embeddings(query_embedding)[0]
         
-        # Sort by similarity score
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        # Score every face with a single matrix-vector product
+        scores = cosine_to_similarity(matrix @ query)
+        positions = select_top_k(scores, threshold, top_k)
         
-        return similarities[:top_k]
\ No newline at end of file
+        return [(face_ids[i], float(scores[i])) for i in positions]
\ No newline at end of file
@@ -0,0 +1,307 @@
+# face_tracker.py
+import os
+import uuid
+import logging
+import numpy as np
+from typing import List, Dict, Callable
+
+from search_index import normalize_embeddings, cosine_to_similarity
+
+logger = logging.getLogger(__name__)
+
+# Link detections in consecutive sampled frames into tracks and keep one face per track
+VIDEO_FACE_TRACKING = os.getenv('VIDEO_FACE_TRACKING', 'false').lower() == 'true'
+TRACK_IOU_THRESHOLD = float(os.getenv('TRACK_IOU_THRESHOLD', 0.3))  # minimum box overlap to link to a track
+TRACK_CONFIDENT_IOU = float(os.getenv('TRACK_CONFIDENT_IOU', 0.6))  # unambiguous overlap that skips recognition
+TRACK_EMBEDDING_THRESHOLD = float(os.getenv('TRACK_EMBEDDING_THRESHOLD', 0.7))  # similarity (0-1) confirming a link
+TRACK_MAX_MISSED = int(os.getenv('TRACK_MAX_MISSED', 2))  # processed frames a track survives without a detection
+TRACK_QUALITY_MARGIN = float(os.getenv('TRACK_QUALITY_MARGIN', 0.05))  # quality gain that re-embeds a linked face
+TRACK_DIVERSE_SAMPLES = int(os.getenv('TRACK_DIVERSE_SAMPLES', 0))  # extra faces kept per track (0 = best only)
+TRACK_DIVERSITY_THRESHOLD = float(os.getenv('TRACK_DIVERSITY_THRESHOLD', 0.85))  # samples must be less similar than this
+
+
+def box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Pairwise intersection-over-union of two sets of [x1, y1, x2, y2] boxes
+
+    Returns:
+        (len(boxes_a), len(boxes_b)) IoU matrix
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+class TrackSample:
+    """One detection kept by a track"""
+
+    __slots__ = ('face', 'frame', 'frame_number', 'timestamp', 'quality', 'embedding')
+
+    def __init__(self, face, frame: np.ndarray, frame_number: int, timestamp: float,
+                 quality: float, embedding: np.ndarray):
+        self.face = face
+        self.frame = frame
+        self.frame_number = frame_number
+        self.timestamp = timestamp
+        self.quality = quality
+        self.embedding = embedding
+
+
+class Track:
+    """A face followed across sampled frames"""
+
+    def __init__(self, sample: TrackSample):
+        self.track_id = str(uuid.uuid4())
+        self.bbox = np.asarray(sample.face.bbox, dtype=np.float32)
+        self.embedding = sample.embedding
+        self.best = sample
+        self.samples: List[TrackSample] = []
+        self.start_frame = self.end_frame = sample.frame_number
+        self.start_time = self.end_time = sample.timestamp
+        self.detections = 1
+        self.missed = 0
+
+    def similarity(self, embedding: np.ndarray) -> float:
+        return float(cosine_to_similarity(self.embedding @ embedding))
+
+
+class FaceTracker:
+    """
+    Link face detections across sampled video frames into tracks
+
+    A detection overlapping one track's last box by at least confident_iou,
+    with no competing track or detection, is linked without running
+    recognition. New, ambiguous and weakly overlapping detections are
+    embedded (all of a frame's in one batched call) and linked when their
+    embedding matches a track, which also re-identifies faces after a short
+    occlusion or a large move between samples. A linked face is also
+    embedded when its quality beats the track's best by quality_margin, so
+    every track ends with an embedding of its best-quality detection.
+    """
+
+    def __init__(self, iou_threshold: float = None, confident_iou: float = None,
+                 embedding_threshold: float = None, max_missed: int = None,
+                 quality_margin: float = None, diverse_samples: int = None,
+                 diversity_threshold: float = None):
+        self.iou_threshold = TRACK_IOU_THRESHOLD if iou_threshold is None else iou_threshold
+        self.confident_iou = TRACK_CONFIDENT_IOU if confident_iou is None else confident_iou
+        self.embedding_threshold = TRACK_EMBEDDING_THRESHOLD if embedding_threshold is None else embedding_threshold
+        self.max_missed = TRACK_MAX_MISSED if max_missed is None else max_missed
+        self.quality_margin = TRACK_QUALITY_MARGIN if quality_margin is None else quality_margin
+        self.diverse_samples = TRACK_DIVERSE_SAMPLES if diverse_samples is None else diverse_samples
+        self.diversity_threshold = TRACK_DIVERSITY_THRESHOLD if diversity_threshold is None else diversity_threshold
+        self.active: List[Track] = []
+        self.stats = {'detections': 0, 'embedded': 0, 'tracks': 0}
+
+    def update(self, faces: List, qualities: List[float], frame: np.ndarray, frame_number: int,
+               timestamp: float, embed: Callable[[List], None]) -> List[Track]:
+        """
+        Add one processed frame's detections
+
+        Args:
+            faces: Detected faces (bbox, kps, det_score; no embedding yet)
+            qualities: Quality score of each face
+            frame: The frame the faces were detected in
+            frame_number: Frame number
+            timestamp: Frame time in seconds
+            embed: Callable embedding a list of faces in place (sets face.embedding)
+
+        Returns:
+            Tracks that ended (went unmatched for more than max_missed frames)
+        """
+        self.stats['detections'] += len(faces)
+        links: Dict[int, Track] = {}
+        to_embed = set()
+
+        if faces and self.active:
+            boxes = np.array([face.bbox for face in faces], dtype=np.float32)
+            iou = box_iou(boxes, np.array([track.bbox for track in self.active]))
+            # Greedy assignment, highest overlap first
+            taken_tracks = set()
+            for flat in np.argsort(-iou, axis=None):
+                i, t = np.unravel_index(flat, iou.shape)
+                if iou[i, t] < self.iou_threshold:
+                    break
+                if i in links or t in taken_tracks:
+                    continue
+                links[i] = self.active[t]
+                taken_tracks.add(t)
+                competing = (np.count_nonzero(iou[i] >= self.iou_threshold) > 1 or
+                             np.count_nonzero(iou[:, t] >= self.iou_threshold) > 1)
+                if iou[i, t] < self.confident_iou or competing:
+                    to_embed.add(i)
+                elif qualities[i] > self.active[t].best.quality + self.quality_margin:
+                    to_embed.add(i)
+                elif self.diverse_samples and len(self.active[t].samples) < self.diverse_samples:
+                    to_embed.add(i)
+        to_embed.update(i for i in range(len(faces)) if i not in links)
+
+        embedded = sorted(to_embed)
+        if embedded:
+            embed([faces[i] for i in embedded])
+            self.stats['embedded'] += len(embedded)
+        embeddings = {i: normalize_embeddings(faces[i].embedding)[0] for i in embedded}
+
+        # Links the embedding disagrees with are dropped and re-matched below
+        for i in list(links):
+            if i in embeddings and links[i].similarity(embeddings[i]) < self.embedding_threshold:
+                del links[i]
+
+        # Unlinked faces: match to tracks not seen in this frame by embedding, or start a track
+        for i in range(len(faces)):
+            if i in links:
+                continue
+            linked = {id(track) for track in links.values()}
+            candidates = [track for track in self.active if id(track) not in linked]
+            scores = [track.similarity(embeddings[i]) for track in candidates]
+            if scores and max(scores) >= self.embedding_threshold:
+                links[i] = candidates[int(np.argmax(scores))]
+            else:
+                track = Track(TrackSample(faces[i], frame, frame_number, timestamp, qualities[i], embeddings[i]))
+                self.active.append(track)
+                self.stats['tracks'] += 1
+                links[i] = track
+                track.missed = -1  # counted as seen below without re-adding the sample
+
+        seen = set()
+        for i, track in links.items():
+            seen.add(id(track))
+            if track.missed == -1:
+                track.missed = 0
+                continue
+            track.bbox = np.asarray(faces[i].bbox, dtype=np.float32)
+            track.end_frame, track.end_time = frame_number, timestamp
+            track.detections += 1
+            track.missed = 0
+            if i in embeddings:
+                self._add_sample(track, TrackSample(faces[i], frame, frame_number, timestamp,
+                                                    qualities[i], embeddings[i]))
+
+        finished = []
+        for track in self.active:
+            if id(track) not in seen:
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    finished.append(track)
+        self.active = [track for track in self.active if track not in finished]
+        return finished
+
+    def _add_sample(self, track: Track, sample: TrackSample):
+        """Keep a newly embedded detection as the best face or a diverse sample"""
+        if sample.quality > track.best.quality:
+            previous, track.best = track.best, sample
+            track.embedding = sample.embedding
+            sample = previous
+        if len(track.samples) < self.diverse_samples:
+            kept = [track.best] + track.samples
+            if all(cosine_to_similarity(other.embedding @ sample.embedding) < self.diversity_threshold
+                   for other in kept):
+                track.samples.append(sample)
+
+    def finish(self) -> List[Track]:
+        """End all active tracks"""
+        finished, self.active = self.active, []
+        return finished
+
+
+def merge_segment_tracks(segments: List[Dict], max_gap_seconds: float, embedding_threshold: float = None,
+                         diverse_samples: int = None) -> List[Dict]:
+    """
+    Concatenate the faces of consecutive video segments, joining tracks cut at segment boundaries
+
+    A track ending within max_gap_seconds before a boundary is joined to a
+    track starting within max_gap_seconds after it when their best faces
+    match (greedily, most similar pair first). A joined track keeps its
+    highest-quality face plus up to diverse_samples others, under the first
+    segment's track_id and the combined time span.
+
+    Args:
+        segments: Dicts with 'faces' (face dictionaries from process_video) and
+            'start_time' (seconds), in video order
+        max_gap_seconds: How close to a boundary a track must end or start
+        embedding_threshold: Similarity (0-1) needed to join two tracks
+            (defaults to TRACK_EMBEDDING_THRESHOLD)
+        diverse_samples: Extra faces kept per joined track (defaults to TRACK_DIVERSE_SAMPLES)
+
+    Returns:
+        Face dictionaries of the whole video
+    """
+    embedding_threshold = TRACK_EMBEDDING_THRESHOLD if embedding_threshold is None else embedding_threshold
+    diverse_samples = TRACK_DIVERSE_SAMPLES if diverse_samples is None else diverse_samples
+    parent: Dict[str, str] = {}
+
+    def root(track_id: str) -> str:
+        while parent.get(track_id, track_id) != track_id:
+            track_id = parent[track_id]
+        return track_id
+
+    def best_faces(faces: List[Dict]) -> Dict[str, Dict]:
+        best = {}
+        for face in faces:
+            track_id = face.get('track_id')
+            if track_id and (track_id not in best or face['quality_score'] > best[track_id]['quality_score']):
+                best[track_id] = face
+        return best
+
+    for previous, current in zip(segments, segments[1:]):
+        boundary = current['start_time']
+        ending = [face for face in best_faces(previous['faces']).values()
+                  if face['track_end'] >= boundary - max_gap_seconds]
+        starting = [face for face in best_faces(current['faces']).values()
+                    if face['track_start'] <= boundary + max_gap_seconds]
+        if not ending or not starting:
+            continue
+        scores = cosine_to_similarity(
+            normalize_embeddings([face['embedding'] for face in ending]) @
+            normalize_embeddings([face['embedding'] for face in starting]).T
+        )
+        joined_ending, joined_starting = set(), set()
+        for flat in np.argsort(-scores, axis=None):
+            i, j = np.unravel_index(flat, scores.shape)
+            if scores[i, j] < embedding_threshold:
+                break
+            if i in joined_ending or j in joined_starting:
+                continue
+            joined_ending.add(i)
+            joined_starting.add(j)
+            parent[starting[j]['track_id']] = root(ending[i]['track_id'])
+
+    faces = [face for segment in segments for face in segment['faces']]
+    if not parent:
+        return faces
+
+    groups: Dict[str, List[Dict]] = {}
+    for face in faces:
+        if face.get('track_id'):
+            groups.setdefault(root(face['track_id']), []).append(face)
+
+    merged, emitted = [], set()
+    for face in faces:
+        track_id = face.get('track_id')
+        if not track_id:
+            merged.append(face)
+            continue
+        group_id = root(track_id)
+        if group_id in emitted:
+            continue
+        emitted.add(group_id)
+        group = groups[group_id]
+        if len({member['track_id'] for member in group}) == 1:
+            merged.extend(group)
+            continue
+        detections = {member['track_id']: member.get('track_detections', 0) for member in group}
+        track_start = min(member['track_start'] for member in group)
+        track_end = max(member['track_end'] for member in group)
+        kept = sorted(group, key=lambda member: member['quality_score'], reverse=True)[:1 + diverse_samples]
+        for member in kept:
+            member.update(track_id=group_id, track_start=track_start, track_end=track_end,
+                          track_detections=sum(detections.values()))
+        merged.extend(kept)
+    logger.info(f"Joined {len(parent)} tracks across {len(segments) - 1} segment boundaries")
+    return merged
@@ -0,0 +1,335 @@
+# filter_index.py
+import numpy as np
+import threading
+import logging
+from datetime import datetime
+from typing import List, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Lower bounds of the age buckets after the first one ('0-12')
+AGE_BUCKET_EDGES = (13, 18, 25, 35, 45, 55, 65)
+AGE_BUCKET_LABELS = ('0-12', '13-17', '18-24', '25-34', '35-44', '45-54', '55-64', '65+')
+GENDER_CODES = {'male': 1, 'female': 2}
+
+CATEGORICAL_COLUMNS = ('gender', 'age_bucket')
+
+# Rows changed since the range columns were sorted are checked directly until
+# there are more than this many (or 1/16 of the index); then the columns are re-sorted
+STALE_ROWS_BEFORE_RESORT = 4096
+
+
+def age_bucket(age) -> int:
+    """Bucket number for an age, or -1 when unknown"""
+    if age is None:
+        return -1
+    return int(np.searchsorted(AGE_BUCKET_EDGES, age, side='right'))
+
+
+def _to_epoch(value) -> float:
+    """Convert a datetime, ISO-8601 string or number to epoch seconds"""
+    if value is None:
+        return np.nan
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+class SearchFilter:
+    """
+    Attribute constraints for a face search
+
+    Every constraint left as None is ignored; list constraints match any of
+    their values. Faces with an unknown value never match a constraint on it.
+    """
+
+    FIELDS = ('file_ids', 'uploaded_after', 'uploaded_before', 'min_quality', 'max_quality',
+              'genders', 'age_buckets', 'min_timestamp', 'max_timestamp')
+
+    def __init__(self, file_ids: Iterable[int] = None, uploaded_after=None, uploaded_before=None,
+                 min_quality: float = None, max_quality: float = None,
+                 genders: Iterable[str] = None, age_buckets: Iterable[str] = None,
+                 min_timestamp: float = None, max_timestamp: float = None):
+        """
+        Create a filter
+
+        Args:
+            file_ids: Only faces from these uploaded files
+            uploaded_after: Only files uploaded at or after this time (datetime, ISO string or epoch)
+            uploaded_before: Only files uploaded at or before this time
+            min_quality: Minimum face quality_score
+            max_quality: Maximum face quality_score
+            genders: 'male' and/or 'female'
+            age_buckets: Age bucket labels from AGE_BUCKET_LABELS
+            min_timestamp: Minimum video timestamp in seconds (frames within a video)
+            max_timestamp: Maximum video timestamp in seconds
+        """
+        self.file_ids = sorted({int(file_id) for file_id in file_ids}) if file_ids is not None else None
+        self.uploaded_after = None if uploaded_after is None else _to_epoch(uploaded_after)
+        self.uploaded_before = None if uploaded_before is None else _to_epoch(uploaded_before)
+        self.min_quality = None if min_quality is None else float(min_quality)
+        self.max_quality = None if max_quality is None else float(max_quality)
+        self.min_timestamp = None if min_timestamp is None else float(min_timestamp)
+        self.max_timestamp = None if max_timestamp is None else float(max_timestamp)
+
+        self.genders = None
+        if genders is not None:
+            unknown = [gender for gender in genders if gender not in GENDER_CODES]
+            if unknown:
+                raise ValueError(f"Unknown gender filter: {unknown}")
+            self.genders = sorted(set(genders))
+
+        self.age_buckets = None
+        if age_buckets is not None:
+            unknown = [bucket for bucket in age_buckets if bucket not in AGE_BUCKET_LABELS]
+            if unknown:
+                raise ValueError(f"Unknown age bucket: {unknown}")
+            self.age_buckets = sorted(set(age_buckets), key=AGE_BUCKET_LABELS.index)
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> Optional['SearchFilter']:
+        """Build a filter from a dict of FIELDS, returning None when nothing is constrained"""
+        if not data:
+            return None
+        unknown = set(data) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown search filter fields: {sorted(unknown)}")
+        search_filter = cls(**data)
+        return None if search_filter.is_empty() else search_filter
+
+    def to_dict(self) -> Dict:
+        """JSON-serializable form, used for task arguments and cache keys"""
+        return {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+
+    def is_empty(self) -> bool:
+        return not self.to_dict()
+
+    def ranges(self) -> Dict[str, tuple]:
+        """(low, high) bounds per constrained range column"""
+        bounds = {
+            'upload_time': (self.uploaded_after, self.uploaded_before),
+            'quality_score': (self.min_quality, self.max_quality),
+            'timestamp': (self.min_timestamp, self.max_timestamp),
+        }
+        return {
+            column: (-np.inf if low is None else low, np.inf if high is None else high)
+            for column, (low, high) in bounds.items()
+            if low is not None or high is not None
+        }
+
+    def categories(self) -> Dict[str, List[int]]:
+        """Accepted codes per constrained categorical column"""
+        categories = {}
+        if self.genders is not None:
+            categories['gender'] = [GENDER_CODES[gender] for gender in self.genders]
+        if self.age_buckets is not None:
+            categories['age_bucket'] = [AGE_BUCKET_LABELS.index(bucket) for bucket in self.age_buckets]
+        return categories
+
+
+class AttributeIndex:
+    """
+    Per-row face attributes kept aligned with the rows of an embedding index
+
+    Answers a SearchFilter with the matching row positions before any
+    embedding is scored:
+      - file_id: posting lists of positions per file
+      - gender / age bucket: one precomputed bitmap per value
+      - upload_time / quality_score / timestamp: sorted position arrays
+        searched with binary search; rows written since the sort are kept in
+        a small stale set, compared directly, and merged by re-sorting only
+        once the set grows past STALE_ROWS_BEFORE_RESORT
+    """
+
+    def __init__(self, initial_capacity: int = 1024):
+        capacity = max(initial_capacity, 1)
+        self._size = 0
+        self._columns = {
+            'file_id': np.full(capacity, -1, dtype=np.int64),
+            'upload_time': np.full(capacity, np.nan, dtype=np.float64),
+            'quality_score': np.full(capacity, np.nan, dtype=np.float64),
+            'timestamp': np.full(capacity, np.nan, dtype=np.float64),
+            'gender': np.full(capacity, -1, dtype=np.int8),
+            'age_bucket': np.full(capacity, -1, dtype=np.int8),
+        }
+        self._bitmaps: Dict[tuple, np.ndarray] = {}
+        self._file_positions: Dict[int, set] = {}
+        self._sorted: Dict[str, tuple] = {}
+        self._stale: set = set()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, rows: int):
+        capacity = len(self._columns['file_id'])
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.full(capacity, -1 if column.dtype.kind == 'i' else np.nan, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+        for key, bitmap in self._bitmaps.items():
+            grown = np.zeros(capacity, dtype=bool)
+            grown[:self._size] = bitmap[:self._size]
+            self._bitmaps[key] = grown
+
+    def _bitmap(self, column: str, code: int) -> np.ndarray:
+        bitmap = self._bitmaps.get((column, code))
+        if bitmap is None:
+            bitmap = np.zeros(len(self._columns[column]), dtype=bool)
+            self._bitmaps[(column, code)] = bitmap
+        return bitmap
+
+    def set_rows(self, positions: np.ndarray, attributes: Iterable[Optional[Dict]]):
+        """
+        Store attributes for rows, growing the index to cover every position
+
+        Args:
+            positions: Row positions, in the same order as attributes
+            attributes: Dicts with file_id, upload_time, quality_score,
+                timestamp, gender and age (missing keys are unknown)
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if positions.size == 0:
+            return
+        attributes = [attrs or {} for attrs in attributes]
+
+        values = {
+            'file_id': [attrs.get('file_id') for attrs in attributes],
+            'upload_time': [_to_epoch(attrs.get('upload_time')) for attrs in attributes],
+            'quality_score': [attrs.get('quality_score') for attrs in attributes],
+            'timestamp': [attrs.get('timestamp') for attrs in attributes],
+            'gender': [GENDER_CODES.get(attrs.get('gender'), -1) for attrs in attributes],
+            'age_bucket': [age_bucket(attrs.get('age')) for attrs in attributes],
+        }
+
+        with self._lock:
+            self._reserve(int(positions.max()) + 1)
+            self._clear_rows(positions)
+            for name, column_values in values.items():
+                column = self._columns[name]
+                missing = -1 if column.dtype.kind == 'i' else np.nan
+                column[positions] = [missing if value is None else value for value in column_values]
+            for column in CATEGORICAL_COLUMNS:
+                codes = self._columns[column][positions]
+                for code in np.unique(codes[codes >= 0]):
+                    self._bitmap(column, int(code))[positions[codes == code]] = True
+            for position, file_id in zip(positions.tolist(), self._columns['file_id'][positions].tolist()):
+                if file_id >= 0:
+                    self._file_positions.setdefault(file_id, set()).add(position)
+            self._size = max(self._size, int(positions.max()) + 1)
+            self._mark_stale(positions.tolist())
+
+    def _clear_rows(self, positions: np.ndarray):
+        """Drop rows from the bitmaps and posting lists before they are overwritten"""
+        positions = positions[positions < self._size]
+        if positions.size == 0:
+            return
+        for bitmap in self._bitmaps.values():
+            bitmap[positions] = False
+        for position, file_id in zip(positions.tolist(), self._columns['file_id'][positions].tolist()):
+            postings = self._file_positions.get(file_id)
+            if postings is not None:
+                postings.discard(position)
+                if not postings:
+                    del self._file_positions[file_id]
+
+    def move_last(self, position: int):
+        """Move the last row into `position` and drop the last row, mirroring a swap-remove"""
+        with self._lock:
+            last = self._size - 1
+            self._clear_rows(np.array([position], dtype=np.int64))
+            if position != last:
+                file_id = int(self._columns['file_id'][last])
+                if file_id >= 0:
+                    postings = self._file_positions[file_id]
+                    postings.discard(last)
+                    postings.add(position)
+                for column in self._columns.values():
+                    column[position] = column[last]
+                for bitmap in self._bitmaps.values():
+                    bitmap[position] = bitmap[last]
+                    bitmap[last] = False
+            self._size = last
+            self._mark_stale([position])
+
+    def _mark_stale(self, positions: List[int]):
+        """Record rows whose range values changed since the columns were sorted"""
+        if not self._sorted:
+            return
+        self._stale.update(positions)
+        if len(self._stale) > max(STALE_ROWS_BEFORE_RESORT, self._size // 16):
+            self._sorted.clear()
+            self._stale.clear()
+
+    def _sorted_column(self, column: str) -> tuple:
+        """(positions ordered by value, sorted values) for a range column, ignoring unknowns"""
+        cached = self._sorted.get(column)
+        if cached is None:
+            values = self._columns[column][:self._size]
+            known = np.flatnonzero(~np.isnan(values))
+            order = known[np.argsort(values[known], kind='stable')]
+            cached = (order, values[order])
+            self._sorted[column] = cached
+        return cached
+
+    def candidates(self, search_filter: Optional[SearchFilter]) -> Optional[np.ndarray]:
+        """
+        Positions of the rows matching a filter
+
+        Args:
+            search_filter: Filter to apply, or None
+
+        Returns:
+            Sorted int64 array of matching positions, or None when nothing is filtered
+        """
+        if search_filter is None or search_filter.is_empty():
+            return None
+
+        with self._lock:
+            size = self._size
+            ranges = search_filter.ranges()
+            categories = search_filter.categories()
+
+            if search_filter.file_ids is not None:
+                # Narrow path: start from the files' posting lists and check the
+                # remaining constraints on those rows only
+                postings = [self._file_positions.get(file_id, ()) for file_id in search_filter.file_ids]
+                positions = np.fromiter((p for posting in postings for p in posting), dtype=np.int64)
+                positions.sort()
+                keep = np.ones(len(positions), dtype=bool)
+                for column, codes in categories.items():
+                    keep &= np.isin(self._columns[column][positions], codes)
+                for column, (low, high) in ranges.items():
+                    values = self._columns[column][positions]
+                    keep &= (values >= low) & (values <= high)
+                return positions[keep]
+
+            mask = None
+            for column, codes in categories.items():
+                column_mask = np.zeros(size, dtype=bool)
+                for code in codes:
+                    bitmap = self._bitmaps.get((column, code))
+                    if bitmap is not None:
+                        column_mask |= bitmap[:size]
+                mask = column_mask if mask is None else mask & column_mask
+            stale = np.fromiter(self._stale, dtype=np.int64, count=len(self._stale))
+            stale = stale[stale < size]
+            for column, (low, high) in ranges.items():
+                order, values = self._sorted_column(column)
+                start = np.searchsorted(values, low, side='left')
+                end = np.searchsorted(values, high, side='right')
+                hits = order[start:end]
+                column_mask = np.zeros(size, dtype=bool)
+                column_mask[hits[hits < size]] = True
+                if stale.size:
+                    # The sorted arrays hold old values for these rows
+                    current = self._columns[column][stale]
+                    column_mask[stale] = (current >= low) & (current <= high)
+                mask = column_mask if mask is None else mask & column_mask
+            return np.flatnonzero(mask)
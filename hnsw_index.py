@@ -0,0 +1,383 @@
+# hnsw_index.py
+import os
+import heapq
+import tempfile
+import math
+import numpy as np
+import threading
+import logging
+from typing import List, Tuple, Dict, Iterable, Optional
+
+from search_index import EMBEDDING_DIM, normalize_embeddings, cosine_to_similarity
+
+logger = logging.getLogger(__name__)
+
+
+class HNSWIndex:
+    """
+    Hierarchical navigable small world graph over face embeddings
+
+    Vectors live in one contiguous float32 matrix. Level-0 adjacency is a
+    fixed-width int32 matrix (2 * M slots per node, -1 for empty); the much
+    sparser upper levels map node -> int32 neighbor array. Distances are
+    1 - cosine on L2-normalized vectors. Deleted faces are tombstoned: they
+    still route searches but never appear in results.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, m: int = 16, ef_construction: int = 100,
+                 ef_search: int = 64, initial_capacity: int = 1024, seed: int = 0):
+        """
+        Initialize an empty graph
+
+        Args:
+            dim: Embedding dimensionality
+            m: Neighbors per node on upper levels (2 * m on level 0)
+            ef_construction: Candidate list size while inserting
+            ef_search: Default candidate list size while searching
+            initial_capacity: Number of nodes to preallocate
+            seed: Random seed for level assignment
+        """
+        self.dim = dim
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._level_mult = 1.0 / math.log(m)
+        self._rng = np.random.default_rng(seed)
+
+        capacity = max(initial_capacity, 1)
+        self._vectors = np.empty((capacity, dim), dtype=np.float32)
+        self._levels = np.zeros(capacity, dtype=np.int8)
+        self._deleted = np.zeros(capacity, dtype=bool)
+        self._neighbors0 = np.full((capacity, self.m0), -1, dtype=np.int32)
+        self._upper: List[Dict[int, np.ndarray]] = []
+        self._face_ids: List[str] = []
+        self._nodes: Dict[str, int] = {}
+        self._entry_point = -1
+        self._max_level = -1
+        self._lock = threading.RLock()
+        self.metadata: Dict = {}
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, face_id: str) -> bool:
+        return face_id in self._nodes
+
+    @property
+    def face_ids(self) -> List[str]:
+        """Faces in the graph, excluding tombstoned ones"""
+        return list(self._nodes)
+
+    @property
+    def deleted_count(self) -> int:
+        return len(self._face_ids) - len(self._nodes)
+
+    # ------------------------------------------------------------------
+    # Graph primitives
+    # ------------------------------------------------------------------
+
+    def _reserve(self, rows: int):
+        capacity = len(self._vectors)
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        size = len(self._face_ids)
+
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:size] = self._vectors[:size]
+        levels = np.zeros(capacity, dtype=np.int8)
+        levels[:size] = self._levels[:size]
+        deleted = np.zeros(capacity, dtype=bool)
+        deleted[:size] = self._deleted[:size]
+        neighbors0 = np.full((capacity, self.m0), -1, dtype=np.int32)
+        neighbors0[:size] = self._neighbors0[:size]
+
+        self._vectors, self._levels, self._deleted, self._neighbors0 = vectors, levels, deleted, neighbors0
+
+    def _get_neighbors(self, node: int, level: int) -> np.ndarray:
+        if level == 0:
+            row = self._neighbors0[node]
+        else:
+            row = self._upper[level - 1].get(node)
+            if row is None:
+                return np.empty(0, dtype=np.int32)
+        return row[row >= 0]
+
+    def _set_neighbors(self, node: int, level: int, neighbors: np.ndarray):
+        width = self.m0 if level == 0 else self.m
+        row = np.full(width, -1, dtype=np.int32)
+        row[:len(neighbors)] = neighbors[:width]
+        if level == 0:
+            self._neighbors0[node] = row
+        else:
+            self._upper[level - 1][node] = row
+
+    def _distances(self, query: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+        return 1.0 - self._vectors[nodes] @ query
+
+    def _search_layer(self, query: np.ndarray, entry_points: List[int], ef: int,
+                      level: int) -> List[Tuple[float, int]]:
+        """Best-first search of one level; returns up to ef (distance, node) pairs, nearest first"""
+        entry = np.asarray(entry_points, dtype=np.int64)
+        entry_dists = self._distances(query, entry)
+        visited = set(entry_points)
+        candidates = [(float(d), int(n)) for d, n in zip(entry_dists, entry)]
+        heapq.heapify(candidates)
+        results = [(-d, n) for d, n in candidates]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            dist, node = heapq.heappop(candidates)
+            if dist > -results[0][0] and len(results) >= ef:
+                break
+
+            neighbors = [n for n in self._get_neighbors(node, level).tolist() if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+
+            for neighbor, neighbor_dist in zip(neighbors, self._distances(query, np.asarray(neighbors)).tolist()):
+                if len(results) < ef or neighbor_dist < -results[0][0]:
+                    heapq.heappush(candidates, (neighbor_dist, neighbor))
+                    heapq.heappush(results, (-neighbor_dist, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted((-d, n) for d, n in results)
+
+    def _select_neighbors(self, candidates: List[Tuple[float, int]], m: int) -> np.ndarray:
+        """
+        Pick up to m diverse neighbors (HNSW heuristic): a candidate is kept only
+        if it is closer to the base node than to any already selected neighbor;
+        pruned candidates back-fill remaining slots
+        """
+        if not candidates:
+            return np.empty(0, dtype=np.int32)
+        dists, nodes = zip(*candidates)
+        vectors = self._vectors[list(nodes)]
+        # Candidate c is dominated once some selected s has 1 - s.c < dist(c);
+        # each selection marks every candidate it dominates in one product
+        limits = 1.0 - np.asarray(dists, dtype=np.float32)
+        dominated = np.zeros(len(nodes), dtype=bool)
+
+        selected: List[int] = []
+        pruned: List[int] = []
+        for i, node in enumerate(nodes):
+            if len(selected) >= m:
+                break
+            if dominated[i]:
+                pruned.append(node)
+                continue
+            selected.append(node)
+            dominated |= vectors @ vectors[i] > limits
+
+        selected.extend(pruned[:m - len(selected)])
+        return np.asarray(selected, dtype=np.int32)
+
+    def _random_level(self) -> int:
+        return int(-math.log(max(self._rng.random(), 1e-12)) * self._level_mult)
+
+    def _insert(self, vector: np.ndarray, face_id: str):
+        node = len(self._face_ids)
+        self._reserve(node + 1)
+        level = min(self._random_level(), 127)
+
+        self._vectors[node] = vector
+        self._levels[node] = level
+        self._face_ids.append(face_id)
+        self._nodes[face_id] = node
+        while len(self._upper) < level:
+            self._upper.append({})
+
+        if self._entry_point < 0:
+            self._entry_point, self._max_level = node, level
+            return
+
+        # Greedy descent through levels above the new node's top level
+        entry = [self._entry_point]
+        for lc in range(self._max_level, level, -1):
+            entry = [self._search_layer(vector, entry, 1, lc)[0][1]]
+
+        for lc in range(min(level, self._max_level), -1, -1):
+            candidates = self._search_layer(vector, entry, self.ef_construction, lc)
+            width = self.m0 if lc == 0 else self.m
+            neighbors = self._select_neighbors(candidates, self.m)
+            self._set_neighbors(node, lc, neighbors)
+
+            # Add reverse edges, shrinking neighbor lists that overflow
+            for neighbor in neighbors.tolist():
+                current = self._get_neighbors(neighbor, lc)
+                if len(current) < width:
+                    self._set_neighbors(neighbor, lc, np.append(current, node))
+                else:
+                    pool = np.append(current, node)
+                    dists = self._distances(self._vectors[neighbor], pool)
+                    order = np.argsort(dists)
+                    ranked = [(float(dists[i]), int(pool[i])) for i in order]
+                    self._set_neighbors(neighbor, lc, self._select_neighbors(ranked, width))
+
+            entry = [n for _, n in candidates]
+
+        if level > self._max_level:
+            self._entry_point, self._max_level = node, level
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def add(self, face_ids: Iterable[str], embeddings) -> int:
+        """
+        Insert embeddings into the graph; re-adding a face tombstones its old node
+
+        Args:
+            face_ids: Face identifiers, one per embedding
+            embeddings: Sequence or 2-D array of embeddings
+
+        Returns:
+            Number of nodes inserted
+        """
+        face_ids = list(face_ids)
+        if not face_ids:
+            return 0
+
+        vectors = normalize_embeddings(embeddings)
+        if vectors.shape != (len(face_ids), self.dim):
+            raise ValueError(
+                f"Expected {len(face_ids)} embeddings of dimension {self.dim}, got {vectors.shape}"
+            )
+
+        with self._lock:
+            self.remove([face_id for face_id in face_ids if face_id in self._nodes])
+            for face_id, vector in zip(face_ids, vectors):
+                self._insert(vector, face_id)
+
+        return len(face_ids)
+
+    def remove(self, face_ids: Iterable[str]) -> int:
+        """
+        Tombstone faces so they no longer appear in results
+
+        Args:
+            face_ids: Face identifiers to remove
+
+        Returns:
+            Number of faces removed
+        """
+        removed = 0
+        with self._lock:
+            for face_id in face_ids:
+                node = self._nodes.pop(face_id, None)
+                if node is not None:
+                    self._deleted[node] = True
+                    removed += 1
+        return removed
+
+    def search(self, query_embedding, threshold: float = 0.6, top_k: int = 10,
+               ef_search: int = None) -> List[Tuple[str, float]]:
+        """
+        Find approximate nearest faces to a query embedding
+
+        Args:
+            query_embedding: Query face embedding
+            threshold: Similarity threshold (0-1)
+            top_k: Return top k results
+            ef_search: Candidate list size (defaults to self.ef_search)
+
+        Returns:
+            List of (face_id, similarity_score) tuples, best first
+        """
+        query = normalize_embeddings(query_embedding)[0]
+        ef = max(ef_search or self.ef_search, top_k)
+
+        with self._lock:
+            if self._entry_point < 0 or top_k <= 0:
+                return []
+
+            entry = [self._entry_point]
+            for lc in range(self._max_level, 0, -1):
+                entry = [self._search_layer(query, entry, 1, lc)[0][1]]
+            # Widen the beam when tombstones are likely to crowd out live results
+            if self.deleted_count:
+                ef += min(self.deleted_count, ef)
+            candidates = self._search_layer(query, entry, ef, 0)
+
+            results = []
+            for dist, node in candidates:
+                if self._deleted[node]:
+                    continue
+                similarity = float(cosine_to_similarity(1.0 - dist))
+                if similarity < threshold or len(results) >= top_k:
+                    break
+                results.append((self._face_ids[node], similarity))
+            return results
+
+    def save(self, path: str):
+        """
+        Write the graph to an .npz file atomically
+
+        Args:
+            path: Destination path; `self.metadata` values are stored alongside
+        """
+        with self._lock:
+            size = len(self._face_ids)
+            upper_nodes, upper_levels, upper_rows = [], [], []
+            for level, table in enumerate(self._upper, start=1):
+                for node, row in table.items():
+                    upper_nodes.append(node)
+                    upper_levels.append(level)
+                    upper_rows.append(row)
+
+            directory = os.path.dirname(path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            # A temp file per writer, so concurrent checkpoints never interleave
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(
+                        f,
+                        params=np.array([self.dim, self.m, self.ef_construction, self.ef_search,
+                                         self._entry_point, self._max_level], dtype=np.int64),
+                        vectors=self._vectors[:size],
+                        levels=self._levels[:size],
+                        deleted=self._deleted[:size],
+                        neighbors0=self._neighbors0[:size],
+                        upper_nodes=np.array(upper_nodes, dtype=np.int32),
+                        upper_levels=np.array(upper_levels, dtype=np.int32),
+                        upper_rows=np.array(upper_rows, dtype=np.int32).reshape(-1, self.m),
+                        face_ids=np.array(self._face_ids, dtype=str),
+                        metadata_keys=np.array(list(self.metadata.keys()), dtype=str),
+                        metadata_values=np.array(list(self.metadata.values()), dtype=np.float64)
+                    )
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    @classmethod
+    def load(cls, path: str) -> 'HNSWIndex':
+        """Load a graph written by save()"""
+        data = np.load(path)
+        dim, m, ef_construction, ef_search, entry_point, max_level = data['params'].tolist()
+        size = len(data['face_ids'])
+
+        index = cls(dim=dim, m=m, ef_construction=ef_construction, ef_search=ef_search,
+                    initial_capacity=max(size, 1))
+        index._vectors[:size] = data['vectors']
+        index._levels[:size] = data['levels']
+        index._deleted[:size] = data['deleted']
+        index._neighbors0[:size] = data['neighbors0']
+        index._upper = [{} for _ in range(max(max_level, 0))]
+        for node, level, row in zip(data['upper_nodes'], data['upper_levels'], data['upper_rows']):
+            index._upper[level - 1][int(node)] = row.copy()
+        index._face_ids = data['face_ids'].tolist()
+        index._nodes = {face_id: node for node, face_id in enumerate(index._face_ids)
+                        if not index._deleted[node]}
+        index._entry_point = entry_point
+        index._max_level = max_level
+        index.metadata = dict(zip(data['metadata_keys'].tolist(), data['metadata_values'].tolist()))
+        return index
@@ -0,0 +1,264 @@
+# image_pipeline.py
+import io
+import os
+import cv2
+import time
+import queue
+import logging
+import threading
+import numpy as np
+from PIL import Image
+from typing import List, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Decode threads reading images ahead of inference, and how many decoded images may wait
+DECODE_WORKERS = int(os.getenv('DECODE_WORKERS', 4))
+DECODE_QUEUE_SIZE = int(os.getenv('DECODE_QUEUE_SIZE', 32))
+# Decode large images at 1/2, 1/4 or 1/8 size for face detection
+IMAGE_REDUCED_DECODE = os.getenv('IMAGE_REDUCED_DECODE', 'false').lower() == 'true'
+# Smallest reduction worth a second, full-size decode for images with faces
+IMAGE_REDUCED_MIN_FACTOR = int(os.getenv('IMAGE_REDUCED_MIN_FACTOR', 4))
+
+REDUCED_DECODE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2
+}
+
+_DONE = object()
+
+
+def reduced_decode_factor(width: int, height: int, min_side: int) -> int:
+    """
+    Pick the reduced-decode factor for an image of the given size
+
+    The largest power-of-two reduction that keeps the long side at least
+    min_side, or 1 when that is below IMAGE_REDUCED_MIN_FACTOR: images with
+    faces are decoded again at full size, which only pays off when the
+    reduced decode is a small fraction of a full one.
+    """
+    factor = next((f for f in REDUCED_DECODE_FLAGS if max(width, height) / f >= min_side), 1)
+    return factor if factor >= IMAGE_REDUCED_MIN_FACTOR else 1
+
+
+def decode_image_reduced(data: bytes, min_side: int) -> Tuple[Optional[np.ndarray], Tuple[float, float]]:
+    """
+    Decode an encoded image at the reduction picked by reduced_decode_factor
+
+    The size comes from the header (PIL parses only the header), and
+    OpenCV's reduced decode scales JPEGs in the DCT domain, so the full-size
+    pixels are never produced. Other formats are decoded and then shrunk.
+
+    Args:
+        data: Encoded image bytes
+        min_side: Smallest acceptable long side, e.g. the detector input size
+
+    Returns:
+        (image, (scale_x, scale_y)) where multiplying coordinates in image by
+        the scales gives full-resolution coordinates; image is None if unreadable
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    try:
+        with Image.open(io.BytesIO(data)) as header:
+            width, height = header.size
+    except OSError:
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR), (1.0, 1.0)
+
+    factor = reduced_decode_factor(width, height, min_side)
+    if factor == 1:
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR), (1.0, 1.0)
+
+    image = cv2.imdecode(buffer, REDUCED_DECODE_FLAGS[factor])
+    if image is None:
+        return None, (1.0, 1.0)
+    if (image.shape[1] >= image.shape[0]) != (width >= height):
+        # Rotated by the EXIF orientation, which imdecode applies
+        width, height = height, width
+    return image, (width / image.shape[1], height / image.shape[0])
+
+
+def read_image_reduced(path: str, min_side: int) -> Tuple[Optional[np.ndarray], Tuple[float, float]]:
+    """Read an image file with decode_image_reduced; image is None if unreadable"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None, (1.0, 1.0)
+    return decode_image_reduced(data, min_side)
+
+
+class DecodedImage:
+    """An image read and decoded by the prefetcher"""
+
+    __slots__ = ('index', 'path', 'image', 'error', 'scale')
+
+    def __init__(self, index: int, path: str, image: Optional[np.ndarray], error: Optional[str] = None,
+                 scale: Tuple[float, float] = (1.0, 1.0)):
+        self.index = index
+        self.path = path
+        self.image = image
+        self.error = error
+        # Full-resolution size over decoded size, when decoded reduced
+        self.scale = scale
+
+
+class ImagePrefetcher:
+    """
+    Read and decode images on a thread pool ahead of the consumer
+
+    Worker threads pull paths, read the file and decode it (cv2.imdecode
+    releases the GIL, so decodes run in parallel), then put the image on a
+    bounded queue. The consumer iterates the queue in completion order, so
+    inference never waits on disk or JPEG decode unless the pool falls behind.
+
+    stats() tells which side is the bottleneck: a high consumer_wait_seconds
+    means inference starves (add workers), a high producer_blocked_seconds
+    means the queue is full and inference is the slow stage.
+    """
+
+    def __init__(self, image_paths: List[str], workers: int = None, queue_size: int = None,
+                 reduced_min_side: int = None):
+        """
+        Start prefetching
+
+        Args:
+            image_paths: Paths to read, in priority order
+            workers: Decode threads (defaults to DECODE_WORKERS)
+            queue_size: Maximum decoded images waiting for the consumer (defaults to DECODE_QUEUE_SIZE)
+            reduced_min_side: Decode large images reduced to no less than this
+                long side (see decode_image_reduced); full size when None
+        """
+        self.image_paths = list(image_paths)
+        self.reduced_min_side = reduced_min_side
+        self.workers = max(1, min(workers or DECODE_WORKERS, len(self.image_paths) or 1))
+        self.queue_size = max(1, queue_size or DECODE_QUEUE_SIZE)
+
+        self._paths = queue.Queue()
+        for item in enumerate(self.image_paths):
+            self._paths.put(item)
+        self._decoded = queue.Queue(maxsize=self.queue_size)
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'decoded': 0,
+            'failed': 0,
+            'consumed': 0,
+            'max_queue_depth': 0,
+            'read_seconds': 0.0,
+            'decode_seconds': 0.0,
+            'producer_blocked_seconds': 0.0,
+            'consumer_wait_seconds': 0.0
+        }
+        self._threads = [
+            threading.Thread(target=self._work, name=f'image-decode-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _add(self, **increments):
+        with self._stats_lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    def _put(self, item) -> bool:
+        """Put on the bounded queue, giving up when the prefetcher is closed"""
+        blocked_start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self._decoded.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self._add(producer_blocked_seconds=time.perf_counter() - blocked_start)
+        with self._stats_lock:
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self._decoded.qsize())
+        return not self._stop.is_set()
+
+    def _work(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    index, path = self._paths.get_nowait()
+                except queue.Empty:
+                    break
+
+                image, error, scale = None, None, (1.0, 1.0)
+                read_start = time.perf_counter()
+                try:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    decode_start = time.perf_counter()
+                    # Raises cv2.error rather than returning None for some inputs, e.g. empty files
+                    if self.reduced_min_side:
+                        image, scale = decode_image_reduced(data, self.reduced_min_side)
+                    else:
+                        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                    decode_end = time.perf_counter()
+                    self._add(read_seconds=decode_start - read_start, decode_seconds=decode_end - decode_start)
+                    if image is None:
+                        error = f"Cannot read image: {path}"
+                except Exception as e:
+                    image, error = None, f"Cannot read image: {path} ({str(e)})"
+
+                self._add(decoded=1 if error is None else 0, failed=1 if error else 0)
+                if not self._put(DecodedImage(index, path, image, error, scale)):
+                    return
+        finally:
+            # Always signal the consumer, even if this thread dies
+            self._put(_DONE)
+
+    def __iter__(self) -> Iterator[DecodedImage]:
+        finished = 0
+        while finished < self.workers:
+            wait_start = time.perf_counter()
+            try:
+                item = self._decoded.get(timeout=1.0)
+            except queue.Empty:
+                self._add(consumer_wait_seconds=time.perf_counter() - wait_start)
+                if not any(thread.is_alive() for thread in self._threads) and self._decoded.empty():
+                    logger.error("Image decode workers exited without finishing the queue")
+                    return
+                continue
+            self._add(consumer_wait_seconds=time.perf_counter() - wait_start)
+            if item is _DONE:
+                finished += 1
+                continue
+            self._add(consumed=1)
+            yield item
+
+    def batches(self, batch_size: int) -> Iterator[List[DecodedImage]]:
+        """Group decoded images into batches of up to batch_size, in completion order"""
+        batch = []
+        for item in self:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def stats(self) -> Dict:
+        """Queue depths and per-stage timings so far"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update(
+            workers=self.workers,
+            queue_capacity=self.queue_size,
+            queue_depth=self._decoded.qsize(),
+            pending_paths=self._paths.qsize()
+        )
+        return stats
+
+    def close(self):
+        """Stop the decode threads (pending images are dropped)"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+
+    def __enter__(self) -> 'ImagePrefetcher':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
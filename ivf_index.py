@@ -0,0 +1,220 @@
+# ivf_index.py
+import os
+import tempfile
+import numpy as np
+import threading
+import logging
+from typing import List, Tuple, Dict, Iterable
+
+from search_index import (EMBEDDING_DIM, normalize_embeddings, cosine_to_similarity,
+                          select_top_k, train_kmeans, assign_nearest)
+
+logger = logging.getLogger(__name__)
+
+
+class IVFIndex:
+    """
+    Inverted-file face index
+
+    Embeddings are partitioned by their nearest k-means centroid into
+    posting lists. A search ranks the centroids against the query and only
+    scans the `nprobe` closest lists, so query cost grows with
+    nprobe * (faces / nlist) instead of the full gallery.
+    """
+
+    def __init__(self, centroids: np.ndarray = None, dim: int = EMBEDDING_DIM, nprobe: int = 8):
+        """
+        Initialize an index
+
+        Args:
+            centroids: Pre-trained (nlist, dim) centroids, or None to train later
+            dim: Embedding dimensionality
+            nprobe: Default number of posting lists scanned per query
+        """
+        self.dim = dim
+        self.nprobe = nprobe
+        self.centroids = None
+        self._lock = threading.RLock()
+        if centroids is not None:
+            self._reset(np.asarray(centroids, dtype=np.float32))
+
+    def _reset(self, centroids: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._centroid_norms = (self.centroids ** 2).sum(axis=1)
+        nlist = len(self.centroids)
+        self._vectors: List[np.ndarray] = [np.empty((0, self.dim), dtype=np.float32) for _ in range(nlist)]
+        self._ids: List[List[str]] = [[] for _ in range(nlist)]
+        self._locations: Dict[str, Tuple[int, int]] = {}
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def nlist(self) -> int:
+        return 0 if self.centroids is None else len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self._locations) if self.trained else 0
+
+    def __contains__(self, face_id: str) -> bool:
+        return self.trained and face_id in self._locations
+
+    @property
+    def face_ids(self) -> List[str]:
+        return list(self._locations)
+
+    def list_sizes(self) -> np.ndarray:
+        """Number of faces in each posting list"""
+        return np.array([len(ids) for ids in self._ids], dtype=np.int64)
+
+    def train(self, sample, nlist: int, iterations: int = 20):
+        """
+        Train centroids on a sample of embeddings; clears all posting lists
+
+        Args:
+            sample: 2-D array of embeddings
+            nlist: Number of posting lists
+            iterations: k-means iterations
+        """
+        centroids = train_kmeans(normalize_embeddings(sample), nlist, iterations)
+        with self._lock:
+            self._reset(centroids)
+
+    def _reserve(self, list_no: int, rows: int):
+        """Grow a posting list's vector buffer geometrically to hold `rows` rows"""
+        buffer = self._vectors[list_no]
+        if rows <= len(buffer):
+            return
+        grown = np.empty((max(rows, 2 * len(buffer), 16), self.dim), dtype=np.float32)
+        grown[:len(self._ids[list_no])] = buffer[:len(self._ids[list_no])]
+        self._vectors[list_no] = grown
+
+    def _coarse_assign(self, vectors: np.ndarray) -> np.ndarray:
+        return assign_nearest(vectors, self.centroids)
+
+    def add(self, face_ids: Iterable[str], embeddings) -> int:
+        """
+        Assign embeddings to their nearest posting lists
+
+        Args:
+            face_ids: Face identifiers, one per embedding
+            embeddings: Sequence or 2-D array of embeddings
+
+        Returns:
+            Number of rows added or replaced
+        """
+        if not self.trained:
+            raise RuntimeError("IVFIndex must be trained before adding embeddings")
+
+        face_ids = list(face_ids)
+        if not face_ids:
+            return 0
+
+        vectors = normalize_embeddings(embeddings)
+        assignments = self._coarse_assign(vectors)
+
+        with self._lock:
+            self.remove([face_id for face_id in face_ids if face_id in self._locations])
+            for list_no in np.unique(assignments):
+                members = np.flatnonzero(assignments == list_no)
+                start = len(self._ids[list_no])
+                self._reserve(list_no, start + len(members))
+                self._vectors[list_no][start:start + len(members)] = vectors[members]
+                for offset, member in enumerate(members):
+                    self._ids[list_no].append(face_ids[member])
+                    self._locations[face_ids[member]] = (int(list_no), start + offset)
+
+        return len(face_ids)
+
+    def remove(self, face_ids: Iterable[str]) -> int:
+        """
+        Remove faces by moving the last entry of their posting list into the gap
+
+        Args:
+            face_ids: Face identifiers to remove
+
+        Returns:
+            Number of faces removed
+        """
+        removed = 0
+        with self._lock:
+            for face_id in face_ids:
+                location = self._locations.pop(face_id, None)
+                if location is None:
+                    continue
+                list_no, position = location
+                ids = self._ids[list_no]
+                vectors = self._vectors[list_no]
+                last = len(ids) - 1
+                if position != last:
+                    vectors[position] = vectors[last]
+                    ids[position] = ids[last]
+                    self._locations[ids[position]] = (list_no, position)
+                ids.pop()
+                removed += 1
+        return removed
+
+    def search(self, query_embedding, threshold: float = 0.6, top_k: int = 10,
+               nprobe: int = None) -> List[Tuple[str, float]]:
+        """
+        Find the most similar faces in the closest posting lists
+
+        Args:
+            query_embedding: Query face embedding
+            threshold: Similarity threshold (0-1)
+            top_k: Return top k results
+            nprobe: Number of posting lists to scan (defaults to self.nprobe)
+
+        Returns:
+            List of (face_id, similarity_score) tuples, best first
+        """
+        if not self.trained:
+            return []
+
+        query = normalize_embeddings(query_embedding)[0]
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        with self._lock:
+            # Nearest centroids by squared L2 distance
+            distances = self._centroid_norms - 2.0 * (self.centroids @ query)
+            probes = np.argpartition(distances, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+
+            candidate_ids = []
+            candidate_scores = []
+            for list_no in probes:
+                if not self._ids[list_no]:
+                    continue
+                size = len(self._ids[list_no])
+                scores = cosine_to_similarity(self._vectors[list_no][:size] @ query)
+                keep = select_top_k(scores, threshold, top_k)
+                candidate_ids.extend(self._ids[list_no][i] for i in keep)
+                candidate_scores.append(scores[keep])
+
+        if not candidate_ids:
+            return []
+
+        scores = np.concatenate(candidate_scores)
+        order = select_top_k(scores, threshold, top_k)
+        return [(candidate_ids[i], float(scores[i])) for i in order]
+
+    def save_centroids(self, path: str):
+        """Write trained centroids to disk atomically"""
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        # A temp file per writer, so concurrent retrains never interleave
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, self.centroids)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def from_centroids_file(cls, path: str, nprobe: int = 8) -> 'IVFIndex':
+        """Create an empty index from centroids saved with save_centroids"""
+        centroids = np.load(path)
+        return cls(centroids=centroids, dim=centroids.shape[1], nprobe=nprobe)
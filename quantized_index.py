@@ -0,0 +1,258 @@
+# quantized_index.py
+import numpy as np
+import threading
+import logging
+from typing import Callable, Optional, Tuple
+
+from search_index import EMBEDDING_DIM, normalize_embeddings, cosine_to_similarity, select_top_k, train_kmeans
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ('sq8', 'pq')
+
+
+class ScalarQuantizer:
+    """
+    8-bit scalar quantizer with a per-dimension value range
+
+    Each component is stored as a uint8 step between the trained minimum and
+    maximum, cutting storage from 4 bytes to 1 byte per dimension.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.vmin = None
+        self.scale = None
+
+    @property
+    def trained(self) -> bool:
+        return self.vmin is not None
+
+    @property
+    def code_size(self) -> int:
+        return self.dim
+
+    def train(self, data: np.ndarray):
+        data = np.asarray(data, dtype=np.float32)
+        self.vmin = data.min(axis=0)
+        vmax = data.max(axis=0)
+        self.scale = np.maximum(vmax - self.vmin, 1e-6) / 255.0
+
+    def encode(self, data: np.ndarray) -> np.ndarray:
+        steps = np.rint((np.asarray(data, dtype=np.float32) - self.vmin) / self.scale)
+        return np.clip(steps, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.vmin + codes.astype(np.float32) * self.scale
+
+    def prepare_query(self, query: np.ndarray):
+        # q.x ~= q.vmin + (q * scale).codes
+        return float(query @ self.vmin), (query * self.scale).astype(np.float32)
+
+    def score(self, codes: np.ndarray, prepared) -> np.ndarray:
+        offset, weights = prepared
+        return offset + codes.astype(np.float32) @ weights
+
+
+class ProductQuantizer:
+    """
+    Product quantizer splitting each embedding into `m` sub-vectors
+
+    Every sub-vector is replaced by the id of its nearest centroid in a
+    per-subspace codebook of up to 256 entries, so a face costs `m` bytes.
+    Queries are scored with asymmetric distance computation: one lookup
+    table of query/centroid dot products per subspace.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, m: int = 64, ks: int = 256):
+        if dim % m != 0:
+            raise ValueError(f"Dimension {dim} is not divisible by m={m}")
+        self.dim = dim
+        self.m = m
+        self.ks = ks
+        self.dsub = dim // m
+        self.codebooks = None
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    @property
+    def code_size(self) -> int:
+        return self.m
+
+    def _split(self, data: np.ndarray) -> np.ndarray:
+        return np.asarray(data, dtype=np.float32).reshape(len(data), self.m, self.dsub)
+
+    def train(self, data: np.ndarray, iterations: int = 15):
+        subvectors = self._split(data)
+        ks = min(self.ks, len(data))
+        self.codebooks = np.zeros((self.m, self.ks, self.dsub), dtype=np.float32)
+        for j in range(self.m):
+            self.codebooks[j, :ks] = train_kmeans(subvectors[:, j], ks, iterations, seed=j)
+        if ks < self.ks:
+            # Pad unused codebook entries with copies so every code decodes
+            self.codebooks[:, ks:] = self.codebooks[:, :1]
+
+    def encode(self, data: np.ndarray) -> np.ndarray:
+        subvectors = self._split(data)
+        codes = np.empty((len(data), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codebook = self.codebooks[j]
+            distances = (codebook ** 2).sum(axis=1)[None, :] - 2.0 * (subvectors[:, j] @ codebook.T)
+            codes[:, j] = distances.argmin(axis=1)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = self.codebooks[np.arange(self.m)[None, :], codes]
+        return parts.reshape(len(codes), self.dim)
+
+    def prepare_query(self, query: np.ndarray) -> np.ndarray:
+        # (m, ks) table of sub-query . centroid
+        return np.einsum('md,mkd->mk', query.reshape(self.m, self.dsub), self.codebooks)
+
+    def score(self, codes: np.ndarray, table: np.ndarray) -> np.ndarray:
+        return table[np.arange(self.m)[None, :], codes].sum(axis=1)
+
+
+class QuantizedIndex:
+    """
+    Compressed embedding index with exact re-ranking
+
+    Stores only quantization codes in RAM. A search scans the codes to pick
+    `top_k * rerank_factor` candidates, then re-scores them against
+    full-precision embeddings fetched on demand (for example from the
+    memory-mapped EmbeddingStore). Positions are assigned in insertion
+    order so they can be shared with the full-precision source.
+    """
+
+    def __init__(self, mode: str = 'sq8', dim: int = EMBEDDING_DIM, pq_m: int = 64,
+                 rerank_factor: int = 10, initial_capacity: int = 1024):
+        """
+        Initialize an empty index
+
+        Args:
+            mode: 'sq8' (int8 scalar) or 'pq' (product quantization)
+            dim: Embedding dimensionality
+            pq_m: Number of PQ sub-vectors (bytes per face in 'pq' mode)
+            rerank_factor: Candidates re-ranked per requested result
+            initial_capacity: Number of code rows to preallocate
+        """
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unsupported quantization mode: {mode}")
+
+        self.mode = mode
+        self.dim = dim
+        self.rerank_factor = rerank_factor
+        self.quantizer = ScalarQuantizer(dim) if mode == 'sq8' else ProductQuantizer(dim, m=pq_m)
+        self._codes = np.empty((max(initial_capacity, 1), self.quantizer.code_size), dtype=np.uint8)
+        self._size = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def trained(self) -> bool:
+        return self.quantizer.trained
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._codes[:self._size]
+
+    def memory_bytes(self) -> int:
+        """Approximate bytes used by the stored codes"""
+        return self._size * self.quantizer.code_size
+
+    def train(self, sample):
+        """
+        Train the quantizer on a representative sample of embeddings
+
+        Args:
+            sample: 2-D array of embeddings
+        """
+        with self._lock:
+            self.quantizer.train(normalize_embeddings(sample))
+            self._size = 0
+
+    def add(self, embeddings) -> int:
+        """
+        Encode and append embeddings
+
+        Args:
+            embeddings: Sequence or 2-D array of embeddings
+
+        Returns:
+            Number of rows added
+        """
+        if not self.trained:
+            raise RuntimeError("QuantizedIndex must be trained before adding embeddings")
+
+        vectors = normalize_embeddings(embeddings)
+        codes = self.quantizer.encode(vectors)
+
+        with self._lock:
+            end = self._size + len(codes)
+            capacity = self._codes.shape[0]
+            if end > capacity:
+                while capacity < end:
+                    capacity *= 2
+                grown = np.empty((capacity, self._codes.shape[1]), dtype=np.uint8)
+                grown[:self._size] = self._codes[:self._size]
+                self._codes = grown
+            self._codes[self._size:end] = codes
+            self._size = end
+
+        return len(codes)
+
+    def search(self, query_embedding, threshold: float = 0.6, top_k: int = 10,
+               full_vectors: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+               rerank_factor: int = None,
+               chunk_rows: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the most similar rows to a query embedding
+
+        Args:
+            query_embedding: Query face embedding
+            threshold: Similarity threshold (0-1)
+            top_k: Return top k results
+            full_vectors: Callable mapping row positions to full-precision
+                embeddings; approximate scores are returned when omitted
+            rerank_factor: Override for candidates re-ranked per result
+            chunk_rows: Code rows scored per chunk
+
+        Returns:
+            (positions, similarity_scores) arrays, best first
+        """
+        query = normalize_embeddings(query_embedding)[0]
+        rerank_factor = rerank_factor or self.rerank_factor
+        n_candidates = top_k * rerank_factor if full_vectors is not None else top_k
+
+        with self._lock:
+            size = self._size
+            codes = self._codes
+        if size == 0 or top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # Approximate scan over the codes, keeping the best candidates per chunk
+        prepared = self.quantizer.prepare_query(query)
+        candidate_rows = []
+        candidate_scores = []
+        for start in range(0, size, chunk_rows):
+            scores = self.quantizer.score(codes[start:min(start + chunk_rows, size)], prepared)
+            keep = select_top_k(scores, -np.inf, n_candidates)
+            candidate_rows.append(keep + start)
+            candidate_scores.append(scores[keep])
+        rows = np.concatenate(candidate_rows)
+        scores = np.concatenate(candidate_scores)
+        keep = select_top_k(scores, -np.inf, n_candidates)
+        rows, scores = rows[keep], scores[keep]
+
+        if full_vectors is not None:
+            # Exact re-ranking against full-precision embeddings
+            exact = normalize_embeddings(full_vectors(rows))
+            scores = exact @ query
+
+        similarities = cosine_to_similarity(scores.astype(np.float32))
+        order = select_top_k(similarities, threshold, top_k)
+        return rows[order], similarities[order]
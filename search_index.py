@@ -0,0 +1,368 @@
+# search_index.py
+import numpy as np
+import threading
+import logging
+from typing import List, Tuple, Dict, Iterable, Optional
+
+from filter_index import AttributeIndex, SearchFilter
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 512
+
+
+def normalize_embeddings(embeddings) -> np.ndarray:
+    """
+    Convert embeddings to a contiguous float32 matrix of unit-length rows
+
+    Args:
+        embeddings: Single embedding or sequence of embeddings
+
+    Returns:
+        2-D float32 array with L2-normalized rows
+    """
+    matrix = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms)
+
+
+def cosine_to_similarity(scores: np.ndarray) -> np.ndarray:
+    """Map cosine similarity from [-1, 1] to the 0-1 range used by search"""
+    return (scores + 1.0) / 2.0
+
+
+def select_top_k(scores: np.ndarray, threshold: float, top_k: int) -> np.ndarray:
+    """
+    Pick the positions of the best scores above a threshold
+
+    Args:
+        scores: 1-D array of similarity scores (0-1 range)
+        threshold: Minimum similarity to keep
+        top_k: Maximum number of positions to return
+
+    Returns:
+        Positions into scores, ordered by descending score
+    """
+    if top_k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if top_k < scores.size:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(scores.size)
+
+    candidates = candidates[scores[candidates] >= threshold]
+    order = np.argsort(-scores[candidates], kind='stable')
+    return candidates[order]
+
+
+def block_top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Column positions of the top_k scores in every row of a score matrix (unordered)
+
+    Args:
+        scores: (queries, candidates) score matrix
+        top_k: Number of positions to keep per row
+
+    Returns:
+        (queries, min(top_k, candidates)) position matrix
+    """
+    k = min(top_k, scores.shape[1])
+    if k < scores.shape[1]:
+        return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+
+
+def merge_shard_results(shard_results: List[Dict], top_k: int) -> List[List[Tuple[str, float]]]:
+    """
+    Merge per-shard top-k lists into global top-k lists per query
+
+    Args:
+        shard_results: Dicts with a 'results' entry holding one list of
+            (face_id, similarity_score) pairs per query, as returned by search_shard
+        top_k: Results to keep per query
+
+    Returns:
+        One list of (face_id, similarity_score) tuples per query, best first
+    """
+    num_queries = len(shard_results[0]['results']) if shard_results else 0
+    merged = []
+    for query_index in range(num_queries):
+        hits = [
+            (face_id, score)
+            for shard_result in shard_results
+            for face_id, score in shard_result['results'][query_index]
+        ]
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        merged.append(hits[:top_k])
+    return merged
+
+
+def trim_results(results: List[List[Tuple[str, float]]], threshold: float,
+                 top_k: int) -> List[List[Tuple[str, float]]]:
+    """
+    Cut ranked per-query hit lists down to a shallower threshold and top_k
+
+    Args:
+        results: One list of (face_id, similarity_score) pairs per query, best first
+        threshold: Similarity threshold (0-1)
+        top_k: Results to keep per query
+
+    Returns:
+        Trimmed lists in the same layout
+    """
+    return [[hit for hit in hits if hit[1] >= threshold][:top_k] for hits in results]
+
+
+def train_kmeans(data: np.ndarray, k: int, iterations: int = 20, seed: int = 0,
+                 chunk_rows: int = 65536) -> np.ndarray:
+    """
+    Train k-means centroids with Lloyd's algorithm
+
+    Args:
+        data: 2-D float32 training matrix
+        k: Number of centroids
+        iterations: Number of assignment/update rounds
+        seed: Random seed for initialization
+        chunk_rows: Rows assigned per distance computation
+
+    Returns:
+        (k, dim) float32 centroid matrix
+    """
+    data = np.asarray(data, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_nearest(data, centroids, chunk_rows)
+        counts = np.bincount(assignments, minlength=k).astype(np.float32)
+
+        # Sum members per centroid with one sort + reduceat instead of a Python loop
+        order = np.argsort(assignments, kind='stable')
+        present = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts[present])[:-1]]).astype(np.int64)
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(data[order], starts, axis=0)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            # Re-seed empty clusters from random training points
+            centroids[empty] = data[rng.choice(len(data), size=int(empty.sum()), replace=False)]
+
+    return centroids
+
+
+def assign_nearest(data: np.ndarray, centroids: np.ndarray, chunk_rows: int = 65536) -> np.ndarray:
+    """Return the index of the nearest centroid (squared L2) for every row of data"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk_rows):
+        chunk = np.asarray(data[start:start + chunk_rows], dtype=np.float32)
+        # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2; ||x||^2 is constant per row
+        distances = centroid_norms[None, :] - 2.0 * (chunk @ centroids.T)
+        assignments[start:start + len(chunk)] = distances.argmin(axis=1)
+    return assignments
+
+
+class EmbeddingIndex:
+    """
+    In-memory face search index backed by one contiguous float32 matrix
+    of pre-normalized embeddings, with row-aligned attributes for filtered search
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, initial_capacity: int = 1024):
+        """
+        Initialize an empty index
+
+        Args:
+            dim: Embedding dimensionality
+            initial_capacity: Number of rows to preallocate
+        """
+        self.dim = dim
+        self._matrix = np.empty((max(initial_capacity, 1), dim), dtype=np.float32)
+        self._face_ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self.attributes = AttributeIndex(initial_capacity)
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._face_ids)
+
+    def __contains__(self, face_id: str) -> bool:
+        return face_id in self._positions
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """View of the populated rows of the embedding matrix"""
+        return self._matrix[:len(self._face_ids)]
+
+    @property
+    def face_ids(self) -> List[str]:
+        return self._face_ids
+
+    def _reserve(self, rows: int):
+        """Grow the backing matrix geometrically to hold at least `rows` rows"""
+        capacity = self._matrix.shape[0]
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        grown = np.empty((capacity, self.dim), dtype=np.float32)
+        grown[:len(self._face_ids)] = self._matrix[:len(self._face_ids)]
+        self._matrix = grown
+
+    def add(self, face_ids: Iterable[str], embeddings,
+            attributes: List[Optional[Dict]] = None) -> int:
+        """
+        Add or replace embeddings in the index
+
+        Args:
+            face_ids: Face identifiers, one per embedding
+            embeddings: Sequence or 2-D array of embeddings
+            attributes: Optional per-face attribute dicts used by filtered search
+                (see AttributeIndex.set_rows); faces without them only match
+                unfiltered searches
+
+        Returns:
+            Number of rows added or replaced
+        """
+        face_ids = list(face_ids)
+        if not face_ids:
+            return 0
+
+        vectors = normalize_embeddings(embeddings)
+        if vectors.shape != (len(face_ids), self.dim):
+            raise ValueError(
+                f"Expected {len(face_ids)} embeddings of dimension {self.dim}, got {vectors.shape}"
+            )
+
+        with self._lock:
+            self._reserve(len(self._face_ids) + len(face_ids))
+            positions = []
+            for face_id, vector in zip(face_ids, vectors):
+                position = self._positions.get(face_id)
+                if position is None:
+                    position = len(self._face_ids)
+                    self._face_ids.append(face_id)
+                    self._positions[face_id] = position
+                self._matrix[position] = vector
+                positions.append(position)
+            self.attributes.set_rows(positions, attributes or [None] * len(positions))
+
+        return len(face_ids)
+
+    def remove(self, face_ids: Iterable[str]) -> int:
+        """
+        Remove embeddings from the index by moving the last row into the gap
+
+        Args:
+            face_ids: Face identifiers to remove
+
+        Returns:
+            Number of rows removed
+        """
+        removed = 0
+        with self._lock:
+            for face_id in face_ids:
+                position = self._positions.pop(face_id, None)
+                if position is None:
+                    continue
+                last = len(self._face_ids) - 1
+                if position != last:
+                    moved_id = self._face_ids[last]
+                    self._matrix[position] = self._matrix[last]
+                    self._face_ids[position] = moved_id
+                    self._positions[moved_id] = position
+                self._face_ids.pop()
+                self.attributes.move_last(position)
+                removed += 1
+        return removed
+
+    def get_embedding(self, face_id: str) -> Optional[np.ndarray]:
+        """Return a copy of the normalized embedding for a face, if indexed"""
+        with self._lock:
+            position = self._positions.get(face_id)
+            if position is None:
+                return None
+            return self._matrix[position].copy()
+
+    def search_batch(self, query_embeddings, threshold: float = 0.6, top_k: int = 10,
+                     block_rows: int = 65536,
+                     search_filter: SearchFilter = None) -> List[List[Tuple[str, float]]]:
+        """
+        Rank many query embeddings in one pass over the matrix
+
+        Gallery rows are scored block by block with a single matrix-matrix
+        product per block, so the matrix is read once for the whole batch.
+        With a filter only the matching rows are gathered and scored.
+
+        Args:
+            query_embeddings: Sequence or 2-D array of query embeddings
+            threshold: Similarity threshold (0-1)
+            top_k: Return top k results per query
+            block_rows: Gallery rows scored per matrix-matrix product
+            search_filter: Optional attribute filter applied before scoring
+
+        Returns:
+            One list of (face_id, similarity_score) tuples per query, best first
+        """
+        queries = normalize_embeddings(query_embeddings)
+
+        with self._lock:
+            candidates = self.attributes.candidates(search_filter)
+            size = len(self._face_ids) if candidates is None else len(candidates)
+            if size == 0 or top_k <= 0:
+                return [[] for _ in range(len(queries))]
+
+            best_positions = []
+            best_scores = []
+            for start in range(0, size, block_rows):
+                end = min(start + block_rows, size)
+                block = self._matrix[start:end] if candidates is None else self._matrix[candidates[start:end]]
+                scores = cosine_to_similarity(queries @ block.T)
+                keep = block_top_k(scores, top_k)
+                best_positions.append(keep + start)
+                best_scores.append(np.take_along_axis(scores, keep, axis=1))
+
+            positions = np.hstack(best_positions)
+            if candidates is not None:
+                positions = candidates[positions]
+            scores = np.hstack(best_scores)
+            results = []
+            for row_positions, row_scores in zip(positions, scores):
+                order = select_top_k(row_scores, threshold, top_k)
+                results.append([(self._face_ids[row_positions[i]], float(row_scores[i])) for i in order])
+            return results
+
+    def search(self, query_embedding, threshold: float = 0.6, top_k: int = 10,
+               search_filter: SearchFilter = None) -> List[Tuple[str, float]]:
+        """
+        Find the most similar indexed faces to a query embedding
+
+        Args:
+            query_embedding: Query face embedding
+            threshold: Similarity threshold (0-1)
+            top_k: Return top k results
+            search_filter: Optional attribute filter applied before scoring
+
+        Returns:
+            List of (face_id, similarity_score) tuples, best first
+        """
+        query = normalize_embeddings(query_embedding)[0]
+
+        with self._lock:
+            if not self._face_ids:
+                return []
+            candidates = self.attributes.candidates(search_filter)
+            if candidates is None:
+                scores = cosine_to_similarity(self.matrix @ query)
+                positions = select_top_k(scores, threshold, top_k)
+                return [(self._face_ids[i], float(scores[i])) for i in positions]
+
+            # Score only the rows that pass the filter
+            scores = cosine_to_similarity(self._matrix[candidates] @ query)
+            positions = select_top_k(scores, threshold, top_k)
+            return [(self._face_ids[candidates[i]], float(scores[i])) for i in positions]
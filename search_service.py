@@ -0,0 +1,359 @@
+# search_service.py
+import os
+import json
+import time
+import queue
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+from typing import List, Dict, Optional
+
+from logging_config import configure_logging, get_logger
+
+logger = get_logger(__name__)
+
+# Address of the long-lived search service: unix:///path/to/socket or tcp://host:port
+SEARCH_SERVICE_URL = os.getenv('SEARCH_SERVICE_URL', 'unix:///tmp/face_search.sock')
+SEARCH_SERVICE_ENABLED = os.getenv('SEARCH_SERVICE_ENABLED', 'false').lower() == 'true'
+SEARCH_SERVICE_TIMEOUT = float(os.getenv('SEARCH_SERVICE_TIMEOUT', 30))
+# Requests arriving within the batch window are detected and ranked together
+SEARCH_SERVICE_BATCH_WINDOW_MS = float(os.getenv('SEARCH_SERVICE_BATCH_WINDOW_MS', 5))
+SEARCH_SERVICE_MAX_BATCH = int(os.getenv('SEARCH_SERVICE_MAX_BATCH', 32))
+
+_HEADER = struct.Struct('!I')
+
+
+class SearchServiceUnavailable(ConnectionError):
+    """Raised by the client when the search service cannot be reached"""
+
+
+class SearchServiceTimeout(TimeoutError):
+    """Raised by the client when the service accepted a request but did not answer in time"""
+
+
+def _parse_address(url: str):
+    """Return (socket family, address) for a unix:// or tcp:// service URL"""
+    if url.startswith('unix://'):
+        return socket.AF_UNIX, url[len('unix://'):]
+    if url.startswith('tcp://'):
+        host, port = url[len('tcp://'):].rsplit(':', 1)
+        return socket.AF_INET, (host, int(port))
+    raise ValueError(f"Unsupported search service URL: {url}")
+
+
+def _send_message(sock: socket.socket, message: Dict):
+    """Write one length-prefixed JSON message"""
+    payload = json.dumps(message).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _read_exact(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-message")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _recv_message(sock: socket.socket) -> Optional[Dict]:
+    """Read one length-prefixed JSON message, or None at end of stream"""
+    header = sock.recv(_HEADER.size, socket.MSG_WAITALL)
+    if not header:
+        return None
+    if len(header) < _HEADER.size:
+        header += _read_exact(sock, _HEADER.size - len(header))
+    (size,) = _HEADER.unpack(header)
+    return json.loads(_read_exact(sock, size).decode('utf-8'))
+
+
+class SearchServiceClient:
+    """
+    Client for the search service, used by the web app
+
+    Each call opens a short-lived connection; callers fall back to the
+    Celery path when SearchServiceUnavailable is raised. A timeout after the
+    request was sent raises SearchServiceTimeout instead: the service is up
+    but busy, and a fallback would only add to the wait.
+    """
+
+    def __init__(self, url: str = None, timeout: float = None, enabled: bool = None):
+        self.url = url or SEARCH_SERVICE_URL
+        self.timeout = timeout or SEARCH_SERVICE_TIMEOUT
+        self.enabled = SEARCH_SERVICE_ENABLED if enabled is None else enabled
+
+    def request(self, message: Dict) -> Dict:
+        """
+        Send one request and wait for its response
+
+        Raises:
+            SearchServiceUnavailable: If the service is disabled or unreachable
+            SearchServiceTimeout: If the service does not answer within the timeout
+        """
+        if not self.enabled:
+            raise SearchServiceUnavailable("Search service is disabled")
+        
+        family, address = _parse_address(self.url)
+        sent = False
+        try:
+            with socket.socket(family, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(address)
+                _send_message(sock, message)
+                sent = True
+                response = _recv_message(sock)
+        except socket.timeout as e:
+            if sent:
+                raise SearchServiceTimeout(f"No response within {self.timeout}s") from e
+            raise SearchServiceUnavailable(str(e)) from e
+        except (OSError, ValueError) as e:
+            raise SearchServiceUnavailable(str(e)) from e
+
+        if response is None:
+            raise SearchServiceUnavailable("Search service closed the connection")
+        return response
+
+    def search(self, query_image_path: str, threshold: float = 0.6, top_k: int = 20,
+               backend: str = None, all_faces: bool = False, filters: Dict = None) -> Dict:
+        """Search with a query image; same result layout as search_similar_faces"""
+        return self.request({
+            'op': 'search',
+            'query_image_path': query_image_path,
+            'threshold': threshold,
+            'top_k': top_k,
+            'backend': backend,
+            'all_faces': all_faces,
+            'filters': filters
+        })
+
+    def similar(self, face_id: str, threshold: float = 0.6, top_k: int = 20,
+                backend: str = None, filters: Dict = None) -> Dict:
+        """Search with a stored face; same result layout as find_faces_similar_to"""
+        return self.request({
+            'op': 'similar',
+            'face_id': face_id,
+            'threshold': threshold,
+            'top_k': top_k,
+            'backend': backend,
+            'filters': filters
+        })
+
+
+class _PendingRequest:
+    """A request waiting in the batch queue"""
+
+    def __init__(self, message: Dict):
+        self.message = message
+        self.result = None
+        self.done = threading.Event()
+
+
+class SearchService:
+    """
+    Long-lived search process keeping the model and embedding index warm
+
+    Connection handler threads enqueue requests; one batch thread drains the
+    queue every SEARCH_SERVICE_BATCH_WINDOW_MS (or at SEARCH_SERVICE_MAX_BATCH
+    requests), runs detection for the batch and ranks all query embeddings
+    that share a backend and filter in one pass over the index.
+    """
+
+    def __init__(self, url: str = None, batch_window_ms: float = None, max_batch: int = None):
+        # Imported here so the web app can use the client without loading the model
+        import celery_tasks
+        self.tasks = celery_tasks
+
+        self.url = url or SEARCH_SERVICE_URL
+        self.batch_window = (batch_window_ms if batch_window_ms is not None else SEARCH_SERVICE_BATCH_WINDOW_MS) / 1000.0
+        self.max_batch = max_batch or SEARCH_SERVICE_MAX_BATCH
+        self._queue = queue.Queue()
+        self._server = None
+
+    def warm_up(self):
+        """Load the in-memory index before accepting requests"""
+        session = self.tasks.get_session()
+        try:
+            index = self.tasks.get_search_index(session)
+            logger.info("Search index warm", faces=len(index))
+        finally:
+            session.close()
+
+    def submit(self, message: Dict, timeout: float = None) -> Dict:
+        """Queue a request for the next batch and wait for its result"""
+        pending = _PendingRequest(message)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout or SEARCH_SERVICE_TIMEOUT):
+            return {'status': 'error', 'message': 'Search timed out'}
+        return pending.result
+
+    def _next_batch(self) -> List[_PendingRequest]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.process_batch(batch)
+            except Exception as e:
+                logger.error(f"Search batch failed: {str(e)}")
+                for pending in batch:
+                    if pending.result is None:
+                        pending.result = {'status': 'error', 'message': str(e)}
+            for pending in batch:
+                pending.done.set()
+
+    def process_batch(self, batch: List[_PendingRequest]):
+        """Answer every request in a batch, sharing ranking passes where possible"""
+        tasks = self.tasks
+        start_time = time.time()
+        session = tasks.get_session()
+        try:
+            searches = []
+            for pending in batch:
+                message = pending.message
+                op = message.get('op')
+                try:
+                    backend = (message.get('backend') or tasks.SEARCH_BACKEND).lower()
+                    if backend == 'sharded':
+                        # This process holds the whole index; no need to fan out
+                        backend = 'memory'
+                    search_filter = tasks.SearchFilter.from_dict(message.get('filters'))
+
+                    if op == 'ping':
+                        pending.result = {'status': 'success'}
+                    elif op == 'similar':
+                        pending.result = tasks.find_faces_similar_to(
+                            session, message['face_id'], message.get('threshold', 0.6),
+                            message.get('top_k', 20), backend, search_filter
+                        )
+                    elif op == 'search':
+                        searches.append((pending, message['query_image_path'], backend, search_filter))
+                    else:
+                        pending.result = {'status': 'error', 'message': f'Unknown operation: {op}'}
+                except Exception as e:
+                    pending.result = {'status': 'error', 'message': str(e)}
+
+            # Detect the faces of every query image of the batch in one batched pass
+            try:
+                detected = tasks.detect_query_faces_batch(
+                    [path for _, path, _, _ in searches]
+                ) if searches else []
+            except Exception as e:
+                logger.error(f"Query detection failed: {str(e)}")
+                for pending, _, _, _ in searches:
+                    pending.result = {'status': 'error', 'message': str(e)}
+                searches, detected = [], []
+
+            groups = {}
+            for (pending, _, backend, search_filter), query_faces in zip(searches, detected):
+                if not query_faces:
+                    pending.result = {'status': 'error', 'message': 'No faces found in query image'}
+                    continue
+                if not pending.message.get('all_faces'):
+                    query_faces = query_faces[:1]
+                key = (backend, json.dumps(search_filter.to_dict() if search_filter else None, sort_keys=True))
+                groups.setdefault(key, (backend, search_filter, []))[2].append((pending, query_faces))
+
+            for backend, search_filter, members in groups.values():
+                try:
+                    self._answer_group(session, backend, search_filter, members, start_time)
+                except Exception as e:
+                    # Only this group's requests share the failure
+                    logger.error(f"Search group failed: {str(e)}", backend=backend)
+                    session.rollback()
+                    for pending, _ in members:
+                        pending.result = {'status': 'error', 'message': str(e)}
+        finally:
+            session.close()
+
+        logger.info("Search batch completed", batch_size=len(batch),
+                    duration_seconds=time.time() - start_time)
+
+    def _answer_group(self, session, backend: str, search_filter, members: List, start_time: float):
+        """Rank every query face of a group at the loosest threshold / deepest top_k, then slice per request"""
+        tasks = self.tasks
+        embeddings = [face['embedding'] for _, query_faces in members for face in query_faces]
+        threshold = min(pending.message.get('threshold', 0.6) for pending, _ in members)
+        top_k = max(pending.message.get('top_k', 20) for pending, _ in members)
+        ranked, cache_hit = tasks.rank_with_candidate_cache(
+            session, embeddings, threshold, top_k, backend, search_filter
+        )
+
+        ranked = iter(ranked)
+        for pending, query_faces in members:
+            request_threshold = pending.message.get('threshold', 0.6)
+            request_top_k = pending.message.get('top_k', 20)
+            sliced = [
+                [(face_id, score) for face_id, score in next(ranked) if score >= request_threshold][:request_top_k]
+                for _ in query_faces
+            ]
+            summaries = [
+                {'bbox': face['bbox'], 'quality_score': face['quality_score']}
+                for face in query_faces
+            ]
+            result = tasks.build_search_result(
+                session, summaries, sliced, bool(pending.message.get('all_faces'))
+            )
+            tasks.record_search_result(result, start_time, backend, cache_hit=cache_hit)
+            pending.result = result
+
+    def serve_forever(self):
+        """Bind the service address and answer requests until interrupted"""
+        family, address = _parse_address(self.url)
+        service = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    try:
+                        message = _recv_message(self.request)
+                    except (OSError, ValueError):
+                        return
+                    if message is None:
+                        return
+                    _send_message(self.request, service.submit(message))
+
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.remove(address)
+            server_class = socketserver.ThreadingUnixStreamServer
+        else:
+            server_class = socketserver.ThreadingTCPServer
+        server_class.daemon_threads = True
+        server_class.allow_reuse_address = True
+
+        self.warm_up()
+        threading.Thread(target=self._batch_loop, name='search-batcher', daemon=True).start()
+
+        with server_class(address, Handler) as server:
+            self._server = server
+            logger.info("Search service listening", url=self.url)
+            server.serve_forever()
+
+
+# Global client used by the web app
+search_service_client = SearchServiceClient()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Long-lived face search service')
+    parser.add_argument('--url', default=None, help='unix:///path or tcp://host:port (defaults to SEARCH_SERVICE_URL)')
+    parser.add_argument('--batch-window-ms', type=float, default=None, help='Request batching window')
+    parser.add_argument('--max-batch', type=int, default=None, help='Maximum requests per batch')
+    args = parser.parse_args()
+
+    configure_logging()
+    SearchService(args.url, args.batch_window_ms, args.max_batch).serve_forever()
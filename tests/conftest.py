@@ -0,0 +1,35 @@
+# tests/conftest.py
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The application modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def brute_force_top_k(gallery, face_ids, query, threshold, top_k):
+    """Exact reference ranking: (face_id, similarity) pairs, best first"""
+    gallery = np.asarray(gallery, dtype=np.float64)
+    gallery = gallery / np.linalg.norm(gallery, axis=1, keepdims=True)
+    query = np.asarray(query, dtype=np.float64)
+    query = query / np.linalg.norm(query)
+    scores = (gallery @ query + 1.0) / 2.0
+    order = np.argsort(-scores, kind='stable')
+    return [(face_ids[i], float(scores[i])) for i in order[:top_k] if scores[i] >= threshold]
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(1234)
+
+
+@pytest.fixture
+def clustered_embeddings(rng):
+    """600 64-d embeddings drawn around 30 identities, so thresholds matter"""
+    centers = rng.standard_normal((30, 64))
+    labels = rng.integers(0, 30, 600)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((600, 64))
+    face_ids = [f"face_{i}" for i in range(len(vectors))]
+    return face_ids, vectors.astype(np.float32)
@@ -0,0 +1,116 @@
+# tests/test_embedding_store.py
+import numpy as np
+import pytest
+
+from conftest import brute_force_top_k
+from embedding_store import EmbeddingStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    # Small shards so the gallery spans several shard files
+    return EmbeddingStore(str(tmp_path / 'store'), dim=64, dtype='float32', shard_rows=128)
+
+
+def assert_same_ranking(results, expected, abs_tol=1e-5):
+    assert [face_id for face_id, _ in results] == [face_id for face_id, _ in expected]
+    assert [score for _, score in results] == pytest.approx([score for _, score in expected], abs=abs_tol)
+
+
+def test_search_matches_brute_force_across_shards(store, clustered_embeddings, rng):
+    face_ids, vectors = clustered_embeddings
+    # Uneven appends land on shard boundaries mid-batch
+    for start, end in ((0, 100), (100, 333), (333, len(face_ids))):
+        store.append(face_ids[start:end], vectors[start:end])
+    assert len(store) == len(face_ids)
+
+    queries = vectors[rng.choice(len(vectors), 6, replace=False)]
+    batch = store.search_batch(queries, 0.6, 15, chunk_rows=50)
+    for query, ranked in zip(queries, batch):
+        expected = brute_force_top_k(vectors, face_ids, query, 0.6, 15)
+        assert_same_ranking(store.search(query, 0.6, 15, chunk_rows=70), expected)
+        assert_same_ranking(ranked, expected)
+
+
+def test_float16_store_ranks_close_to_exact(tmp_path, clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    store = EmbeddingStore(str(tmp_path / 'half'), dim=64, dtype='float16', shard_rows=256)
+    store.append(face_ids, vectors)
+
+    expected = brute_force_top_k(vectors, face_ids, vectors[3], 0.0, 5)
+    results = store.search(vectors[3], 0.0, 5)
+    assert results[0][0] == face_ids[3]
+    assert [score for _, score in results] == pytest.approx([score for _, score in expected], abs=1e-3)
+
+
+def test_get_rows_and_face_ids_for(store, clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    store.append(face_ids, vectors)
+    rows = np.array([0, 127, 128, 599, 300])
+
+    normalized = vectors[rows] / np.linalg.norm(vectors[rows], axis=1, keepdims=True)
+    assert store.get_rows(rows) == pytest.approx(normalized, abs=1e-6)
+    assert store.face_ids_for(rows) == [face_ids[row] for row in rows]
+
+
+def test_iter_search_batch_converges_to_search_batch(store, clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    store.append(face_ids, vectors)
+    queries = vectors[[5, 50, 500]]
+
+    steps = list(store.iter_search_batch(queries, 0.55, 10, chunk_rows=100))
+    # Chunks stop at shard boundaries as well as every chunk_rows
+    scanned = [rows for rows, _, _ in steps]
+    assert scanned == sorted(set(scanned)) and scanned[-1] == len(face_ids)
+    assert all(b - a <= 100 for a, b in zip([0] + scanned, scanned))
+    assert all(total == len(face_ids) for _, total, _ in steps)
+
+    # Running top-k only ever improves
+    for (_, _, before), (_, _, after) in zip(steps, steps[1:]):
+        for old_hits, new_hits in zip(before, after):
+            if old_hits and new_hits:
+                assert new_hits[0][1] >= old_hits[0][1]
+
+    _, total, final = steps[-1]
+    assert store.resolve_rows(final, total) == store.search_batch(queries, 0.55, 10)
+
+
+def test_reopen_keeps_rows_and_manifest(store, clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    store.append(face_ids[:200], vectors[:200])
+
+    # Settings of an existing store come from its manifest, not the arguments
+    reopened = EmbeddingStore(store.root, dim=64, dtype='float16', shard_rows=1000)
+    assert reopened.dtype == np.float32
+    assert reopened.shard_rows == 128
+    assert len(reopened) == 200
+
+    reopened.append(face_ids[200:], vectors[200:])
+    assert len(store) == len(face_ids)
+    expected = brute_force_top_k(vectors, face_ids, vectors[450], 0.0, 5)
+    assert_same_ranking(store.search(vectors[450], 0.0, 5), expected)
+
+
+def test_clear_bumps_epoch_and_drops_stale_mappings(store, clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    other = EmbeddingStore(store.root)
+    store.append(face_ids[:300], vectors[:300])
+    assert other.search(vectors[0], 0.0, 1)[0][0] == face_ids[0]
+    epoch = other.epoch
+
+    store.clear()
+    assert other.epoch == epoch + 1
+    assert len(other) == 0
+    assert other.search(vectors[0], 0.0, 5) == []
+
+    # New rows reuse the same row numbers; the other process must not read its old mappings
+    store.append(face_ids[300:], vectors[300:])
+    expected = brute_force_top_k(vectors[300:], face_ids[300:], vectors[0], 0.0, 5)
+    assert_same_ranking(other.search(vectors[0], 0.0, 5), expected)
+    assert other.face_ids_for([0]) == [face_ids[300]]
+
+
+def test_append_rejects_wrong_dimension(store):
+    with pytest.raises(ValueError):
+        store.append(['a'], np.ones((1, 32)))
+    assert len(store) == 0
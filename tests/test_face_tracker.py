@@ -0,0 +1,161 @@
+# tests/test_face_tracker.py
+import numpy as np
+import pytest
+
+from face_tracker import FaceTracker, box_iou, merge_segment_tracks
+
+
+class FakeFace:
+    """Detection with the attributes FaceTracker reads"""
+
+    def __init__(self, bbox, identity):
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.identity = identity
+        self.embedding = None
+
+
+class FakeEmbedder:
+    """Embeds faces with their identity's vector and counts the calls"""
+
+    def __init__(self, identities):
+        self.identities = identities
+        self.embedded = 0
+
+    def __call__(self, faces):
+        self.embedded += len(faces)
+        for face in faces:
+            face.embedding = self.identities[face.identity]
+
+
+@pytest.fixture
+def embedder(rng):
+    return FakeEmbedder({name: rng.standard_normal(64) for name in ('alice', 'bob')})
+
+
+def shifted(box, dx):
+    return [box[0] + dx, box[1], box[2] + dx, box[3]]
+
+
+def test_box_iou():
+    iou = box_iou([[0, 0, 10, 10]], [[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]])
+    assert iou[0] == pytest.approx([1.0, 1.0 / 3.0, 0.0])
+
+
+def test_confident_overlaps_link_without_recognition(embedder):
+    tracker = FaceTracker(iou_threshold=0.3, confident_iou=0.6, embedding_threshold=0.7,
+                          max_missed=1, quality_margin=0.05, diverse_samples=0)
+    box = [100, 100, 200, 200]
+    for frame_number in range(5):
+        face = FakeFace(shifted(box, 2 * frame_number), 'alice')
+        assert tracker.update([face], [0.5], None, frame_number, frame_number / 10.0, embedder) == []
+
+    # Only the first detection needs an embedding; the others overlap confidently
+    assert embedder.embedded == 1
+    assert tracker.stats == {'detections': 5, 'embedded': 1, 'tracks': 1}
+    (track,) = tracker.finish()
+    assert (track.start_frame, track.end_frame, track.detections) == (0, 4, 5)
+
+
+def test_better_quality_face_replaces_best(embedder):
+    tracker = FaceTracker(quality_margin=0.05, diverse_samples=0)
+    box = [100, 100, 200, 200]
+    for frame_number, quality in enumerate([0.5, 0.52, 0.9]):
+        tracker.update([FakeFace(box, 'alice')], [quality], None, frame_number, float(frame_number), embedder)
+
+    (track,) = tracker.finish()
+    assert track.best.quality == 0.9 and track.best.frame_number == 2
+    assert embedder.embedded == 2
+
+
+def test_tracks_end_after_max_missed_and_faces_are_reidentified(embedder):
+    tracker = FaceTracker(max_missed=1, embedding_threshold=0.7, diverse_samples=0)
+    alice, bob = [0, 0, 50, 50], [300, 300, 350, 350]
+
+    tracker.update([FakeFace(alice, 'alice'), FakeFace(bob, 'bob')], [0.5, 0.5], None, 0, 0.0, embedder)
+    assert len(tracker.active) == 2
+
+    # Alice jumps across the frame (no overlap) and is re-identified by embedding
+    tracker.update([FakeFace([400, 0, 450, 50], 'alice')], [0.5], None, 1, 1.0, embedder)
+    assert len(tracker.active) == 2
+    finished = tracker.update([], [], None, 2, 2.0, embedder)
+    assert len(finished) == 1 and finished[0].detections == 1  # bob, missed twice
+    (alice_track,) = tracker.finish()
+    assert alice_track.detections == 2
+
+
+def test_overlapping_strangers_start_separate_tracks(embedder):
+    tracker = FaceTracker(embedding_threshold=0.7, diverse_samples=0)
+    box = [100, 100, 200, 200]
+    tracker.update([FakeFace(box, 'alice')], [0.5], None, 0, 0.0, embedder)
+    # Same place, different person: the weak link is checked and rejected
+    tracker.update([FakeFace(shifted(box, 40), 'bob')], [0.5], None, 1, 1.0, embedder)
+    assert tracker.stats['tracks'] == 2
+
+
+def segment_face(track_id, embedding, quality, track_start, track_end, detections=3):
+    return {'track_id': track_id, 'embedding': list(embedding), 'quality_score': quality,
+            'track_start': track_start, 'track_end': track_end, 'track_detections': detections}
+
+
+def test_track_cut_at_boundary_is_joined(embedder):
+    alice = embedder.identities['alice']
+    segments = [
+        {'start_time': 0.0, 'faces': [segment_face('a', alice, 0.5, 2.0, 9.8, detections=4)]},
+        {'start_time': 10.0, 'faces': [segment_face('b', alice + 0.05, 0.8, 10.1, 15.0, detections=6)]},
+    ]
+    merged = merge_segment_tracks(segments, max_gap_seconds=1.0, embedding_threshold=0.7, diverse_samples=0)
+
+    (face,) = merged
+    # The best face survives under the first segment's track and the combined span
+    assert face['quality_score'] == 0.8
+    assert (face['track_id'], face['track_start'], face['track_end']) == ('a', 2.0, 15.0)
+    assert face['track_detections'] == 10
+
+
+def test_tracks_are_chained_across_several_boundaries(embedder):
+    alice = embedder.identities['alice']
+    segments = [
+        {'start_time': 0.0, 'faces': [segment_face('a', alice, 0.4, 0.0, 9.9)]},
+        {'start_time': 10.0, 'faces': [segment_face('b', alice, 0.9, 10.0, 19.9)]},
+        {'start_time': 20.0, 'faces': [segment_face('c', alice, 0.6, 20.0, 25.0)]},
+    ]
+    merged = merge_segment_tracks(segments, max_gap_seconds=0.5, embedding_threshold=0.7, diverse_samples=1)
+
+    assert [face['quality_score'] for face in merged] == [0.9, 0.6]
+    assert {face['track_id'] for face in merged} == {'a'}
+    assert all((face['track_start'], face['track_end']) == (0.0, 25.0) for face in merged)
+
+
+def test_only_matching_tracks_near_the_boundary_are_joined(embedder):
+    alice, bob = embedder.identities['alice'], embedder.identities['bob']
+    segments = [
+        {'start_time': 0.0, 'faces': [
+            segment_face('a', alice, 0.5, 0.0, 9.9),
+            segment_face('b', bob, 0.5, 0.0, 9.9),
+            segment_face('early', alice, 0.5, 0.0, 4.0),
+            {'quality_score': 0.3, 'embedding': list(bob)},
+        ]},
+        {'start_time': 10.0, 'faces': [
+            segment_face('c', bob, 0.7, 10.0, 12.0),
+            segment_face('d', alice, 0.7, 10.0, 12.0),
+            segment_face('late', bob, 0.7, 16.0, 18.0),
+        ]},
+    ]
+    merged = merge_segment_tracks(segments, max_gap_seconds=1.0, embedding_threshold=0.7, diverse_samples=0)
+
+    by_track = {}
+    for face in merged:
+        by_track.setdefault(face.get('track_id'), []).append(face['quality_score'])
+    # Each cut track pairs with the same identity; tracks away from the boundary stay separate
+    assert by_track == {'a': [0.7], 'b': [0.7], 'early': [0.5], 'late': [0.7], None: [0.3]}
+    assert next(face for face in merged if face.get('track_id') == 'a')['embedding'] == list(alice)
+
+
+def test_segments_without_joins_are_concatenated(embedder):
+    alice, bob = embedder.identities['alice'], embedder.identities['bob']
+    first = [segment_face('a', alice, 0.5, 0.0, 9.9)]
+    second = [segment_face('b', bob, 0.5, 10.0, 12.0), segment_face('b', bob, 0.4, 10.0, 12.0)]
+    segments = [{'start_time': 0.0, 'faces': first}, {'start_time': 10.0, 'faces': second}]
+
+    assert merge_segment_tracks(segments, max_gap_seconds=1.0, embedding_threshold=0.7) == first + second
+    assert merge_segment_tracks([], max_gap_seconds=1.0) == []
@@ -0,0 +1,145 @@
+# tests/test_filter_index.py
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+import filter_index
+from filter_index import AttributeIndex, SearchFilter, age_bucket, AGE_BUCKET_LABELS
+
+
+def random_attributes(rng):
+    attrs = {
+        'file_id': int(rng.integers(0, 8)),
+        'upload_time': float(rng.uniform(0, 1000)),
+        'quality_score': float(rng.uniform(0, 1)),
+        'gender': ('male', 'female', None)[rng.integers(0, 3)],
+        'age': int(rng.integers(0, 90)),
+    }
+    if rng.random() < 0.5:
+        attrs['timestamp'] = float(rng.uniform(0, 60))
+    if rng.random() < 0.1:
+        del attrs['quality_score']
+    return attrs
+
+
+def random_filter(rng):
+    fields = {}
+    if rng.random() < 0.3:
+        fields['file_ids'] = rng.choice(8, int(rng.integers(1, 4)), replace=False).tolist()
+    if rng.random() < 0.5:
+        low = float(rng.uniform(0, 1))
+        fields['min_quality'], fields['max_quality'] = low, low + float(rng.uniform(0, 0.5))
+    if rng.random() < 0.4:
+        fields['uploaded_after'] = float(rng.uniform(0, 800))
+    if rng.random() < 0.3:
+        fields['max_timestamp'] = float(rng.uniform(0, 60))
+    if rng.random() < 0.4:
+        fields['genders'] = [('male', 'female')[rng.integers(0, 2)]]
+    if rng.random() < 0.3:
+        fields['age_buckets'] = list(rng.choice(AGE_BUCKET_LABELS, 2, replace=False))
+    return SearchFilter(**fields)
+
+
+def matches(attrs, search_filter):
+    """Reference implementation of a filter on one row"""
+    def within(value, low, high):
+        if low is None and high is None:
+            return True
+        if value is None:
+            return False
+        return (low is None or value >= low) and (high is None or value <= high)
+
+    if search_filter.file_ids is not None and attrs.get('file_id') not in search_filter.file_ids:
+        return False
+    if search_filter.genders is not None and attrs.get('gender') not in search_filter.genders:
+        return False
+    if search_filter.age_buckets is not None and (
+            attrs.get('age') is None
+            or AGE_BUCKET_LABELS[age_bucket(attrs['age'])] not in search_filter.age_buckets):
+        return False
+    return (within(attrs.get('quality_score'), search_filter.min_quality, search_filter.max_quality)
+            and within(attrs.get('upload_time'), search_filter.uploaded_after, search_filter.uploaded_before)
+            and within(attrs.get('timestamp'), search_filter.min_timestamp, search_filter.max_timestamp))
+
+
+def expected_positions(rows, search_filter):
+    return [position for position, attrs in enumerate(rows) if matches(attrs, search_filter)]
+
+
+@pytest.mark.parametrize('stale_limit', [4096, 8])
+def test_candidates_match_reference_under_ingest_and_removal(monkeypatch, rng, stale_limit):
+    # A small limit exercises the re-sort path as well as the stale-row path
+    monkeypatch.setattr(filter_index, 'STALE_ROWS_BEFORE_RESORT', stale_limit)
+    index = AttributeIndex(initial_capacity=4)
+    rows = []
+
+    for step in range(600):
+        action = rng.random()
+        if action < 0.45 or not rows:
+            batch = [random_attributes(rng) for _ in range(int(rng.integers(1, 6)))]
+            index.set_rows(np.arange(len(rows), len(rows) + len(batch)), batch)
+            rows.extend(batch)
+        elif action < 0.6:
+            position = int(rng.integers(0, len(rows)))
+            rows[position] = random_attributes(rng)
+            index.set_rows([position], [rows[position]])
+        elif action < 0.75:
+            # Swap-remove, as EmbeddingIndex.remove does
+            position = int(rng.integers(0, len(rows)))
+            index.move_last(position)
+            rows[position] = rows[-1]
+            rows.pop()
+        else:
+            search_filter = random_filter(rng)
+            candidates = index.candidates(search_filter)
+            if search_filter.is_empty():
+                assert candidates is None
+            else:
+                assert candidates.tolist() == expected_positions(rows, search_filter), f"step {step}"
+        assert len(index) == len(rows)
+
+
+def test_range_columns_stay_sorted_across_small_ingests(rng):
+    index = AttributeIndex()
+    index.set_rows(np.arange(100), [random_attributes(rng) for _ in range(100)])
+    index.candidates(SearchFilter(min_quality=0.5))
+    sorted_columns = dict(index._sorted)
+
+    index.set_rows([100, 101], [{'quality_score': 0.9}, {'quality_score': 0.1}])
+    index.move_last(3)
+    # Small changes are tracked as stale rows instead of dropping the sort
+    assert index._sorted.keys() == sorted_columns.keys()
+    assert index._stale == {100, 101, 3}
+    assert 100 in index.candidates(SearchFilter(min_quality=0.8)).tolist()
+
+
+def test_unknown_values_never_match():
+    index = AttributeIndex()
+    index.set_rows([0, 1], [{'quality_score': 0.9, 'gender': 'female', 'age': 30}, None])
+    assert index.candidates(SearchFilter(min_quality=0.0)).tolist() == [0]
+    assert index.candidates(SearchFilter(genders=['female'])).tolist() == [0]
+    assert index.candidates(SearchFilter(age_buckets=['25-34'])).tolist() == [0]
+    assert index.candidates(SearchFilter(max_timestamp=10)).tolist() == []
+    assert index.candidates(None) is None
+
+
+def test_search_filter_parsing():
+    assert SearchFilter.from_dict(None) is None
+    assert SearchFilter.from_dict({'file_ids': None}) is None
+
+    search_filter = SearchFilter.from_dict({
+        'file_ids': ['3', 1, 3],
+        'uploaded_after': datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat(),
+        'genders': ['male'],
+    })
+    assert search_filter.file_ids == [1, 3]
+    assert search_filter.uploaded_after == datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+    assert SearchFilter.from_dict(search_filter.to_dict()).to_dict() == search_filter.to_dict()
+
+    with pytest.raises(ValueError):
+        SearchFilter.from_dict({'colour': 'red'})
+    with pytest.raises(ValueError):
+        SearchFilter(genders=['other'])
+    with pytest.raises(ValueError):
+        SearchFilter(age_buckets=['20-30'])
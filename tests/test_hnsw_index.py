@@ -0,0 +1,100 @@
+# tests/test_hnsw_index.py
+import os
+
+import numpy as np
+import pytest
+
+from conftest import brute_force_top_k
+from hnsw_index import HNSWIndex
+
+
+@pytest.fixture
+def graph(clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    index = HNSWIndex(dim=vectors.shape[1], m=8, ef_construction=64, ef_search=32, initial_capacity=16)
+    index.add(face_ids, vectors)
+    return index
+
+
+def recall(index, vectors, face_ids, queries, top_k, **search_kwargs):
+    hits = 0
+    for query in queries:
+        expected = {face_id for face_id, _ in brute_force_top_k(vectors, face_ids, query, 0.0, top_k)}
+        hits += len(expected & {face_id for face_id, _ in index.search(query, 0.0, top_k, **search_kwargs)})
+    return hits / (len(queries) * top_k)
+
+
+def test_search_recall_against_brute_force(graph, clustered_embeddings, rng):
+    face_ids, vectors = clustered_embeddings
+    assert len(graph) == len(face_ids)
+    queries = vectors[rng.choice(len(vectors), 20, replace=False)] + 0.2 * rng.standard_normal((20, 64))
+
+    assert recall(graph, vectors, face_ids, queries, 10) >= 0.9
+    # A beam as wide as the graph visits every reachable node
+    assert recall(graph, vectors, face_ids, queries, 10, ef_search=len(face_ids)) == 1.0
+
+
+def test_scores_and_threshold_match_brute_force(graph, clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    results = graph.search(vectors[17], 0.7, 10, ef_search=len(face_ids))
+    expected = brute_force_top_k(vectors, face_ids, vectors[17], 0.7, 10)
+
+    assert [face_id for face_id, _ in results] == [face_id for face_id, _ in expected]
+    assert [score for _, score in results] == pytest.approx([score for _, score in expected], abs=1e-5)
+
+
+def test_removed_faces_never_returned(graph, clustered_embeddings, rng):
+    face_ids, vectors = clustered_embeddings
+    removed = set(rng.choice(len(face_ids), 200, replace=False).tolist())
+    assert graph.remove([face_ids[i] for i in removed] + ['missing']) == len(removed)
+    assert len(graph) == len(face_ids) - len(removed)
+    assert graph.deleted_count == len(removed)
+
+    kept = [i for i in range(len(face_ids)) if i not in removed]
+    kept_ids = [face_ids[i] for i in kept]
+    removed_ids = {face_ids[i] for i in removed}
+    queries = vectors[list(removed)[:10]]
+    for query in queries:
+        assert not removed_ids & {face_id for face_id, _ in graph.search(query, 0.0, 20)}
+    # Tombstones still route searches, so recall over the live faces holds up
+    assert recall(graph, vectors[kept], kept_ids, queries, 10) >= 0.85
+
+
+def test_re_adding_face_replaces_its_node(graph, clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    graph.add([face_ids[0]], vectors[300:301])
+    assert len(graph) == len(face_ids)
+    assert graph.deleted_count == 1
+
+    results = graph.search(vectors[300], 0.0, 5, ef_search=len(face_ids))
+    assert {face_ids[0], face_ids[300]} <= {face_id for face_id, _ in results[:2]}
+    assert [face_id for face_id, _ in results].count(face_ids[0]) == 1
+
+
+def test_save_load_round_trip(tmp_path, graph, clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    graph.remove(face_ids[:50])
+    graph.metadata = {'last_row_id': 600.0, 'store_epoch': 3.0}
+    path = str(tmp_path / 'hnsw' / 'graph.npz')
+    graph.save(path)
+    assert os.listdir(os.path.dirname(path)) == ['graph.npz']
+
+    loaded = HNSWIndex.load(path)
+    assert len(loaded) == len(graph)
+    assert loaded.deleted_count == graph.deleted_count
+    assert loaded.metadata == graph.metadata
+    assert sorted(loaded.face_ids) == sorted(graph.face_ids)
+    for query in vectors[[60, 250, 599]]:
+        assert loaded.search(query, 0.5, 10) == graph.search(query, 0.5, 10)
+
+    # The loaded graph keeps accepting inserts
+    extra = vectors[:5] + 0.01
+    loaded.add([f"extra_{i}" for i in range(5)], extra)
+    assert loaded.search(extra[2], 0.0, 1, ef_search=len(face_ids))[0][0] == 'extra_2'
+
+
+def test_empty_graph():
+    index = HNSWIndex(dim=8)
+    assert index.search(np.ones(8), 0.0, 5) == []
+    with pytest.raises(ValueError):
+        index.add(['a'], np.ones((1, 4)))
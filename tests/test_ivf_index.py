@@ -0,0 +1,91 @@
+# tests/test_ivf_index.py
+import os
+
+import numpy as np
+import pytest
+
+from conftest import brute_force_top_k
+from ivf_index import IVFIndex
+
+
+def build_index(face_ids, vectors, nlist=12, nprobe=3):
+    index = IVFIndex(dim=vectors.shape[1], nprobe=nprobe)
+    index.train(vectors, nlist)
+    index.add(face_ids, vectors)
+    return index
+
+
+def assert_same_ranking(results, expected):
+    assert [face_id for face_id, _ in results] == [face_id for face_id, _ in expected]
+    assert [score for _, score in results] == pytest.approx([score for _, score in expected], abs=1e-5)
+
+
+def test_probing_every_list_matches_brute_force(clustered_embeddings, rng):
+    face_ids, vectors = clustered_embeddings
+    index = build_index(face_ids, vectors)
+    assert len(index) == len(face_ids)
+    assert index.list_sizes().sum() == len(face_ids)
+
+    for query in vectors[rng.choice(len(vectors), 5, replace=False)]:
+        expected = brute_force_top_k(vectors, face_ids, query, 0.6, 15)
+        assert_same_ranking(index.search(query, 0.6, 15, nprobe=index.nlist), expected)
+
+
+def test_partial_probe_recall(clustered_embeddings, rng):
+    face_ids, vectors = clustered_embeddings
+    index = build_index(face_ids, vectors, nlist=12, nprobe=4)
+    queries = vectors[rng.choice(len(vectors), 20, replace=False)]
+
+    hits = 0
+    for query in queries:
+        expected = {face_id for face_id, _ in brute_force_top_k(vectors, face_ids, query, 0.0, 10)}
+        hits += len(expected & {face_id for face_id, _ in index.search(query, 0.0, 10)})
+    assert hits / (len(queries) * 10) >= 0.9
+
+
+def test_add_replaces_and_remove_compacts_lists(clustered_embeddings, rng):
+    face_ids, vectors = clustered_embeddings
+    index = build_index(face_ids, vectors)
+
+    # Re-adding a face with another embedding may move it to another list
+    index.add([face_ids[0]], vectors[400:401])
+    assert len(index) == len(face_ids)
+    top = index.search(vectors[400], 0.0, 2, nprobe=index.nlist)
+    assert {face_id for face_id, _ in top} == {face_ids[0], face_ids[400]}
+
+    vectors = vectors.copy()
+    vectors[0] = vectors[400]
+    removed = set(rng.choice(len(face_ids), 200, replace=False).tolist())
+    assert index.remove([face_ids[i] for i in removed] + ['missing']) == len(removed)
+    assert index.list_sizes().sum() == len(face_ids) - len(removed)
+
+    kept = [i for i in range(len(face_ids)) if i not in removed]
+    assert sorted(index.face_ids) == sorted(face_ids[i] for i in kept)
+    for query in vectors[kept[:3]]:
+        expected = brute_force_top_k(vectors[kept], [face_ids[i] for i in kept], query, 0.0, 10)
+        assert_same_ranking(index.search(query, 0.0, 10, nprobe=index.nlist), expected)
+
+
+def test_centroids_round_trip(tmp_path, clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    index = build_index(face_ids, vectors)
+    path = str(tmp_path / 'ivf' / 'centroids.npy')
+    index.save_centroids(path)
+    assert os.listdir(os.path.dirname(path)) == ['centroids.npy']
+
+    loaded = IVFIndex.from_centroids_file(path, nprobe=3)
+    assert loaded.trained and len(loaded) == 0
+    assert np.array_equal(loaded.centroids, index.centroids)
+
+    # Same centroids give the same partitioning and the same results
+    loaded.add(face_ids, vectors)
+    assert loaded.list_sizes().tolist() == index.list_sizes().tolist()
+    assert loaded.search(vectors[9], 0.5, 10) == index.search(vectors[9], 0.5, 10)
+
+
+def test_untrained_index():
+    index = IVFIndex(dim=8)
+    assert not index.trained and len(index) == 0
+    assert index.search(np.ones(8), 0.0, 5) == []
+    with pytest.raises(RuntimeError):
+        index.add(['a'], np.ones((1, 8)))
@@ -0,0 +1,95 @@
+# tests/test_quantized_index.py
+import numpy as np
+import pytest
+
+from conftest import brute_force_top_k
+from quantized_index import QuantizedIndex
+from search_index import normalize_embeddings
+
+
+def build_index(vectors, mode, **kwargs):
+    index = QuantizedIndex(mode, dim=vectors.shape[1], initial_capacity=16, **kwargs)
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def recall(index, vectors, face_ids, queries, top_k, **search_kwargs):
+    hits = 0
+    for query in queries:
+        rows, _ = index.search(query, 0.0, top_k, **search_kwargs)
+        expected = {face_id for face_id, _ in brute_force_top_k(vectors, face_ids, query, 0.0, top_k)}
+        hits += len(expected & {face_ids[row] for row in rows})
+    return hits / (len(queries) * top_k)
+
+
+def full_vectors_of(vectors):
+    normalized = normalize_embeddings(vectors)
+    return lambda rows: normalized[rows]
+
+
+@pytest.mark.parametrize('mode,kwargs', [('sq8', {}), ('pq', {'pq_m': 8})])
+def test_full_rerank_matches_brute_force(clustered_embeddings, mode, kwargs):
+    face_ids, vectors = clustered_embeddings
+    index = build_index(vectors, mode, **kwargs)
+    assert len(index) == len(vectors)
+
+    # Re-ranking every row makes the search exact whatever the codes lose
+    for query in vectors[[0, 123, 456]]:
+        rows, scores = index.search(query, 0.6, 10, full_vectors=full_vectors_of(vectors),
+                                    rerank_factor=len(vectors))
+        expected = brute_force_top_k(vectors, face_ids, query, 0.6, 10)
+        assert [face_ids[row] for row in rows] == [face_id for face_id, _ in expected]
+        assert scores == pytest.approx([score for _, score in expected], abs=1e-5)
+
+
+@pytest.mark.parametrize('mode,kwargs,min_recall', [('sq8', {}, 0.95), ('pq', {'pq_m': 16}, 0.8)])
+def test_rerank_recall_against_brute_force(clustered_embeddings, rng, mode, kwargs, min_recall):
+    face_ids, vectors = clustered_embeddings
+    index = build_index(vectors, mode, **kwargs)
+    queries = vectors[rng.choice(len(vectors), 20, replace=False)] + 0.2 * rng.standard_normal((20, 64))
+
+    assert recall(index, vectors, face_ids, queries, 10,
+                  full_vectors=full_vectors_of(vectors), rerank_factor=5) >= min_recall
+
+
+def test_sq8_scores_approximate_exact_scores(clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    index = build_index(vectors, 'sq8')
+    rows, scores = index.search(vectors[7], 0.0, 20)
+
+    exact = (normalize_embeddings(vectors[rows]) @ normalize_embeddings(vectors[7])[0] + 1.0) / 2.0
+    assert scores == pytest.approx(exact, abs=0.01)
+    assert list(scores) == sorted(scores, reverse=True)
+    assert rows[0] == 7
+
+
+def test_chunked_scan_matches_single_chunk(clustered_embeddings):
+    _, vectors = clustered_embeddings
+    index = build_index(vectors, 'sq8')
+    whole = index.search(vectors[42], 0.5, 15)
+    chunked = index.search(vectors[42], 0.5, 15, chunk_rows=77)
+    assert whole[0].tolist() == chunked[0].tolist()
+    assert whole[1] == pytest.approx(chunked[1])
+
+
+def test_codes_are_compact(clustered_embeddings):
+    _, vectors = clustered_embeddings
+    assert build_index(vectors, 'sq8').memory_bytes() == len(vectors) * 64
+    assert build_index(vectors, 'pq', pq_m=8).memory_bytes() == len(vectors) * 8
+
+
+def test_training_resets_codes(clustered_embeddings):
+    _, vectors = clustered_embeddings
+    index = build_index(vectors, 'sq8')
+    index.train(vectors)
+    assert len(index) == 0
+    assert index.search(vectors[0], 0.0, 5)[0].size == 0
+
+
+def test_untrained_index_rejects_adds():
+    index = QuantizedIndex('sq8', dim=8)
+    with pytest.raises(RuntimeError):
+        index.add(np.ones((2, 8)))
+    with pytest.raises(ValueError):
+        QuantizedIndex('int4', dim=8)
@@ -0,0 +1,180 @@
+# tests/test_search_index.py
+import numpy as np
+import pytest
+
+from conftest import brute_force_top_k
+from filter_index import SearchFilter
+from search_index import (EmbeddingIndex, select_top_k, block_top_k, normalize_embeddings,
+                          merge_shard_results, trim_results)
+
+
+def build_index(face_ids, vectors, attributes=None):
+    index = EmbeddingIndex(dim=vectors.shape[1], initial_capacity=16)
+    index.add(face_ids, vectors, attributes)
+    return index
+
+
+def assert_same_ranking(results, expected):
+    assert [face_id for face_id, _ in results] == [face_id for face_id, _ in expected]
+    assert [score for _, score in results] == pytest.approx([score for _, score in expected], abs=1e-5)
+
+
+def test_normalize_embeddings_returns_unit_rows():
+    matrix = normalize_embeddings([[3.0, 4.0], [0.0, 0.0]])
+    assert matrix.dtype == np.float32
+    assert matrix[0] == pytest.approx([0.6, 0.8])
+    # Zero vectors stay zero instead of dividing by zero
+    assert matrix[1] == pytest.approx([0.0, 0.0])
+
+
+def test_select_top_k_orders_and_thresholds():
+    scores = np.array([0.2, 0.9, 0.5, 0.7, 0.95], dtype=np.float32)
+    assert select_top_k(scores, 0.6, 10).tolist() == [4, 1, 3]
+    assert select_top_k(scores, 0.0, 2).tolist() == [4, 1]
+    assert select_top_k(scores, 0.0, 0).size == 0
+
+
+def test_block_top_k_keeps_best_columns_per_row():
+    scores = np.array([[0.1, 0.8, 0.3, 0.9], [0.7, 0.2, 0.6, 0.1]])
+    keep = block_top_k(scores, 2)
+    assert [sorted(row) for row in keep.tolist()] == [[1, 3], [0, 2]]
+    assert block_top_k(scores, 10).shape == (2, 4)
+
+
+@pytest.mark.parametrize('threshold,top_k', [(0.0, 10), (0.6, 25), (0.75, 600), (0.99, 5)])
+def test_search_matches_brute_force(clustered_embeddings, rng, threshold, top_k):
+    face_ids, vectors = clustered_embeddings
+    index = build_index(face_ids, vectors)
+    for query in vectors[rng.choice(len(vectors), 5, replace=False)]:
+        expected = brute_force_top_k(vectors, face_ids, query, threshold, top_k)
+        assert_same_ranking(index.search(query, threshold, top_k), expected)
+
+
+def test_search_batch_matches_brute_force_across_blocks(clustered_embeddings, rng):
+    face_ids, vectors = clustered_embeddings
+    index = build_index(face_ids, vectors)
+    queries = vectors[rng.choice(len(vectors), 8, replace=False)] + 0.1 * rng.standard_normal((8, 64))
+
+    # A block size that does not divide the gallery exercises the partial last block
+    results = index.search_batch(queries, 0.55, 12, block_rows=97)
+    assert len(results) == len(queries)
+    for query, ranked in zip(queries, results):
+        assert_same_ranking(ranked, brute_force_top_k(vectors, face_ids, query, 0.55, 12))
+
+
+def test_filtered_search_matches_brute_force_on_subset(clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    attributes = [
+        {'file_id': i % 7, 'quality_score': (i % 10) / 10.0, 'gender': ('male', 'female')[i % 2]}
+        for i in range(len(face_ids))
+    ]
+    index = build_index(face_ids, vectors, attributes)
+    search_filter = SearchFilter(file_ids=[1, 3], min_quality=0.3, genders=['female'])
+
+    subset = [i for i, attrs in enumerate(attributes)
+              if attrs['file_id'] in (1, 3) and attrs['quality_score'] >= 0.3 and attrs['gender'] == 'female']
+    query = vectors[subset[0]]
+    expected = brute_force_top_k(vectors[subset], [face_ids[i] for i in subset], query, 0.0, 15)
+
+    assert_same_ranking(index.search(query, 0.0, 15, search_filter=search_filter), expected)
+    assert_same_ranking(index.search_batch([query], 0.0, 15, search_filter=search_filter)[0], expected)
+
+
+def test_add_replaces_existing_face(clustered_embeddings):
+    face_ids, vectors = clustered_embeddings
+    index = build_index(face_ids, vectors)
+
+    index.add([face_ids[0]], vectors[1:2])
+    assert len(index) == len(face_ids)
+    assert index.get_embedding(face_ids[0]) == pytest.approx(normalize_embeddings(vectors[1])[0])
+    top = index.search(vectors[1], 0.0, 2)
+    assert {face_id for face_id, _ in top} == {face_ids[0], face_ids[1]}
+
+
+def test_remove_keeps_remaining_faces_searchable(clustered_embeddings, rng):
+    face_ids, vectors = clustered_embeddings
+    attributes = [{'file_id': i % 5} for i in range(len(face_ids))]
+    index = build_index(face_ids, vectors, attributes)
+
+    removed = set(rng.choice(len(face_ids), 150, replace=False).tolist())
+    assert index.remove([face_ids[i] for i in removed] + ['missing']) == len(removed)
+    assert len(index) == len(face_ids) - len(removed)
+    assert all(face_ids[i] not in index for i in removed)
+
+    kept = [i for i in range(len(face_ids)) if i not in removed]
+    kept_ids = [face_ids[i] for i in kept]
+    query = vectors[kept[0]]
+    assert_same_ranking(index.search(query, 0.0, 20), brute_force_top_k(vectors[kept], kept_ids, query, 0.0, 20))
+
+    # Rows moved into the gaps keep their attributes
+    search_filter = SearchFilter(file_ids=[2])
+    in_file = [i for i in kept if i % 5 == 2]
+    expected = brute_force_top_k(vectors[in_file], [face_ids[i] for i in in_file], query, 0.0, 20)
+    assert_same_ranking(index.search(query, 0.0, 20, search_filter=search_filter), expected)
+
+
+def test_empty_index_returns_no_results():
+    index = EmbeddingIndex(dim=8)
+    assert index.search(np.ones(8), 0.0, 5) == []
+    assert index.search_batch(np.ones((3, 8)), 0.0, 5) == [[], [], []]
+
+
+def test_add_rejects_wrong_dimension():
+    index = EmbeddingIndex(dim=8)
+    with pytest.raises(ValueError):
+        index.add(['a'], np.ones((1, 4)))
+
+
+def test_merged_shard_results_match_single_index(clustered_embeddings, rng):
+    face_ids, vectors = clustered_embeddings
+    num_shards = 4
+    queries = vectors[rng.choice(len(vectors), 5, replace=False)]
+
+    shard_results = []
+    for shard_id in range(num_shards):
+        members = list(range(shard_id, len(face_ids), num_shards))
+        shard = build_index([face_ids[i] for i in members], vectors[members])
+        ranked = shard.search_batch(queries, 0.6, 10)
+        # Shard results arrive as JSON, so hits are lists rather than tuples
+        shard_results.append({'shard_id': shard_id,
+                              'results': [[[face_id, score] for face_id, score in hits] for hits in ranked]})
+
+    merged = merge_shard_results(shard_results, 10)
+    assert len(merged) == len(queries)
+    for query, hits in zip(queries, merged):
+        assert_same_ranking(hits, brute_force_top_k(vectors, face_ids, query, 0.6, 10))
+
+
+def test_merge_shard_results_trims_to_top_k():
+    shard_results = [
+        {'results': [[['a', 0.9], ['b', 0.7]], []]},
+        {'results': [[['c', 0.95], ['d', 0.65]], [['e', 0.8]]]},
+    ]
+    merged = merge_shard_results(shard_results, 3)
+    assert [[face_id for face_id, _ in hits] for hits in merged] == [['c', 'a', 'b'], ['e']]
+    assert merge_shard_results([], 3) == []
+
+
+def test_deep_shard_lists_trim_to_the_request(clustered_embeddings, rng):
+    face_ids, vectors = clustered_embeddings
+    queries = vectors[rng.choice(len(vectors), 4, replace=False)]
+    # Shards rank deeper than the request so the merged lists can fill the candidate cache
+    deep_threshold, deep_top_k, threshold, top_k = 0.3, 60, 0.7, 5
+
+    shard_results = []
+    for shard_id in range(3):
+        members = list(range(shard_id, len(face_ids), 3))
+        shard = build_index([face_ids[i] for i in members], vectors[members])
+        ranked = shard.search_batch(queries, deep_threshold, deep_top_k)
+        shard_results.append({'shard_id': shard_id, 'results': ranked})
+
+        # The partial result a shard streams holds only what the request asked for
+        partial = trim_results(ranked, threshold, top_k)
+        for hits, deep in zip(partial, ranked):
+            assert len(hits) <= top_k
+            assert all(score >= threshold for _, score in hits)
+            assert hits == [hit for hit in deep if hit[1] >= threshold][:top_k]
+
+    merged = trim_results(merge_shard_results(shard_results, deep_top_k), threshold, top_k)
+    for query, hits in zip(queries, merged):
+        assert_same_ranking(hits, brute_force_top_k(vectors, face_ids, query, threshold, top_k))
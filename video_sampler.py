@@ -0,0 +1,310 @@
+# video_sampler.py
+"""
+Frame sampling for video face extraction without decoding skipped frames
+
+    python video_sampler.py VIDEO [--interval 30] [--sample-fps 1]
+
+benchmarks the legacy read-every-frame loop against grab() skipping and
+keyframe seeking on a real video and prints frames/second for each.
+"""
+import os
+import cv2
+import time
+import argparse
+import logging
+import numpy as np
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Sample this many frames per second of video instead of every frame_interval-th (0 = off)
+VIDEO_SAMPLE_FPS = float(os.getenv('VIDEO_SAMPLE_FPS', 0))
+# Seek (decoding from the previous keyframe) instead of grabbing when the gap is at least this many frames (0 = never)
+VIDEO_SEEK_MIN_INTERVAL = int(os.getenv('VIDEO_SEEK_MIN_INTERVAL', 300))
+
+# Motion gating: skip face detection on sampled frames where nothing changed
+VIDEO_MOTION_GATING = os.getenv('VIDEO_MOTION_GATING', 'false').lower() == 'true'
+VIDEO_MOTION_THRESHOLD = float(os.getenv('VIDEO_MOTION_THRESHOLD', 0.01))  # fraction of thumbnail pixels that changed
+VIDEO_MOTION_PIXEL_DELTA = int(os.getenv('VIDEO_MOTION_PIXEL_DELTA', 25))  # gray-level change counted as motion
+VIDEO_SCENE_CHANGE_THRESHOLD = float(os.getenv('VIDEO_SCENE_CHANGE_THRESHOLD', 0.3))  # histogram distance of a cut
+VIDEO_MOTION_MAX_SKIP_SECONDS = float(os.getenv('VIDEO_MOTION_MAX_SKIP_SECONDS', 10))
+
+# Split videos longer than this into segments processed in parallel (0 = never split)
+VIDEO_SEGMENT_SECONDS = float(os.getenv('VIDEO_SEGMENT_SECONDS', 300))
+
+
+class FrameSampler:
+    """
+    Yield sampled frames of a video, paying decode cost only where needed
+
+    Frames between samples are skipped with cap.grab(), which demuxes and
+    decodes but skips the retrieve() step (pixel format conversion and copy
+    into a BGR array). When the gap to the next sample is at least
+    seek_min_interval frames, the sampler seeks instead: the backend jumps to
+    the keyframe before the target and decodes forward from there, so whole
+    GOPs are never touched. Backends that cannot seek accurately fall back to
+    grabbing after the first failed seek.
+
+    Samples lie on one grid over the whole video, so samplers over adjacent
+    [start_frame, end_frame) segments together yield exactly the frames a
+    single sampler would. A segment always seeks to its first sample.
+    """
+
+    def __init__(self, cap: cv2.VideoCapture, frame_interval: int = 30, sample_fps: float = None,
+                 seek_min_interval: int = None, start_frame: int = 0, end_frame: int = None):
+        """
+        Create a sampler over an opened capture
+
+        Args:
+            cap: Opened cv2.VideoCapture positioned at the first frame
+            frame_interval: Sample every nth frame (used when sample_fps is not set)
+            sample_fps: Sample this many frames per second of video instead
+            seek_min_interval: Seek when the gap to the next sample is at least
+                this many frames (defaults to VIDEO_SEEK_MIN_INTERVAL, 0 = never)
+            start_frame: First frame of the segment to sample
+            end_frame: Frame the segment ends before (None = end of video)
+        """
+        self.cap = cap
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_interval = max(1, int(frame_interval or 1))
+        self.sample_fps = sample_fps if sample_fps and self.fps > 0 else None
+        self.seek_min_interval = VIDEO_SEEK_MIN_INTERVAL if seek_min_interval is None else seek_min_interval
+        self.start_frame = max(0, int(start_frame or 0))
+        self.end_frame = end_frame
+        self.stats = {'sampled': 0, 'grabbed': 0, 'seeks': 0, 'seek_failures': 0}
+
+    def _target(self, sample_no: int) -> int:
+        """Frame number of the nth sample"""
+        if self.sample_fps:
+            return int(round(sample_no * self.fps / self.sample_fps))
+        return sample_no * self.frame_interval
+
+    def _seek(self, target: int) -> bool:
+        """Seek to a frame, returning False (and disabling seeking) if the backend lands elsewhere"""
+        if not self.cap.set(cv2.CAP_PROP_POS_FRAMES, target) or \
+                int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) != target:
+            self.stats['seek_failures'] += 1
+            self.seek_min_interval = 0
+            logger.warning("Accurate seeking not supported by this video backend; grabbing frames instead")
+            return False
+        self.stats['seeks'] += 1
+        return True
+
+    def __iter__(self) -> Iterator[Tuple[int, float, np.ndarray]]:
+        """
+        Yields:
+            (frame_number, timestamp_seconds, frame) for every sampled frame
+        """
+        position = 0
+        sample_no = 0
+        while self._target(sample_no) < self.start_frame:
+            sample_no += 1
+        while True:
+            target = self._target(sample_no)
+            sample_no += 1
+            if target < position:
+                # Several samples map to one frame at high sample_fps
+                continue
+            if self.total_frames > 0 and target >= self.total_frames:
+                return
+            if self.end_frame is not None and target >= self.end_frame:
+                return
+
+            gap = target - position
+            jump = position == 0 and self.start_frame > 0
+            if gap > 0 and (jump or self.seek_min_interval and gap >= self.seek_min_interval):
+                if self._seek(target):
+                    position = target
+                else:
+                    # Seek failed; the capture may be anywhere, so re-sync from its position
+                    position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+            while position < target:
+                if not self.cap.grab():
+                    return
+                position += 1
+                self.stats['grabbed'] += 1
+
+            ret, frame = self.cap.read()
+            if not ret:
+                return
+            position += 1
+            self.stats['sampled'] += 1
+
+            if self.fps > 0:
+                timestamp = target / self.fps
+            else:
+                timestamp = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            yield target, timestamp, frame
+
+
+class MotionGate:
+    """
+    Decide whether a sampled frame is worth running face detection on
+
+    Each frame is reduced to a small grayscale thumbnail and compared with the
+    thumbnail of the last frame that was processed (not the previous sample,
+    so slow changes still add up):
+      - motion score: fraction of thumbnail pixels whose gray level moved by
+        more than pixel_delta
+      - scene-change score: total variation distance between the 32-bin gray
+        histograms, which catches cuts and lighting changes
+    A frame is processed when either score reaches its threshold, or when
+    max_skip_seconds have passed since the last processed frame.
+    """
+
+    def __init__(self, motion_threshold: float = None, scene_threshold: float = None,
+                 pixel_delta: int = None, max_skip_seconds: float = None,
+                 thumbnail_size: Tuple[int, int] = (64, 36)):
+        """
+        Create a gate
+
+        Args:
+            motion_threshold: Changed-pixel fraction that counts as motion (defaults to VIDEO_MOTION_THRESHOLD)
+            scene_threshold: Histogram distance (0-1) that counts as a scene change
+                (defaults to VIDEO_SCENE_CHANGE_THRESHOLD)
+            pixel_delta: Gray-level difference counted as a changed pixel (defaults to VIDEO_MOTION_PIXEL_DELTA)
+            max_skip_seconds: Always process a frame after this long (defaults to VIDEO_MOTION_MAX_SKIP_SECONDS)
+            thumbnail_size: (width, height) frames are compared at
+        """
+        self.motion_threshold = VIDEO_MOTION_THRESHOLD if motion_threshold is None else motion_threshold
+        self.scene_threshold = VIDEO_SCENE_CHANGE_THRESHOLD if scene_threshold is None else scene_threshold
+        self.pixel_delta = VIDEO_MOTION_PIXEL_DELTA if pixel_delta is None else pixel_delta
+        self.max_skip_seconds = VIDEO_MOTION_MAX_SKIP_SECONDS if max_skip_seconds is None else max_skip_seconds
+        self.thumbnail_size = thumbnail_size
+        self._reference = None
+        self._reference_hist = None
+        self._reference_time = None
+        self.stats = {'evaluated': 0, 'processed': 0, 'skipped': 0,
+                      'first': 0, 'motion': 0, 'scene_change': 0, 'max_skip': 0}
+
+    def _thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        small = cv2.resize(frame, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def scores(self, thumbnail: np.ndarray, hist: np.ndarray) -> Tuple[float, float]:
+        """(motion, scene-change) scores of a thumbnail against the reference"""
+        diff = np.abs(thumbnail.astype(np.int16) - self._reference.astype(np.int16))
+        motion = float(np.count_nonzero(diff > self.pixel_delta)) / diff.size
+        scene_change = 0.5 * float(np.abs(hist - self._reference_hist).sum())
+        return motion, scene_change
+
+    def should_process(self, frame: np.ndarray, timestamp: float) -> bool:
+        """
+        Check a sampled frame; a processed frame becomes the new reference
+
+        Args:
+            frame: BGR frame
+            timestamp: Frame time in seconds
+
+        Returns:
+            True if face detection should run on this frame
+        """
+        self.stats['evaluated'] += 1
+        thumbnail = self._thumbnail(frame)
+        hist = np.bincount((thumbnail >> 3).ravel(), minlength=32).astype(np.float32) / thumbnail.size
+
+        if self._reference is None:
+            reason = 'first'
+        elif timestamp - self._reference_time >= self.max_skip_seconds:
+            reason = 'max_skip'
+        else:
+            motion, scene_change = self.scores(thumbnail, hist)
+            if scene_change >= self.scene_threshold:
+                reason = 'scene_change'
+            elif motion >= self.motion_threshold:
+                reason = 'motion'
+            else:
+                self.stats['skipped'] += 1
+                return False
+
+        self.stats[reason] += 1
+        self.stats['processed'] += 1
+        self._reference = thumbnail
+        self._reference_hist = hist
+        self._reference_time = timestamp
+        return True
+
+
+def plan_segments(video_path: str, segment_seconds: float = None) -> Tuple[float, int, List[Tuple[int, Optional[int]]]]:
+    """
+    Split a video into [start_frame, end_frame) segments of about segment_seconds
+
+    The last segment runs to the end of the video (end_frame None). Videos
+    shorter than two segments, or whose frame rate or length is unknown, are
+    returned as one segment.
+
+    Args:
+        video_path: Path to video file
+        segment_seconds: Segment length (defaults to VIDEO_SEGMENT_SECONDS, 0 = never split)
+
+    Returns:
+        (fps, total_frames, segments)
+    """
+    segment_seconds = VIDEO_SEGMENT_SECONDS if segment_seconds is None else segment_seconds
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    segment_frames = int(round(segment_seconds * fps))
+    if segment_frames <= 0 or total_frames < 2 * segment_frames:
+        return fps, total_frames, [(0, None)]
+    starts = list(range(0, total_frames, segment_frames))
+    if total_frames - starts[-1] < segment_frames // 2:
+        # Fold a short tail into the previous segment
+        starts.pop()
+    return fps, total_frames, [(start, end) for start, end in zip(starts, starts[1:] + [None])]
+
+
+def benchmark(video_path: str, frame_interval: int = 30, sample_fps: float = None) -> dict:
+    """
+    Time the legacy read-every-frame loop against grab() skipping and seeking
+
+    Returns:
+        {'legacy'|'grab'|'seek': {'seconds', 'sampled', 'video_frames_per_second'}}
+    """
+    results = {}
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    legacy_interval = max(1, int(round(fps / sample_fps))) if sample_fps and fps else frame_interval
+    start = time.perf_counter()
+    frame_count = sampled = 0
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if frame_count % legacy_interval == 0:
+            sampled += 1
+        frame_count += 1
+    cap.release()
+    seconds = time.perf_counter() - start
+    results['legacy'] = {'seconds': seconds, 'sampled': sampled,
+                         'video_frames_per_second': frame_count / seconds if seconds else 0.0}
+
+    for mode, seek_min_interval in (('grab', 0), ('seek', 1)):
+        cap = cv2.VideoCapture(video_path)
+        sampler = FrameSampler(cap, frame_interval, sample_fps, seek_min_interval=seek_min_interval)
+        start = time.perf_counter()
+        sum(1 for _ in sampler)
+        seconds = time.perf_counter() - start
+        cap.release()
+        results[mode] = dict(sampler.stats, seconds=seconds,
+                             video_frames_per_second=frame_count / seconds if seconds else 0.0)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark video frame sampling strategies')
+    parser.add_argument('video', help='Video file')
+    parser.add_argument('--interval', type=int, default=30, help='Sample every nth frame')
+    parser.add_argument('--sample-fps', type=float, default=None, help='Sample N frames per second instead')
+    args = parser.parse_args()
+
+    for mode, result in benchmark(args.video, args.interval, args.sample_fps).items():
+        print(f"{mode:<7} {result['seconds']:8.2f}s  {result['sampled']:6d} frames sampled  "
+              f"{result['video_frames_per_second']:9.1f} video frames/s")